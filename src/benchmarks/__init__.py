@@ -0,0 +1,9 @@
+'''
+Benchmarks of the DNS server, run them from the src folder:
+
+python3 -m benchmarks.micro                  parsing and answear building
+python3 -m benchmarks.fake_upstream          local upstream server for the forwarding path
+python3 -m benchmarks.load                   UDP load against a running server
+
+Every benchmark can write its results as JSON with --output, so runs can be compared
+'''
@@ -0,0 +1,101 @@
+import struct
+import random
+import asyncio
+import argparse
+from dns_wire import question_end
+
+class FakeUpstreamProtocol(asyncio.DatagramProtocol):
+    '''
+    Answers every query with one A record after an optional delay,
+    standing in for the upstream server without any network access
+    '''
+
+    def __init__(
+            self,
+            address: str,
+            ttl: int,
+            delay: float,
+            jitter: float,
+            response_code: int,
+            slow_fraction: float = 0.0,
+            slow_delay: float = 0.0
+    ):
+        self.rdata = bytes(int(part) for part in address.split('.'))
+        self.ttl = ttl
+        self.delay = delay
+        self.jitter = jitter
+        self.response_code = response_code
+        self.slow_fraction = slow_fraction
+        self.slow_delay = slow_delay
+        self.transport = None
+        self.answered = 0
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address: tuple[str, int]):
+        try:
+            response = self.build_response(data)
+        except (IndexError, struct.error):
+            return
+
+        delay = self.delay + random.uniform(0, self.jitter)
+        if random.random() < self.slow_fraction:
+            delay += self.slow_delay
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.transport.sendto, response, address)
+        else:
+            self.transport.sendto(response, address)
+        self.answered += 1
+
+    def build_response(self, query: bytes) -> bytes:
+        '''
+        Builds the response with the ID and question of the query
+        '''
+        end = question_end(query)
+        # QR and RA set, OPCODE and RD copied from the query
+        flags = 0b1000000010000000 | (query[2] & 0b01111001) << 8 | self.response_code
+
+        header = query[:2] + struct.pack('!HHHHH', flags, 1, 0 if self.response_code else 1, 0, 0)
+        answear = b'' if self.response_code else b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, self.ttl, 4) + self.rdata
+
+        return header + query[12:end] + answear
+
+async def run(host: str, port: int, protocol: FakeUpstreamProtocol):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: protocol, local_addr=(host, port))
+
+    try:
+        await loop.create_future()
+    finally:
+        transport.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the upstream server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5354)
+    parser.add_argument("--address", default="192.0.2.1", help="IPv4 address of the A record in every answear")
+    parser.add_argument("--ttl", type=int, default=300)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra delay up to this many seconds")
+    parser.add_argument("--rcode", type=int, default=0, help="response code of every answear")
+    parser.add_argument("--slow-fraction", type=float, default=0.0, help="fraction of the answears delayed by --slow-delay more seconds")
+    parser.add_argument("--slow-delay", type=float, default=0.0)
+    arguments = parser.parse_args()
+
+    protocol = FakeUpstreamProtocol(
+        arguments.address,
+        arguments.ttl,
+        arguments.delay,
+        arguments.jitter,
+        arguments.rcode,
+        arguments.slow_fraction,
+        arguments.slow_delay
+    )
+    try:
+        asyncio.run(run(arguments.host, arguments.port, protocol))
+    except KeyboardInterrupt:
+        print(f"Answered {protocol.answered} queries")
+
+if __name__ == "__main__":
+    main()
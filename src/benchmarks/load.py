@@ -0,0 +1,156 @@
+import time
+import random
+import asyncio
+import argparse
+from benchmarks.queries import build_query, parse_qtype
+from benchmarks.report import write_results, percentile
+
+class LoadProtocol(asyncio.DatagramProtocol):
+    '''
+    Keeps a fixed number of queries outstanding against the server and
+    records the latency of every answer, queries without an answer after
+    the timeout are counted as lost and replaced by new ones
+    '''
+
+    def __init__(self, queries: list[bytes], concurrency: int, duration: float, timeout: float):
+        self.queries = queries
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.transport = None
+
+        self.next_id = 0
+        self.next_query = 0
+        # query ID -> time it was sent
+        self.pending: dict[int, float] = {}
+
+        self.sent = 0
+        self.lost = 0
+        self.latencies: list[float] = []
+
+        self.started = None
+        self.deadline = None
+        self.duration = duration
+        self.done = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+        self.started = time.perf_counter()
+        self.deadline = self.started + self.duration
+
+        for _ in range(self.concurrency):
+            self.__send()
+        self.__sweep()
+
+    def datagram_received(self, data: bytes, address: tuple[str, int]):
+        sent_at = self.pending.pop(int.from_bytes(data[:2], byteorder='big'), None)
+        if sent_at is None:
+            return
+
+        now = time.perf_counter()
+        self.latencies.append(now - sent_at)
+
+        if now < self.deadline:
+            self.__send()
+        elif not self.pending and not self.done.done():
+            self.done.set_result(now)
+
+    def __send(self):
+        query_id = self.next_id
+        while query_id in self.pending:
+            query_id = (query_id + 1) % 65536
+        self.next_id = (query_id + 1) % 65536
+
+        query = self.queries[self.next_query]
+        self.next_query = (self.next_query + 1) % len(self.queries)
+
+        self.pending[query_id] = time.perf_counter()
+        self.transport.sendto(query_id.to_bytes(2, byteorder='big') + query[2:])
+        self.sent += 1
+
+    def __sweep(self):
+        '''
+        Counts the timed out queries as lost and replaces them
+        '''
+        now = time.perf_counter()
+
+        for query_id, sent_at in list(self.pending.items()):
+            if now - sent_at > self.timeout:
+                del self.pending[query_id]
+                self.lost += 1
+                if now < self.deadline:
+                    self.__send()
+
+        if now >= self.deadline and not self.pending:
+            if not self.done.done():
+                self.done.set_result(now)
+            return
+
+        asyncio.get_running_loop().call_later(0.1, self.__sweep)
+
+def build_queries(arguments: argparse.Namespace) -> list[bytes]:
+    '''
+    Builds the queries sent in turn, with random subdomains every query
+    asks for a different name so nothing can be answered from a cache
+    '''
+    names = arguments.names.split(',')
+    qtype = parse_qtype(arguments.qtype)
+
+    if arguments.random_subdomains:
+        names = [f"{random.getrandbits(48):012x}.{name}" for _ in range(arguments.random_subdomains) for name in names]
+
+    return [build_query(name, qtype, not arguments.no_recursion) for name in names]
+
+async def run(arguments: argparse.Namespace) -> dict:
+    loop = asyncio.get_running_loop()
+
+    protocol = LoadProtocol(build_queries(arguments), arguments.concurrency, arguments.duration, arguments.timeout)
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: protocol,
+        remote_addr=(arguments.host, arguments.port)
+    )
+
+    try:
+        finished = await protocol.done
+    finally:
+        transport.close()
+
+    latencies = sorted(protocol.latencies)
+    elapsed = finished - protocol.started
+
+    def milliseconds(value: float | None) -> float | None:
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "sent": protocol.sent,
+        "answered": len(latencies),
+        "lost": protocol.lost,
+        "seconds": round(elapsed, 3),
+        "qps": round(len(latencies) / elapsed),
+        "latency_ms": {
+            "mean": milliseconds(sum(latencies) / len(latencies) if latencies else None),
+            "p50": milliseconds(percentile(latencies, 0.5)),
+            "p99": milliseconds(percentile(latencies, 0.99)),
+            "p999": milliseconds(percentile(latencies, 0.999)),
+            "max": milliseconds(latencies[-1] if latencies else None)
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP load generator measuring the QPS and latency of a running server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5353)
+    parser.add_argument("--names", default="example.com,www.example.com", help="comma separated names the queries ask for")
+    parser.add_argument("--qtype", default="A")
+    parser.add_argument("--random-subdomains", type=int, default=0, help="ask for this many random subdomains of every name")
+    parser.add_argument("--no-recursion", action="store_true", help="send the queries without the RD flag")
+    parser.add_argument("--concurrency", type=int, default=64, help="number of outstanding queries")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to send queries for")
+    parser.add_argument("--timeout", type=float, default=2.0, help="seconds after which a query is lost")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    arguments = parser.parse_args()
+
+    results = asyncio.run(run(arguments))
+    write_results("load", vars(arguments), results, arguments.output)
+
+if __name__ == "__main__":
+    main()
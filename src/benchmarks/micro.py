@@ -0,0 +1,94 @@
+import timeit
+import argparse
+from typing import Callable
+from dns_header import DNSHeader
+from dns_question import DNSQuestion
+from dns_packet import DNSPacket
+from dns_answear import DNSAnswear
+from dns_cache import DNSCache
+from dns_templates import DNSResponseTemplates
+from dns_metrics import DNSMetrics
+from dns_enums import DNSQuestionType
+from benchmarks.queries import build_query
+from benchmarks.report import write_results
+
+# the record types answered from the zones
+RECORD_TYPES = [
+    DNSQuestionType.A,
+    DNSQuestionType.NS,
+    DNSQuestionType.CNAME,
+    DNSQuestionType.SOA,
+    DNSQuestionType.MX,
+    DNSQuestionType.TXT
+]
+
+def measure(function: Callable[[], object], repeat: int) -> dict[str, float]:
+    '''
+    Runs the function in batches big enough to last at least 0.2 seconds
+    and returns the time of one call from the fastest batch
+    '''
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat, number)) / number
+
+    return {
+        "ns_per_op": round(best * 1e9, 1),
+        "ops_per_second": round(1 / best)
+    }
+
+def build_benchmarks(domain: str, alias: str) -> dict[str, Callable[[], object]]:
+    '''
+    Returns the benchmarked functions by name
+    '''
+    query = build_query(domain, DNSQuestionType.A, recursion_desired=False)
+
+    benchmarks = {
+        "parse.header": lambda: DNSHeader(query),
+        "parse.question": lambda: DNSQuestion(query).domain,
+        "parse.packet": lambda: DNSPacket(query)
+    }
+
+    for qtype in RECORD_TYPES:
+        name = alias if qtype == DNSQuestionType.CNAME else domain
+        qtype_query = build_query(name, qtype, recursion_desired=False)
+        benchmarks[f"build_response.{qtype}"] = lambda qtype_query=qtype_query: DNSPacket(qtype_query).build_response()
+
+    missing_query = build_query(f"missing.{domain}", DNSQuestionType.A, recursion_desired=False)
+    benchmarks["build_response.NAME_ERROR"] = lambda: DNSPacket(missing_query).build_response()
+
+    metrics = DNSMetrics()
+    benchmarks["build_response.A.metrics"] = lambda: DNSPacket(query).build_response(metrics)
+
+    response, response_code = DNSPacket(query).build_response()
+
+    templates = DNSResponseTemplates(1)
+    templates.put(query, response, response_code)
+    benchmarks["response_template.hit"] = lambda: templates.get(query)
+
+    cache = DNSCache(1, len(response))
+    cache.put(query, response)
+    benchmarks["cache.hit"] = lambda: cache.get(query)
+
+    return benchmarks
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of parsing and answear building")
+    parser.add_argument("--domain", default="example.com", help="domain from the zones the queries ask for")
+    parser.add_argument("--alias", default="alias.example.com", help="domain with a CNAME record from the zones")
+    parser.add_argument("--repeat", type=int, default=5, help="number of measured batches of each benchmark")
+    parser.add_argument("--filter", default="", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    arguments = parser.parse_args()
+
+    DNSAnswear.load_zones()
+
+    results = {
+        name: measure(function, arguments.repeat)
+        for name, function in build_benchmarks(arguments.domain, arguments.alias).items()
+        if arguments.filter in name
+    }
+
+    write_results("micro", vars(arguments), results, arguments.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+import struct
+from dns_enums import DNSQuestionType
+
+def build_query(domain: str, qtype: DNSQuestionType | int = DNSQuestionType.A, recursion_desired: bool = True, query_id: int = 0) -> bytes:
+    '''
+    Builds the bytes of a query with one question of IN class
+    '''
+    qtype = qtype.value if isinstance(qtype, DNSQuestionType) else qtype
+    flags = 0b0000000100000000 if recursion_desired else 0
+
+    header = struct.pack('!HHHHHH', query_id, flags, 1, 0, 0, 0)
+    labels = b''.join(
+        len(part).to_bytes(1, byteorder='big') + part
+        for part in domain.encode('utf-8').split(b'.')
+        if part
+    )
+
+    return header + labels + b'\x00' + struct.pack('!HH', qtype, 1)
+
+def parse_qtype(qtype: str) -> DNSQuestionType:
+    return DNSQuestionType[qtype.upper()]
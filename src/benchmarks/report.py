@@ -0,0 +1,49 @@
+import sys
+import json
+import platform
+import subprocess
+from datetime import datetime
+
+def git_revision() -> str | None:
+    '''
+    Returns the commit of the benchmarked tree or None if it is not known
+    '''
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+def write_results(benchmark: str, parameters: dict, results: dict, output: str | None):
+    '''
+    Prints the results and writes them as JSON to output if it is given,
+    together with what is needed to compare them with other runs
+    '''
+    report = {
+        "benchmark": benchmark,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "results": results
+    }
+
+    print(json.dumps(results, indent=2))
+
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+
+def percentile(sorted_values: list[float], fraction: float) -> float | None:
+    '''
+    Returns the value under which the fraction of the sorted values are
+    '''
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
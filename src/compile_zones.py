@@ -0,0 +1,39 @@
+import glob
+import time
+import argparse
+from dns_zone import DNSZone
+from dns_zone_image import write_zone_image
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compiles the zone files into one zone image, which the server maps in memory")
+    parser.add_argument(
+        "zone_files",
+        nargs="*",
+        default=["zones/*.zone"],
+        help="zone files, JSON or RFC 1035 master files, or glob patterns of them"
+    )
+    parser.add_argument(
+        "--output",
+        default="zones.img",
+        help="file the zone image is written to"
+    )
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    started = time.perf_counter()
+
+    zones = []
+    for pattern in arguments.zone_files:
+        for zone_file in sorted(glob.glob(pattern)):
+            zones.append(DNSZone.from_zone_file(zone_file))
+
+    write_zone_image(zones, arguments.output)
+
+    names_count = sum(len(zone.names) for zone in zones)
+    print(f"Compiled {len(zones)} zones with {names_count} names to {arguments.output} in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
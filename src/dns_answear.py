@@ -1,8 +1,12 @@
+import os
 import glob
+from datetime import datetime
 from dns_question import DNSQuestion
-import json
 from dns_enums import DNSQuestionType, DNSHeaderResponseCode
 from dns_errors import *
+from dns_zone import DNSZone
+from dns_zone_image import DNSMappedZone, is_zone_image, open_zone_image
+from dns_lazy_zone import DNSLazyZone, DNSParsedZones
 
 class DNSAnswear:
     '''
@@ -11,9 +15,31 @@ class DNSAnswear:
     It holds the zones files statically
     '''
 
-    # A dictionary with the zones where the key is the zone name
-    # and the value is the zone data
-    zones = None
+    # A dictionary with the zones where the key is the zone origin
+    # and the value is the zone compiled to wire format
+    zones: dict[str, DNSZone | DNSMappedZone | DNSLazyZone] | None = None
+
+    # the zone files, JSON zone files or zone images written by compile_zones.py
+    zones_path = "zones/*.zone"
+
+    # the LRU of the zones compiled on their first query, the .zone files
+    # are only compiled when they are queried if it is set
+    parsed_zones: DNSParsedZones | None = None
+
+    # zone file path -> (modification time and size of the file, its zones,
+    # which are none if the file was never loaded successfully)
+    zone_files: dict[str, tuple[tuple[int, int], tuple[DNSZone | DNSMappedZone | DNSLazyZone, ...]]] = {}
+
+    # incremented every time the zones change, anything built from
+    # the previous zones is stale once the generation changes
+    generation = 0
+
+    # the names which don't exist, normalized, with the zone answearing NAME_ERROR
+    # for them or None if they are in no zone, so repeated misses skip the lookup.
+    # They are kept until the zones change, the oldest is dropped past max_missing_names
+    missing_names: dict[str, DNSZone | DNSMappedZone | None] = {}
+    missing_names_generation = 0
+    max_missing_names = 65536
 
     def __init__(self, question: DNSQuestion):
         self.question = question
@@ -25,6 +51,17 @@ class DNSAnswear:
         Returns the response bytes or a DNSHeaderResponseCode if an error occurs
         '''
 
+        self.domain = DNSZone.normalize_name(self.question.domain)
+        self.answears_count = 0
+
+        if DNSAnswear.missing_names_generation != DNSAnswear.generation:
+            DNSAnswear.missing_names = {}
+            DNSAnswear.missing_names_generation = DNSAnswear.generation
+
+        if self.domain in DNSAnswear.missing_names:
+            self.zone = DNSAnswear.missing_names[self.domain]
+            return (DNSHeaderResponseCode.NAME_ERROR, 0)
+
         try:
             '''
             Find the zone for the question, if the zone is not found
@@ -32,246 +69,186 @@ class DNSAnswear:
             raise a DNSServerError
             '''
             self.zone = self.__find_zone()
-            answears = self.__format_anwser()
-            answears_count = 1 if self.question.qtype == DNSQuestionType.SOA else len(answears)
 
         except DNSNoDomainFoundError:
             self.zone = None
+            DNSAnswear.__add_missing_name(self.domain, None)
             return (DNSHeaderResponseCode.NAME_ERROR, 0)
         
         except DNSServerError:
             self.zone = None
             return (DNSHeaderResponseCode.SERVER_FAILURE, 0)
-        
-        '''
-        Encoding answeares to bytes and returning the result
-        if any error occurs return during the process, it means that we can't parse the data
-        so we return a DNSHeaderResponseCode.FORMAT_ERROR
-        '''
+
         try:
-            result = b''
+            '''
+            The answears are already encoded when the zones are loaded, if the
+            domain is not in the zone a DNSNoDomainFoundError is raised and if
+            they could not be encoded a DNSFormatError is raised
+            '''
+            answears, self.answears_count = self.zone.get_answears(self.domain, self.question.qtype)
+            return (answears, self.answears_count)
 
-            if self.question.qtype == DNSQuestionType.SOA:
-                result = self.__answear_as_bytes(answears)
-            else:
-                for answear in answears:
-                    result += self.__answear_as_bytes(answear)
+        except DNSNoDomainFoundError:
+            # the zone is kept for the authority section
+            DNSAnswear.__add_missing_name(self.domain, self.zone)
+            return (DNSHeaderResponseCode.NAME_ERROR, 0)
 
-        except Exception:
+        except DNSFormatError:
             self.zone = None
             return (DNSHeaderResponseCode.FORMAT_ERROR, 0)
-        
-        return (result, answears_count)
     
     def get_authority(self) -> bytes | None:
         '''
-        Builds the authority section of the response
+        Returns the authority section of the response
 
-        Returns the authority section as bytes or None if the question is SOA
+        Returns the authority section as bytes or None if the question is
+        outside the zones or if the answear is already the SOA record
         '''
-        
-        try:
-            # if the question is SOA we don't need the authority section
-            if self.question.qtype == DNSQuestionType.SOA:
-                return None
 
-            authority = self.__format_anwser(DNSQuestionType.SOA)
-            return self.__answear_as_bytes(authority, DNSQuestionType.SOA)
-        except Exception:
+        if self.zone is None:
             return None
 
-    def __answear_as_bytes(
-            self, 
-            info: tuple[str, int, str] | dict[str, str],
-            qtype: DNSQuestionType = None
-    ) -> bytes:
-        '''
-        Converts the answear to bytes
+        # if the answear is the SOA record we don't need the authority section
+        if self.question.qtype == DNSQuestionType.SOA and self.domain == self.zone.origin and self.answears_count > 0:
+            return None
 
-        The info tuple should have the following format:
-        (type, ttl, value)
+        return self.zone.get_authority(self.domain)
 
-        If qtype is not provided it will be taken from the question
+    def __find_zone(self) -> DNSZone | DNSMappedZone:
         '''
+        Find the zone for the question, which is the zone with the longest
+        origin the domain ends with
 
-        if qtype is None:
-            qtype = self.question.qtype
-
-        result_bytes = b''
-
-        info_type = info[0] if qtype != DNSQuestionType.SOA else None
-        if info_type and info_type != '@':
-            result_bytes = self.__encode_domain(info_type)
-        
-        '''
-        Pointer to the domain name which starts at the beginning of the message, after the header
-        https://datatracker.ietf.org/doc/html/rfc1035#section-4.1.4
+        Returns the zone data or throws DNSNoDomainFoundError if the zone is not found
+        and DNSServerError if a lazy zone can't be compiled
         '''
-        result_bytes += b'\xc0\x0c'
-
-        # adding the record type
-        result_bytes += qtype.value.to_bytes(2, byteorder='big')
 
-        result_bytes += b'\x00\x01' # IN class type
+        # the zones might be swapped while answering, so they are read only once
+        zones = DNSAnswear.zones
+        if zones is None:
+            raise DNSServerError("No zones found")
 
-        ttl = info[1] if qtype != DNSQuestionType.SOA else int(info["ttl"])
-        result_bytes += ttl.to_bytes(4, byteorder='big')  # TTL
+        # strip the labels one by one from the left until the rest is a zone origin
+        zone_name = self.domain
+        while zone_name not in zones:
+            if '.' not in zone_name:
+                raise DNSNoDomainFoundError(self.domain)
+            zone_name = zone_name.split('.', 1)[1]
+
+        zone = zones[zone_name]
+        if isinstance(zone, DNSLazyZone):
+            return zone.load()
+        return zone
+    
+    @staticmethod
+    def __add_missing_name(domain: str, zone: DNSZone | DNSMappedZone | None):
+        if DNSAnswear.max_missing_names <= 0:
+            return
 
-        value = info[2] if qtype != DNSQuestionType.SOA else None
+        missing_names = DNSAnswear.missing_names
+        if len(missing_names) >= DNSAnswear.max_missing_names:
+            del missing_names[next(iter(missing_names))]
+        missing_names[domain] = zone
 
+    @classmethod
+    def load_zones(cls) -> bool:
         '''
-        Adding the length of the value and the value itself encoded
+        Get the zones files(.zone) from the zone folder, compile
+        them to wire format and load them into the zones dictionary
 
-        RDLENGTH is the length of the RDATA field in octets
-        '''
-        if qtype == DNSQuestionType.A:
-            # for A record type the length is 4
-            result_bytes += b'\x00\x04'
-
-            # convert the IPv4 address to bytes
-            parts = value.split('.')
-            result_bytes += bytes([int(part) for part in parts])
-
-        elif qtype == DNSQuestionType.CNAME or qtype == DNSQuestionType.NS:
-            encoded_value = self.__encode_domain(value)
-            length = len(encoded_value)
-
-            # add the length of the encoded value
-            result_bytes += length.to_bytes(2, byteorder='big')
-            result_bytes += encoded_value
-
-        elif qtype == DNSQuestionType.TXT:
-            encoded_value = value.encode('utf-8')
-            length = len(encoded_value)
-
-            # total length of the value is the length of the value plus the length of the length byte
-            result_bytes += (length + 1).to_bytes(2, byteorder='big')
-            result_bytes += length.to_bytes(1, byteorder='big')
-            result_bytes += encoded_value
-
-        elif qtype == DNSQuestionType.MX:
-            preference, exchange = value.split()
-            encoded_value = self.__encode_domain(exchange)
-            length = len(encoded_value) + 2
-
-            # total length of the value is the length of the value plus the length of the length byte
-            result_bytes += length.to_bytes(2, byteorder='big')
-            result_bytes += int(preference).to_bytes(2, byteorder='big')
-            result_bytes += encoded_value
-
-        elif qtype == DNSQuestionType.SOA:
-
-            # extract the values from the info dictionary
-            mname = info["mname"]
-            rname = info["rname"]
-            serial = info["serial"]
-            refresh = info["refresh"]
-            retry = info["retry"]
-            expire = info["expire"]
-            minimum = info["minimum"]
-
-            local_bytes = b''
-
-            local_bytes += self.__encode_domain(mname) # primary name server
-            local_bytes += self.__encode_domain(rname) # responsible authority's mailbox
-            local_bytes += int(serial).to_bytes(4, byteorder='big') # Serial number
-            local_bytes += int(refresh).to_bytes(4, byteorder='big') # Refresh interval
-            local_bytes += int(retry).to_bytes(4, byteorder='big') # Retry interval
-            local_bytes += int(expire).to_bytes(4, byteorder='big') # Expire interval
-            local_bytes += int(minimum).to_bytes(4, byteorder='big') # Minimum TTL
-
-            # add the length of the local bytes to the result bytes
-            length = len(local_bytes)
-            result_bytes += length.to_bytes(2, byteorder='big')
-
-            result_bytes += local_bytes
-
-        return result_bytes
-    
-    def __encode_domain(self, domain: str) -> bytes:
+        It can be called again to reload the zones, only the files which
+        changed are compiled again. Returns True if any zone changed
         '''
-        Encodes the domain name into bytes
-        '''
-        result_bytes = b''
-        domain_parts = domain.split('.')
-        for part in domain_parts:
-            result_bytes += len(part).to_bytes(1, byteorder='big')
-            result_bytes += part.encode('utf-8')
-        return result_bytes
-    
-    def __format_anwser(self, qtype: DNSQuestionType = None) -> list[tuple[str, int, str]] | dict[str, str]:
-        '''
-        Getting the quried answears from the zone file and formatting them
-        as a dictionary of string-string for SOA queries and as a list of tuples with the following format:
-        (type, ttl, value) for any other query
+        return cls.swap_zones(cls.read_zone_files())
 
-        If qtype is not provided it will be taken from the question
+    @classmethod
+    def read_zone_files(cls) -> dict[str, tuple[tuple[int, int], tuple[DNSZone | DNSMappedZone | DNSLazyZone, ...]]]:
         '''
-        
-        # the zone file is a dictionary with the keys being the qtype as a lower case string
-        if qtype is None:
-            qtype = self.question.qtype.__str__().lower()
-        else:
-            qtype = qtype.__str__().lower()
-        if qtype not in self.zone:
-            raise DNSNoDomainFoundError(self.question.domain)
-        
-        # retrieve the values for the qtype
-        values = self.zone[qtype]
-        formatted_values = []
+        Compiles the zone files which are new or whose modification time or
+        size changed since they were last loaded, reusing the other zones
 
-        # if the qtype is SOA return the values as they are
-        if qtype == 'soa':
-            return values
-        
-        # format the values
-        for ans in values:
-            type = ans["name"]
-            ttl = ans["ttl"]
-            value = ans["value"]
-            formatted_values.append((type, ttl, value))
+        A zone file which can't be read or compiled keeps its previous
+        version, if it had one. This doesn't change the served zones and
+        can run outside of the thread answering the queries
 
-        return formatted_values
+        A zone image is mapped instead of being compiled and in the lazy
+        mode the .zone files are only compiled when they are queried
 
-    def __find_zone(self) -> dict[str, list[dict[str, str]]]:
+        Returns the zone files to pass to swap_zones
         '''
-        Find the zone for the question
+        # get all the zone files from the specified path
+        zone_files = {}
+
+        for zone_file in sorted(glob.glob(cls.zones_path)):
+            previous = cls.zone_files.get(zone_file)
+
+            try:
+                stat = os.stat(zone_file)
+            except OSError:
+                continue
+
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if previous is not None and previous[0] == stamp:
+                zone_files[zone_file] = previous
+                continue
+
+            try:
+                zones = cls.read_zone_file(zone_file)
+            except Exception as error:
+                # the new stamp avoids compiling the same broken file again
+                if previous is not None and previous[1]:
+                    zone_files[zone_file] = (stamp, previous[1])
+                    cls.__log(f"Failed to reload {zone_file}, keeping the previous version: {error}")
+                else:
+                    zone_files[zone_file] = (stamp, ())
+                    cls.__log(f"Failed to load {zone_file}: {error}")
+                continue
+
+            if previous is not None and len(previous[1]) == 1 and len(zones) == 1 and zones[0].serial is not None:
+                cls.__log(f"Reloaded {zone_file}, serial {previous[1][0].serial} -> {zones[0].serial}")
+            elif previous is not None:
+                cls.__log(f"Reloaded {zone_file} with {len(zones)} zones")
+            zone_files[zone_file] = (stamp, zones)
+
+        return zone_files
 
-        Returns the zone data or throws DNSNoDomainFoundError if the zone is not found
+    @classmethod
+    def read_zone_file(cls, zone_file: str) -> tuple[DNSZone | DNSMappedZone | DNSLazyZone, ...]:
         '''
+        Returns the zones of the file, mapping it if it is a zone image and compiling it otherwise
 
-        if DNSAnswear.zones is None:
-            raise DNSServerError("No zones found")
+        In the lazy mode a <origin>.zone file isn't even opened, its zone
+        is compiled on the first query for it
+        '''
+        if cls.parsed_zones is not None and zone_file.endswith('.zone'):
+            return (DNSLazyZone(zone_file, cls.parsed_zones),)
 
-        zone_name = self.question.domain
+        if is_zone_image(zone_file):
+            return tuple(open_zone_image(zone_file))
+
+        return (DNSZone.from_zone_file(zone_file),)
 
-        # if the zone name is not in the zones dictionary
-        # with the subdomain of the domain
-        # try to find the zone with the domain name
-        if zone_name not in DNSAnswear.zones:
-            zone_name = '.'.join(zone_name.split('.')[1:])
-        
-        try:
-            return DNSAnswear.zones[zone_name]
-        except KeyError:
-            raise DNSNoDomainFoundError(zone_name)
-    
     @classmethod
-    def load_zones(cls):
+    def swap_zones(cls, zone_files: dict[str, tuple[tuple[int, int], tuple[DNSZone | DNSMappedZone | DNSLazyZone, ...]]]) -> bool:
         '''
-        Get the zones files(.zone) from the zone folder
-        and load them into the zones dictionary
+        Replaces the served zones with the ones compiled by read_zone_files
+        in one assignment, so a query sees either all the old or all the new zones
+
+        Returns False without changing the zones if no zone changed
         '''
-        path = "zones/*.zone"
-        # get all the zone files from the specified path
-        zone_files = glob.glob(path)
+        changed = zone_files.keys() != cls.zone_files.keys() or\
+            any(zone_files[zone_file][1] is not cls.zone_files[zone_file][1] for zone_file in zone_files)
+
+        cls.zone_files = zone_files
+        if not changed:
+            return False
 
-        DNSAnswear.zones = {}
-        for zone_file in zone_files:
-            with open(zone_file) as file:
-                data = json.load(file)
-                zone_name = data["$origin"]
-                DNSAnswear.zones[zone_name] = data
+        zones = {zone.origin: zone for _, file_zones in zone_files.values() for zone in file_zones}
+        cls.zones = zones if zones else None
+        cls.generation += 1
+        return True
 
-        if len(DNSAnswear.zones) == 0:
-            DNSAnswear.zones = None
\ No newline at end of file
+    @staticmethod
+    def __log(message: str):
+        curent_date = datetime.strftime(datetime.now(), "%d-%m-%Y %H:%M:%S")
+        print(f"[{curent_date}] {message}", flush=True)
\ No newline at end of file
@@ -0,0 +1,220 @@
+import time
+import struct
+from collections import OrderedDict
+from dns_wire import OPT_TYPE, DNSRecordInfo, question_end, iter_records
+
+# the type of the SOA record, found in the authority section of the negative answears
+SOA_TYPE = 6
+
+class DNSCacheEntry:
+    '''
+    A cached upstream response together with the position of its TTL fields
+    '''
+
+    __slots__ = ('response', 'stored_at', 'expires_at', 'ttls', 'hits', 'prefetching')
+
+    def __init__(self, response: bytes, stored_at: float, ttl: int, ttls: list[tuple[int, int]]):
+        self.response = response
+        self.stored_at = stored_at
+        self.expires_at = stored_at + ttl
+
+        # (offset of the TTL field, original TTL) for every record
+        self.ttls = ttls
+
+        # the number of times the entry was answeared and whether
+        # it is already being queried again before it expires
+        self.hits = 0
+        self.prefetching = False
+
+class DNSCache:
+    '''
+    LRU cache for the responses of the forwarded queries
+
+    The key is the question (qname, qtype, qclass) in wire format with the
+    qname lower cased. An entry lives for the minimum TTL of its records and
+    the cache never holds more than max_entries entries or max_bytes bytes
+
+    The negative answears, NAME_ERROR or NO_ERROR without any answear, live
+    for the TTL of the SOA record in their authority section, which is at most
+    its MINIMUM field and max_negative_ttl. They are not cached without a SOA record
+    https://datatracker.ietf.org/doc/html/rfc2308#section-5
+
+    An expired entry is kept for stale_ttl more seconds, during which it can still
+    be answeared with get_stale if the upstream server doesn't answer (RFC 8767).
+    An entry answeared at least prefetch_hits times is due for a refresh from the
+    upstream server during the last PREFETCH_WINDOW of its TTL, before it expires
+    https://datatracker.ietf.org/doc/html/rfc8767
+    '''
+
+    # the TTL of the records of a stale answear
+    STALE_ANSWEAR_TTL = 30
+
+    # the part of the TTL of an entry before it expires in which it is refreshed
+    PREFETCH_WINDOW = 0.1
+
+    def __init__(
+            self,
+            max_entries: int,
+            max_bytes: int,
+            max_negative_ttl: int = 0,
+            stale_ttl: int = 0,
+            prefetch_hits: int = 0
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_negative_ttl = max_negative_ttl
+        self.stale_ttl = stale_ttl
+        self.prefetch_hits = prefetch_hits
+        self.size = 0
+        self.entries: OrderedDict[bytes, DNSCacheEntry] = OrderedDict()
+
+    def get(self, query: bytes) -> bytes | None:
+        '''
+        Returns the cached response for the query with the query ID
+        and question written in and the TTLs decremented by the time
+        spent in the cache or None if there is no live entry
+        '''
+        end = question_end(query)
+        key = query[12:end].lower()
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        now = time.monotonic()
+        if now >= entry.expires_at:
+            # the expired entry is kept to be answeared stale
+            if now >= entry.expires_at + self.stale_ttl:
+                self.__remove(key)
+            return None
+
+        self.entries.move_to_end(key)
+        entry.hits += 1
+
+        elapsed = int(now - entry.stored_at)
+        return DNSCache.__build_response(entry, query, end, elapsed)
+
+    def get_stale(self, query: bytes) -> bytes | None:
+        '''
+        Returns the expired response for the query, if it expired less than
+        stale_ttl seconds ago, with the TTLs set to STALE_ANSWEAR_TTL, or None
+        '''
+        end = question_end(query)
+        key = query[12:end].lower()
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        now = time.monotonic()
+        if now >= entry.expires_at + self.stale_ttl:
+            self.__remove(key)
+            return None
+
+        return DNSCache.__build_response(entry, query, end, 0, True)
+
+    def prefetch(self, query: bytes) -> bool:
+        '''
+        Returns True once for a popular entry in the last PREFETCH_WINDOW
+        of its TTL, which the caller is expected to query again
+        '''
+        if self.prefetch_hits <= 0:
+            return False
+
+        entry = self.entries.get(query[12:question_end(query)].lower())
+        if entry is None or entry.prefetching or entry.hits < self.prefetch_hits:
+            return False
+
+        now = time.monotonic()
+        if now < entry.expires_at - (entry.expires_at - entry.stored_at) * DNSCache.PREFETCH_WINDOW:
+            return False
+
+        entry.prefetching = True
+        return True
+
+    @staticmethod
+    def __build_response(entry: DNSCacheEntry, query: bytes, end: int, elapsed: int, stale: bool = False) -> bytes:
+        '''
+        Returns the response of the entry for the query, with the TTLs decremented
+        by elapsed seconds or set to STALE_ANSWEAR_TTL for a stale answear
+        '''
+        response = bytearray(entry.response)
+        # the client's ID and question, the name might have a different case
+        response[:2] = query[:2]
+        response[12:end] = query[12:end]
+
+        for offset, ttl in entry.ttls:
+            struct.pack_into('!I', response, offset, DNSCache.STALE_ANSWEAR_TTL if stale else max(ttl - elapsed, 0))
+
+        return bytes(response)
+
+    def put(self, query: bytes, response: bytes):
+        '''
+        Caches the response of the query if it is a successful or negative,
+        not truncated answear with a TTL greater than 0
+        '''
+
+        # not truncated and NO_ERROR or NAME_ERROR
+        response_code = response[3] & 0b00001111
+        if response[2] & 0b00000010 or response_code not in (0, 3):
+            return
+
+        negative = response_code == 3 or response[6:8] == b'\x00\x00'
+        if negative and self.max_negative_ttl <= 0:
+            return
+
+        if len(response) > self.max_bytes:
+            return
+
+        try:
+            end = question_end(query)
+            if response[12:end].lower() != query[12:end].lower():
+                return
+
+            records = [record for record in iter_records(response) if record.rtype != OPT_TYPE]
+            ttls = [(record.rdata_offset - 6, record.ttl) for record in records]
+
+            if negative:
+                ttls = self.__negative_ttls(response, records)
+        except (IndexError, struct.error):
+            return
+
+        if not ttls:
+            return
+
+        ttl = min(ttl for _, ttl in ttls)
+        if ttl <= 0:
+            return
+
+        key = query[12:end].lower()
+        if key in self.entries:
+            self.__remove(key)
+
+        self.entries[key] = DNSCacheEntry(response, time.monotonic(), ttl, ttls)
+        self.size += len(response)
+
+        # evict the least recently used entries
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self.__remove(next(iter(self.entries)))
+
+    def __negative_ttls(self, response: bytes, records: list[DNSRecordInfo]) -> list[tuple[int, int]]:
+        '''
+        Returns the TTLs of a negative answear, where the SOA record of the authority
+        section lives for at most its MINIMUM field and max_negative_ttl, or nothing
+        if it has no SOA record and can't be cached
+        '''
+        soa = next((record for record in records if record.section == 1 and record.rtype == SOA_TYPE), None)
+        if soa is None:
+            return []
+
+        minimum, = struct.unpack_from('!I', response, soa.rdata_offset + soa.rdlength - 4)
+        negative_ttl = min(soa.ttl, minimum, self.max_negative_ttl)
+
+        return [
+            (record.rdata_offset - 6, min(record.ttl, negative_ttl) if record is soa else record.ttl)
+            for record in records
+        ]
+
+    def __remove(self, key: bytes):
+        entry = self.entries.pop(key)
+        self.size -= len(entry.response)
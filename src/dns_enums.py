@@ -1,36 +1,37 @@
 from enum import Enum
 from typing import Self
 
-class DNSHeaderQR(Enum):
+class DNSEnum(Enum):
     '''
-    DNS Header query type field which tells if the message is a query or a response
-
-    Values:
-    - 0 - Query
-    - 1 - Response
+    Base of the DNS fields, decoding a value is a lookup in the table of the members by value
     '''
 
-    QUERY = 0
-    RESPONSE = 1
-
     @classmethod
-    def init_from(cls, value: int) -> Self:
+    def init_from(cls, value: int) -> Self | None:
         '''
-        Initialize the DNSHeaderQR from a value
+        Initialize the field from a value, returns None if the value is unknown
         '''
+        return cls._value2member_map_.get(value)
 
-        if value == 0:
-            return DNSHeaderQR.QUERY
-        elif value == 1:
-            return DNSHeaderQR.RESPONSE
-        
     def __str__(self):
-        return 'QUERY' if self == DNSHeaderQR.QUERY else 'RESPONSE'
-    
+        return self.name
+
     def __repr__(self):
         return self.__str__()
 
-class DNSHeaderOPCODE(Enum):
+class DNSHeaderQR(DNSEnum):
+    '''
+    DNS Header query type field which tells if the message is a query or a response
+
+    Values:
+    - 0 - Query
+    - 1 - Response
+    '''
+
+    QUERY = 0
+    RESPONSE = 1
+
+class DNSHeaderOPCODE(DNSEnum):
     '''
     DNS Header opcode field which tells the type of the query
 
@@ -44,31 +45,7 @@ class DNSHeaderOPCODE(Enum):
     IQUERY = 1
     STATUS = 2
 
-    @classmethod
-    def init_from(cls, value: int) -> Self:
-        '''
-        Initialize the DNSHeaderOPCODE from a value
-        '''
-
-        if value == 0:
-            return DNSHeaderOPCODE.QUERY
-        elif value == 1:
-            return DNSHeaderOPCODE.IQUERY
-        elif value == 2:
-            return DNSHeaderOPCODE.STATUS
-        
-    def __str__(self):
-        if self == DNSHeaderOPCODE.QUERY:
-            return 'QUERY'
-        elif self == DNSHeaderOPCODE.IQUERY:
-            return 'IQUERY'
-        elif self == DNSHeaderOPCODE.STATUS:
-            return 'STATUS'
-        
-    def __repr__(self):
-        return self.__str__()
-
-class DNSHeaderAuthoritiveAnswear(Enum):
+class DNSHeaderAuthoritiveAnswear(DNSEnum):
     '''
     DNS Header authoritive type field which tells if the server is authoritive
 
@@ -80,24 +57,7 @@ class DNSHeaderAuthoritiveAnswear(Enum):
     NON_AUTHORITIVE = 0
     AUTHORITIVE = 1
 
-    @classmethod
-    def init_from(cls, value: int) -> Self:
-        '''
-        Initialize the DNSHeaderAuthoritiveAnswear from a value
-        '''
-
-        if value == 0:
-            return DNSHeaderAuthoritiveAnswear.NON_AUTHORITIVE
-        elif value == 1:
-            return DNSHeaderAuthoritiveAnswear.AUTHORITIVE
-        
-    def __str__(self):
-        return 'NON_AUTHORITIVE' if self == DNSHeaderAuthoritiveAnswear.NON_AUTHORITIVE else 'AUTHORITIVE'
-    
-    def __repr__(self):
-        return self.__str__()
-
-class DNSHeaderTruncated(Enum):
+class DNSHeaderTruncated(DNSEnum):
     '''
     DNS Header truncated field which tells if the message was truncated
 
@@ -109,24 +69,7 @@ class DNSHeaderTruncated(Enum):
     NOT_TRUNCATED = 0
     TRUNCATED = 1
 
-    @classmethod
-    def init_from(cls, value: int) -> Self:
-        '''
-        Initialize the DNSHeaderTruncated from a value
-        '''
-        
-        if value == 0:
-            return DNSHeaderTruncated.NOT_TRUNCATED
-        elif value == 1:
-            return DNSHeaderTruncated.TRUNCATED
-        
-    def __str__(self):
-        return 'NOT_TRUNCATED' if self == DNSHeaderTruncated.NOT_TRUNCATED else 'TRUNCATED'
-    
-    def __repr__(self):
-        return self.__str__()
-
-class DNSHeaderRecursionDesired(Enum):
+class DNSHeaderRecursionDesired(DNSEnum):
     '''
     DNS Header recursion desired field which tells the server if the client wants recursion
 
@@ -138,24 +81,7 @@ class DNSHeaderRecursionDesired(Enum):
     NO_RECURSION = 0
     RECURSION = 1
 
-    @classmethod
-    def init_from(cls, value: int) -> Self:
-        '''
-        Initialize the DNSHeaderRecursionDesired from a value
-        '''
-
-        if value == 0:
-            return DNSHeaderRecursionDesired.NO_RECURSION
-        elif value == 1:
-            return DNSHeaderRecursionDesired.RECURSION
-        
-    def __str__(self):
-        return 'NO_RECURSION' if self == DNSHeaderRecursionDesired.NO_RECURSION else 'RECURSION'
-    
-    def __repr__(self):
-        return self.__str__()
-
-class DNSHeaderRecursionAvailable(Enum):
+class DNSHeaderRecursionAvailable(DNSEnum):
     '''
     DNS Header recursion available field which tells if the server can do recursion
 
@@ -167,24 +93,7 @@ class DNSHeaderRecursionAvailable(Enum):
     NO_RECURSION = 0
     RECURSION = 1
 
-    @classmethod
-    def init_from(cls, value: int) -> Self:
-        '''
-        Initialize the DNSHeaderRecursionAvailable from a value
-        '''
-
-        if value == 0:
-            return DNSHeaderRecursionAvailable.NO_RECURSION
-        elif value == 1:
-            return DNSHeaderRecursionAvailable.RECURSION
-        
-    def __str__(self):
-        return 'NO_RECURSION' if self == DNSHeaderRecursionAvailable.NO_RECURSION else 'RECURSION'
-    
-    def __repr__(self):
-        return self.__str__()
-
-class DNSHeaderZ(Enum):
+class DNSHeaderZ(DNSEnum):
     '''
     DNS Header Z field which is reserved for future use
 
@@ -194,13 +103,7 @@ class DNSHeaderZ(Enum):
 
     RESERVED = 0
 
-    def __str__(self):
-        return 'RESERVED'
-    
-    def __repr__(self):
-        return self.__str__()
-
-class DNSHeaderResponseCode(Enum):
+class DNSHeaderResponseCode(DNSEnum):
     '''
     DNS Header response code field which tells the status of the response
 
@@ -220,43 +123,7 @@ class DNSHeaderResponseCode(Enum):
     NOT_IMPLEMENTED = 4
     REFUSED = 5
 
-    @classmethod
-    def init_from(cls, value: int) -> Self:
-        '''
-        Initialize the DNSHeaderResponseCode from a value
-        '''
-
-        if value == 0:
-            return DNSHeaderResponseCode.NO_ERROR
-        elif value == 1:
-            return DNSHeaderResponseCode.FORMAT_ERROR
-        elif value == 2:
-            return DNSHeaderResponseCode.SERVER_FAILURE
-        elif value == 3:
-            return DNSHeaderResponseCode.NAME_ERROR
-        elif value == 4:
-            return DNSHeaderResponseCode.NOT_IMPLEMENTED
-        elif value == 5:
-            return DNSHeaderResponseCode.REFUSED
-        
-    def __str__(self):
-        if self == DNSHeaderResponseCode.NO_ERROR:
-            return 'NO_ERROR'
-        elif self == DNSHeaderResponseCode.FORMAT_ERROR:
-            return 'FORMAT_ERROR'
-        elif self == DNSHeaderResponseCode.SERVER_FAILURE:
-            return 'SERVER_FAILURE'
-        elif self == DNSHeaderResponseCode.NAME_ERROR:
-            return 'NAME_ERROR'
-        elif self == DNSHeaderResponseCode.NOT_IMPLEMENTED:
-            return 'NOT_IMPLEMENTED'
-        elif self == DNSHeaderResponseCode.REFUSED:
-            return 'REFUSED'
-        
-    def __repr__(self):
-        return self.__str__()
-
-class DNSQuestionType(Enum):
+class DNSQuestionType(DNSEnum):
     '''
     DNS Question type field which tells the type of the question
 
@@ -279,72 +146,15 @@ class DNSQuestionType(Enum):
     PTR = 12
     MX = 15
     TXT = 16
-   
-    @classmethod
-    def init_from(cls, value: int) -> Self:
-        '''
-        Initialize the DNSQuestionType from a value
-        '''
 
-        if value == 1:
-            return DNSQuestionType.A
-        elif value == 2:
-            return DNSQuestionType.NS
-        elif value == 5:
-            return DNSQuestionType.CNAME
-        elif value == 6:
-            return DNSQuestionType.SOA
-        elif value == 11:
-            return DNSQuestionType.WKS
-        elif value == 12:
-            return DNSQuestionType.PTR
-        elif value == 15:
-            return DNSQuestionType.MX
-        elif value == 16:
-            return DNSQuestionType.TXT
-        
-    def __str__(self):
-        if self == DNSQuestionType.A:
-            return 'A'
-        elif self == DNSQuestionType.NS:
-            return 'NS'
-        elif self == DNSQuestionType.CNAME:
-            return 'CNAME'
-        elif self == DNSQuestionType.SOA:
-            return 'SOA'
-        elif self == DNSQuestionType.WKS:
-            return 'WKS'
-        elif self == DNSQuestionType.PTR:
-            return 'PTR'
-        elif self == DNSQuestionType.MX:
-            return 'MX'
-        elif self == DNSQuestionType.TXT:
-            return 'TXT'
-        
-    def __repr__(self):
-        return self.__str__()
-    
-class DNSQuestionClass(Enum):
+class DNSQuestionClass(DNSEnum):
     '''
     DNS Question class field which tells the class of the question
 
     Values:
     - IN - 1
+    - CH - 3
     '''
 
     IN = 1
-
-    @classmethod
-    def init_from(cls, value: int) -> Self:
-        '''
-        Initialize the DNSQuestionClass from a value
-        '''
-
-        if value == 1:
-            return DNSQuestionClass.IN
-        
-    def __str__(self):
-        return 'IN'
-    
-    def __repr__(self):
-        return self.__str__()
+    CH = 3
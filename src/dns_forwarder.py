@@ -0,0 +1,169 @@
+import asyncio
+from typing import Coroutine
+from dns_header import DNSHeader
+from dns_enums import DNSHeaderResponseCode
+from dns_errors import DNSServerError
+from dns_cache import DNSCache
+from dns_upstream import DNSUpstreamTransport
+from dns_upstream_pool import DNSUpstreamPool
+from dns_resolver import DNSIterativeResolver
+from dns_wire import question_end
+from dns_metrics import DNSMetrics
+from time import perf_counter_ns
+
+class DNSForwarder:
+    '''
+    Forwards the queries which are not found in the zones to an upstream server
+    through a long lived DNSUpstreamTransport, or to several ones through a DNSUpstreamPool,
+    or resolves them itself from the root servers with a DNSIterativeResolver
+
+    The number of queries waiting for an upstream answer at the same time
+    is capped by max_in_flight, the answers are kept in the cache if one is given
+    and the cache hits and upstream round trip times are recorded in the metrics
+
+    The queries asking the same question as a query already sent upstream
+    wait for its answear instead of being sent too
+
+    The popular cached answears are queried again in the background shortly
+    before they expire. If the cache keeps stale answears, a query whose answear
+    expired gets the stale one when the upstream server takes more than
+    stale_timeout seconds or fails, and the upstream answear still refreshes the cache
+    '''
+
+    def __init__(
+            self,
+            transport: DNSUpstreamTransport | DNSUpstreamPool | DNSIterativeResolver,
+            max_in_flight: int,
+            cache: DNSCache | None = None,
+            metrics: DNSMetrics | None = None,
+            stale_timeout: float = 1.8
+    ):
+        self.transport = transport
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.cache = cache
+        self.metrics = metrics
+        self.stale_timeout = stale_timeout
+
+        # keep a reference to the background queries so they are not garbage collected
+        self.tasks: set[asyncio.Task] = set()
+
+        # (question with the name lower cased, over TCP) -> the upstream query
+        # answearing it, which the same questions wait for instead of being sent again
+        self.pending: dict[tuple[bytes, bool], asyncio.Task] = {}
+
+    async def open(self):
+        await self.transport.open()
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.transport.close()
+
+    async def redirect(self, query: bytes, tcp: bool = False) -> tuple[bytes, DNSHeaderResponseCode]:
+        '''
+        Redirects the query to the upstream server and returns the response data and response code
+
+        The query is sent over UDP, if the client asked over TCP and the
+        upstream response is truncated, it is sent again over TCP
+
+        Raises a DNSServerError if there are already max_in_flight forwarded queries
+        or if the upstream server doesn't answer
+        '''
+        cache = self.cache
+        if cache is None:
+            return await self.__query_upstream(query, tcp)
+
+        upstream_data = cache.get(query)
+        if upstream_data is not None:
+            if self.metrics is not None:
+                self.metrics.cache_hits += 1
+
+            if cache.prefetch(query):
+                self.__run_in_background(self.__query_upstream(query, tcp))
+                if self.metrics is not None:
+                    self.metrics.prefetches += 1
+
+            # a negative answear is cached too, with its NAME_ERROR response code
+            return upstream_data, DNSHeader(upstream_data).flags.rcode
+
+        stale_data = cache.get_stale(query) if cache.stale_ttl > 0 else None
+        if stale_data is None:
+            return await self.__query_upstream(query, tcp)
+
+        # the upstream query goes on after the timeout, to refresh the cache
+        upstream = self.__run_in_background(self.__query_upstream(query, tcp))
+        try:
+            upstream_data, response_code = await asyncio.wait_for(asyncio.shield(upstream), self.stale_timeout)
+            if response_code != DNSHeaderResponseCode.SERVER_FAILURE:
+                return upstream_data, response_code
+        except (TimeoutError, DNSServerError, OSError):
+            pass
+
+        if self.metrics is not None:
+            self.metrics.stale_answears += 1
+        return stale_data, DNSHeader(stale_data).flags.rcode
+
+    async def __query_upstream(self, query: bytes, tcp: bool) -> tuple[bytes, DNSHeaderResponseCode]:
+        '''
+        Sends the query to the upstream server, unless the same question is
+        already waiting for an upstream answear, in which case that answear is
+        returned with the query ID and question of this query written in
+        '''
+        end = question_end(query)
+        key = (query[12:end].lower(), tcp)
+
+        upstream = self.pending.get(key)
+        if upstream is None:
+            upstream = self.pending[key] = self.__run_in_background(self.__send_upstream(query, tcp))
+            upstream.add_done_callback(lambda _: self.pending.pop(key, None))
+        elif self.metrics is not None:
+            self.metrics.coalesced += 1
+
+        # a cancelled query doesn't cancel the upstream query of the other ones
+        upstream_data, response_code = await asyncio.shield(upstream)
+
+        if upstream_data[:2] != query[:2] or upstream_data[12:end] != query[12:end]:
+            upstream_data = b''.join((query[:2], upstream_data[2:12], query[12:end], upstream_data[end:]))
+
+        return upstream_data, response_code
+
+    async def __send_upstream(self, query: bytes, tcp: bool) -> tuple[bytes, DNSHeaderResponseCode]:
+        '''
+        Sends the query to the upstream server and caches its answear
+        '''
+        if self.in_flight >= self.max_in_flight:
+            raise DNSServerError("Too many forwarded queries")
+
+        self.in_flight += 1
+        started = perf_counter_ns()
+        try:
+            upstream_data = await self.transport.query(query)
+            if tcp and upstream_data[2] & 0b00000010:
+                upstream_data = await self.transport.query_tcp(query)
+        finally:
+            self.in_flight -= 1
+
+        if self.metrics is not None:
+            self.metrics.upstream.observe(perf_counter_ns() - started)
+
+        if self.cache is not None:
+            self.cache.put(query, upstream_data)
+
+        # get the response code from the upstream response
+        dns_header = DNSHeader(upstream_data)
+        response_code = dns_header.flags.rcode
+
+        return upstream_data, response_code
+
+    def __run_in_background(self, coroutine: Coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.__background_done)
+        return task
+
+    def __background_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        # nobody might be waiting for a failed background query
+        if not task.cancelled():
+            task.exception()
@@ -1,12 +1,47 @@
+import struct
 from dns_enums import *
-from utils import convert_bytes_to_int
 from typing import Self
 
+'''
+format of the flags:
+                                1  1  1  1  1  1
+  0  1  2  3  4  5  6  7  8  9  0  1  2  3  4  5
++--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+|QR|   Opcode  |AA|TC|RD|RA|   Z    |   RCODE   |
++--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+https://datatracker.ietf.org/doc/html/rfc1035#section-4.1.1
+
+The flags are decoded with two tables indexed by the value of each byte
+'''
+
+# first byte of the flags -> (QR, OPCODE, AA, TC, RD)
+FIRST_FLAGS_BYTE = tuple(
+    (
+        DNSHeaderQR.init_from((byte & 0b10000000) >> 7),
+        DNSHeaderOPCODE.init_from((byte & 0b01111000) >> 3),
+        DNSHeaderAuthoritiveAnswear.init_from((byte & 0b00000100) >> 2),
+        DNSHeaderTruncated.init_from((byte & 0b00000010) >> 1),
+        DNSHeaderRecursionDesired.init_from(byte & 0b00000001)
+    )
+    for byte in range(256)
+)
+
+# second byte of the flags -> (RA, RCODE)
+SECOND_FLAGS_BYTE = tuple(
+    (
+        DNSHeaderRecursionAvailable.init_from((byte & 0b10000000) >> 7),
+        DNSHeaderResponseCode.init_from(byte & 0b00001111)
+    )
+    for byte in range(256)
+)
+
 class DNSHeaderFlags:
     '''
     Flags of DNS header
     '''
 
+    __slots__ = ('qr', 'opcode', 'aa', 'tc', 'rd', 'ra', 'reserved', 'rcode')
+
     def __init__(
         self,
         qr: DNSHeaderQR,
@@ -26,6 +61,13 @@ class DNSHeaderFlags:
         self.reserved = DNSHeaderZ.RESERVED
         self.rcode = rcode
 
+    @classmethod
+    def init_from(cls, value: int) -> Self:
+        '''
+        Initialize the flags from the 16 bits value
+        '''
+        return cls(*FIRST_FLAGS_BYTE[value >> 8], *SECOND_FLAGS_BYTE[value & 0xff])
+
     def __str__(self) -> str:
         to_return = f"QR: {self.qr}\n"
         to_return += f"OPCODE: {self.opcode}\n"
@@ -36,10 +78,10 @@ class DNSHeaderFlags:
         to_return += f"Z: {self.reserved}\n"
         to_return += f"RCODE: {self.rcode}\n"
         return to_return
-    
+
     def __repr__(self) -> str:
         return self.__str__()
-    
+
     def build_response_header_flags(
             self,
             response_code: DNSHeaderResponseCode = DNSHeaderResponseCode.NO_ERROR
@@ -64,42 +106,32 @@ class DNSHeaderFlags:
             DNSHeaderRecursionAvailable.NO_RECURSION,
             response_code
         )
-    
-    def as_bytes(self) -> bytes:
+
+    def as_int(self) -> int:
         '''
-        Convert the flags to bytes
+        Convert the flags to their 16 bits value
         '''
+        return self.qr.value << 15 |\
+            self.opcode.value << 11 |\
+            self.aa.value << 10 |\
+            self.tc.value << 9 |\
+            self.rd.value << 8 |\
+            self.ra.value << 7 |\
+            self.reserved.value << 4 |\
+            self.rcode.value
 
+    def as_bytes(self) -> bytes:
         '''
-        format of the flags:
-                                        1  1  1  1  1  1
-          0  1  2  3  4  5  6  7  8  9  0  1  2  3  4  5
-        +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-        |QR|   Opcode  |AA|TC|RD|RA|   Z    |   RCODE   |
-        +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-        https://datatracker.ietf.org/doc/html/rfc1035#section-4.1.1
+        Convert the flags to bytes
         '''
-        qr = self.qr.value << 7
-        opcode = self.opcode.value << 3
-        aa = self.aa.value << 2
-        tc = self.tc.value << 1
-        rd = self.rd.value
-        ra = self.ra.value << 7
-        reserved = self.reserved.value << 4
-        rcode = self.rcode.value
-
-        result = qr + opcode + aa + tc + rd
-        result_bytes = result.to_bytes(1, byteorder='big')
-        result = ra + reserved + rcode
-        result_bytes += result.to_bytes(1, byteorder='big')
-
-        return result_bytes
+        return self.as_int().to_bytes(2, byteorder='big')
 
 class DNSHeader:
     '''
     Header of DNS packet
     '''
 
+    __slots__ = ('data', 'id', 'flags', 'questions_count', 'answers_count', 'authority_count', 'additional_count')
 
     def __init__(self, data: bytes = b'', create_empty: bool = False):
         '''
@@ -115,51 +147,23 @@ class DNSHeader:
         '''
         Parse the data from the bytes and convert it to required format, sets the id, flags, questions_count, answers_count, authority_count and additional_count
         '''
-        self.id = convert_bytes_to_int(self.data[:2])
-        flags_bytes = self.data[2:4]
-        self.flags = self.__read_flags(flags_bytes)
-        self.questions_count = convert_bytes_to_int(self.data[4:6])
-        self.answers_count = convert_bytes_to_int(self.data[6:8])
-        self.authority_count = convert_bytes_to_int(self.data[8:10])
-        self.additional_count = convert_bytes_to_int(self.data[10:12])
-
-    def __read_flags(self, flags: bytes) -> DNSHeaderFlags:
-        '''
-        Read the flags from the bytes and convert them to DNSHeaderFlags object
-        '''
-
-        '''
-        format of the flags:
-                                        1  1  1  1  1  1
-          0  1  2  3  4  5  6  7  8  9  0  1  2  3  4  5
-        +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-        |QR|   Opcode  |AA|TC|RD|RA|   Z    |   RCODE   |
-        +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-        https://datatracker.ietf.org/doc/html/rfc1035#section-4.1.1
-        '''
-        qr = (flags[0] & 0b10000000) >> 7
-        opcode = (flags[0] & 0b01111000) >> 3
-        aa = (flags[0] & 0b00000100) >> 2
-        tc = (flags[0] & 0b00000010) >> 1
-        rd = (flags[0] & 0b00000001)
-        ra = (flags[1] & 0b10000000) >> 7
-        rcode = (flags[1] & 0b00001111)
+        (
+            self.id,
+            flags,
+            self.questions_count,
+            self.answers_count,
+            self.authority_count,
+            self.additional_count
+        ) = struct.unpack_from('!HHHHHH', self.data)
 
-        qr = DNSHeaderQR.init_from(qr)
-        opcode = DNSHeaderOPCODE.init_from(opcode)
-        aa = DNSHeaderAuthoritiveAnswear.init_from(aa)
-        tc = DNSHeaderTruncated.init_from(tc)
-        rd = DNSHeaderRecursionDesired.init_from(rd)
-        ra = DNSHeaderRecursionAvailable.init_from(ra)
-        rcode = DNSHeaderResponseCode.init_from(rcode)
-
-        return DNSHeaderFlags(qr, opcode, aa, tc, rd, ra, rcode)
+        self.flags = DNSHeaderFlags.init_from(flags)
 
     def build_response_header(
             self,
             answers_count: int = 0,
             response_code: DNSHeaderResponseCode = DNSHeaderResponseCode.NO_ERROR,
-            authority_count: int = 1
+            authority_count: int = 1,
+            additional_count: int = 0
     ) -> Self:
         '''
         Returns a new DNSHeader object with the response flags set from the current header
@@ -167,7 +171,7 @@ class DNSHeader:
         Questions count is set to 1\n
         Answers count is set to the answer_count parameter\n
         Authority count is set to authority_count\n
-        Additional count is set to 0\n
+        Additional count is set to additional_count\n
         '''
         new_header = DNSHeader(create_empty=True)
         new_header.id = self.id
@@ -175,27 +179,23 @@ class DNSHeader:
         new_header.questions_count = 1
         new_header.answers_count = answers_count
         new_header.authority_count = authority_count
-        new_header.additional_count = 0
+        new_header.additional_count = additional_count
         return new_header
-    
+
     def as_bytes(self) -> bytes:
         '''
         Convert the header to bytes
         '''
-        id_bytes = self.id.to_bytes(2, byteorder='big')
-        flags_bytes = self.flags.as_bytes()
-        questions_count_bytes = self.questions_count.to_bytes(2, byteorder='big')
-        answers_count_bytes = self.answers_count.to_bytes(2, byteorder='big')
-        authority_count_bytes = self.authority_count.to_bytes(2, byteorder='big')
-        additional_count_bytes = self.additional_count.to_bytes(2, byteorder='big')
-
-        return id_bytes +\
-                flags_bytes +\
-                questions_count_bytes +\
-                answers_count_bytes +\
-                authority_count_bytes +\
-                additional_count_bytes
-    
+        return struct.pack(
+            '!HHHHHH',
+            self.id,
+            self.flags.as_int(),
+            self.questions_count,
+            self.answers_count,
+            self.authority_count,
+            self.additional_count
+        )
+
     def __str__(self):
         to_return = f"ID: {self.id}\n"
         to_return += f"FLAGS: {str(self.flags)}\n"
@@ -204,6 +204,6 @@ class DNSHeader:
         to_return += f"AUTHORITY COUNT: {self.authority_count}\n"
         to_return += f"ADDITIONAL COUNT: {self.additional_count}\n"
         return to_return
-    
+
     def __repr__(self):
-        return self.__str__()
\ No newline at end of file
+        return self.__str__()
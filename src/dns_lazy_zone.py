@@ -0,0 +1,84 @@
+import os
+from datetime import datetime
+from collections import OrderedDict
+from dns_zone import DNSZone
+from dns_errors import DNSServerError
+
+class DNSParsedZones:
+    '''
+    LRU of the zones compiled on demand, holding at most max_zones of them
+    '''
+
+    def __init__(self, max_zones: int):
+        self.max_zones = max_zones
+        self.zones: OrderedDict['DNSLazyZone', DNSZone] = OrderedDict()
+
+    def get(self, lazy_zone: 'DNSLazyZone') -> DNSZone | None:
+        zone = self.zones.get(lazy_zone)
+        if zone is not None:
+            self.zones.move_to_end(lazy_zone)
+        return zone
+
+    def put(self, lazy_zone: 'DNSLazyZone', zone: DNSZone):
+        self.zones[lazy_zone] = zone
+
+        # evict the least recently used zones
+        while len(self.zones) > self.max_zones:
+            self.zones.popitem(last=False)
+
+class DNSLazyZone:
+    '''
+    A zone file which is only compiled the first time it is queried
+
+    The origin is taken from the name of the file, which is <origin>.zone,
+    so nothing but the file name is read until the zone is needed. The
+    compiled zone is kept in the shared DNSParsedZones LRU, a zone evicted
+    from it is compiled again on its next query
+    '''
+
+    def __init__(self, zone_file: str, parsed_zones: DNSParsedZones):
+        self.zone_file = zone_file
+        self.parsed_zones = parsed_zones
+        self.origin = DNSZone.normalize_name(os.path.basename(zone_file).removesuffix('.zone'))
+
+        # the serial is only known once the zone is compiled
+        self.serial = None
+
+        # a file which failed to compile isn't read again, it is
+        # replaced by a new lazy zone once the file changes
+        self.error: DNSServerError | None = None
+
+    def load(self) -> DNSZone:
+        '''
+        Returns the compiled zone, compiling it if it is not in the LRU
+
+        Raises a DNSServerError if the zone file can't be compiled
+        or if its origin doesn't match the file name
+        '''
+        zone = self.parsed_zones.get(self)
+        if zone is not None:
+            return zone
+
+        if self.error is not None:
+            raise self.error
+
+        try:
+            zone = DNSZone.from_zone_file(self.zone_file)
+        except Exception as error:
+            self.error = DNSServerError(f"Failed to load {self.zone_file}: {error}")
+        else:
+            if zone.origin != self.origin:
+                self.error = DNSServerError(f"The origin of {self.zone_file} is {zone.origin} instead of {self.origin}")
+
+        if self.error is not None:
+            self.__log(str(self.error))
+            raise self.error
+
+        self.serial = zone.serial
+        self.parsed_zones.put(self, zone)
+        return zone
+
+    @staticmethod
+    def __log(message: str):
+        curent_date = datetime.strftime(datetime.now(), "%d-%m-%Y %H:%M:%S")
+        print(f"[{curent_date}] {message}", flush=True)
@@ -0,0 +1,242 @@
+import re
+from typing import Iterable, Iterator
+from dns_enums import DNSQuestionType
+from dns_errors import DNSFormatError
+
+# a quoted string, an unterminated quote, a comment, a parenthesis or a word,
+# the backslash escaping the next character in the strings and the words
+TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|(")|(;)|([()])|((?:[^\s"();\\]|\\.)+)')
+# \DDD is the octet of decimal value DDD and \X the character X
+ESCAPE = re.compile(r'\\(\d{3}|.)')
+
+# a TTL in seconds or in BIND units, like 1h30m
+TTL = re.compile(r'\d+|(?:\d+[wdhms])+', re.IGNORECASE)
+TTL_UNIT = re.compile(r'(\d+)([wdhms])', re.IGNORECASE)
+TTL_UNITS = {'w': 604800, 'd': 86400, 'h': 3600, 'm': 60, 's': 1}
+
+CLASSES = {'IN', 'CH', 'CS', 'HS'}
+# the types the zones can encode, WKS is never answeared
+QTYPES = {str(qtype): qtype for qtype in DNSQuestionType if qtype != DNSQuestionType.WKS}
+
+class DNSMasterFileParser:
+    '''
+    Parses a zone in the RFC 1035 master file format, one line at a time
+
+    Iterating the parser yields (owner, qtype, ttl, value) for every record,
+    with the value in the same form as in the JSON zone files: the SOA is a
+    dictionary, a TXT record the list of its character strings as bytes and any
+    other record a string. The owner and the names in the
+    values are absolute, ending with a dot, so $ORIGIN changes are already applied
+
+    The escaped octets which are not UTF-8 are kept in the names as surrogate
+    escapes, which the zone encodes back to the same octets
+
+    Only the records of the supported types in the IN class are yielded,
+    the other ones are skipped
+    https://datatracker.ietf.org/doc/html/rfc1035#section-5
+    '''
+
+    def __init__(self, lines: Iterable[str], origin: str | None = None, source: str = "zone file"):
+        self.lines = lines
+        self.source = source
+
+        # the origin the relative names are completed with, without the trailing dot
+        self.origin = origin.rstrip('.') if origin is not None else None
+
+        # the default TTL set by $TTL and the last TTL written in a record,
+        # which is the default without $TTL
+        self.default_ttl: int | None = None
+        self.last_ttl: int | None = None
+
+        self.owner: str | None = None
+        self.line_number = 0
+
+    def __iter__(self) -> Iterator[tuple[str, DNSQuestionType, int, str | list[bytes] | dict[str, str | int]]]:
+        for blank_owner, tokens in self.__entries():
+            if not blank_owner and tokens[0].startswith('$'):
+                self.__directive(tokens)
+                continue
+
+            record = self.__record(blank_owner, tokens)
+            if record is not None:
+                yield record
+
+    def __entries(self) -> Iterator[tuple[bool, list[str]]]:
+        '''
+        Yields the tokens of every entry, which spans more than one line inside
+        parentheses, and whether it starts with a blank instead of an owner
+        '''
+        tokens = []
+        depth = 0
+        blank_owner = False
+
+        for self.line_number, line in enumerate(self.lines, 1):
+            if depth == 0:
+                blank_owner = line[:1] in (' ', '\t')
+
+            # most lines are plain words
+            if '"' not in line and '(' not in line and ')' not in line and '\\' not in line:
+                tokens += line.split(';', 1)[0].split()
+            else:
+                depth = self.__split(line, tokens, depth)
+
+            if depth == 0 and tokens:
+                yield blank_owner, tokens
+                tokens = []
+
+        if depth != 0:
+            raise self.__error("Unbalanced parentheses at the end of the file")
+
+    def __split(self, line: str, tokens: list[str], depth: int) -> int:
+        '''
+        Appends the tokens of the line to tokens and returns the parentheses depth after it
+        '''
+        for match in TOKEN.finditer(line):
+            quoted, unterminated, comment, parenthesis, word = match.groups()
+
+            if quoted is not None:
+                tokens.append(self.__unescape(quoted) if '\\' in quoted else quoted)
+            elif unterminated is not None:
+                raise self.__error("Unterminated quoted string")
+            elif comment is not None:
+                break
+            elif parenthesis == '(':
+                depth += 1
+            elif parenthesis == ')':
+                depth -= 1
+                if depth < 0:
+                    raise self.__error("Unbalanced parentheses")
+            else:
+                tokens.append(self.__unescape(word) if '\\' in word else word)
+
+        return depth
+
+    def __unescape(self, text: str) -> str:
+        '''
+        Returns the text with its escapes replaced, rebuilt from its octets so a \\DDD
+        escape is a single octet, the octets which are not UTF-8 being surrogate escapes
+        '''
+        octets = bytearray()
+        position = 0
+        for match in ESCAPE.finditer(text):
+            octets += text[position:match.start()].encode('utf-8')
+            escaped = match.group(1)
+            if len(escaped) == 3:
+                if int(escaped) > 255:
+                    raise self.__error(f"Invalid escape \\{escaped}")
+                octets.append(int(escaped))
+            else:
+                octets += escaped.encode('utf-8')
+            position = match.end()
+        octets += text[position:].encode('utf-8')
+
+        return octets.decode('utf-8', 'surrogateescape')
+
+    def __directive(self, tokens: list[str]):
+        directive = tokens[0].upper()
+
+        if directive == '$ORIGIN' and len(tokens) == 2:
+            self.origin = self.__absolute(tokens[1])[:-1]
+        elif directive == '$TTL' and len(tokens) == 2:
+            self.default_ttl = self.__ttl(tokens[1])
+        else:
+            raise self.__error(f"Unsupported directive {' '.join(tokens)}")
+
+    def __record(self, blank_owner: bool, tokens: list[str]) -> tuple[str, DNSQuestionType, int, str | list[bytes] | dict[str, str | int]] | None:
+        '''
+        Returns the record of the entry, [owner] [TTL] [class] type RDATA
+        with the TTL and the class in any order, or None if it is skipped
+        '''
+        index = 0
+        if not blank_owner:
+            self.owner = self.__absolute(tokens[0])
+            index = 1
+        elif self.owner is None:
+            raise self.__error("The first record has no owner name")
+
+        ttl = None
+        rclass = 'IN'
+        while index < len(tokens):
+            token = tokens[index]
+            if ttl is None and (token.isdigit() or TTL.fullmatch(token)):
+                ttl = self.__ttl(token)
+            elif token.upper() in CLASSES:
+                rclass = token.upper()
+            else:
+                break
+            index += 1
+        else:
+            raise self.__error("Missing record type")
+
+        if ttl is not None:
+            self.last_ttl = ttl
+        elif self.default_ttl is not None:
+            ttl = self.default_ttl
+        elif self.last_ttl is not None:
+            ttl = self.last_ttl
+        else:
+            raise self.__error("Missing TTL and no $TTL before the record")
+
+        qtype = QTYPES.get(tokens[index].upper())
+        rdata = tokens[index + 1:]
+        if qtype is None or rclass != 'IN':
+            return None
+
+        # like in the JSON zone files, a record which can't be read is
+        # passed on as it is, so the zone flags its RRset as broken
+        try:
+            return (self.owner, qtype, ttl, self.__value(qtype, rdata, ttl))
+        except (IndexError, ValueError, DNSFormatError):
+            return (self.owner, qtype, ttl, ' '.join(rdata))
+
+    def __value(self, qtype: DNSQuestionType, rdata: list[str], ttl: int) -> str | list[bytes] | dict[str, str | int]:
+        '''
+        Returns the value of the record in the form of the JSON zone files
+        '''
+        if qtype == DNSQuestionType.SOA:
+            if len(rdata) != 7:
+                raise ValueError(qtype)
+            return {
+                "mname": self.__absolute(rdata[0]),
+                "rname": self.__absolute(rdata[1]),
+                "serial": int(rdata[2]),
+                "refresh": self.__ttl(rdata[3]),
+                "retry": self.__ttl(rdata[4]),
+                "expire": self.__ttl(rdata[5]),
+                "minimum": self.__ttl(rdata[6]),
+                "ttl": ttl
+            }
+
+        if qtype == DNSQuestionType.CNAME or qtype == DNSQuestionType.NS or qtype == DNSQuestionType.PTR:
+            return self.__absolute(rdata[0])
+
+        if qtype == DNSQuestionType.MX:
+            return f"{rdata[0]} {self.__absolute(rdata[1])}"
+
+        # the character strings of a TXT record are kept apart, each one is at most 255 bytes
+        if qtype == DNSQuestionType.TXT:
+            return [string.encode('utf-8', 'surrogateescape') for string in rdata]
+
+        return ' '.join(rdata)
+
+    def __absolute(self, name: str) -> str:
+        '''
+        Returns the name ending with a dot, completing a relative name with the origin
+        '''
+        if name.endswith('.'):
+            return name
+        if self.origin is None:
+            raise self.__error(f"Relative name {name} without $ORIGIN")
+        if name == '@':
+            return f"{self.origin}."
+        return f"{name}.{self.origin}."
+
+    def __ttl(self, value: str) -> int:
+        if value.isdigit():
+            return int(value)
+        if not TTL.fullmatch(value):
+            raise self.__error(f"Invalid TTL {value}")
+        return sum(int(count) * TTL_UNITS[unit.lower()] for count, unit in TTL_UNIT.findall(value))
+
+    def __error(self, message: str) -> DNSFormatError:
+        return DNSFormatError(f"{self.source}:{self.line_number}: {message}")
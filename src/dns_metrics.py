@@ -0,0 +1,230 @@
+import time
+import struct
+import asyncio
+from bisect import bisect_left
+from dns_header import DNSHeader
+from dns_question import DNSQuestion
+from dns_enums import DNSQuestionType, DNSQuestionClass, DNSHeaderResponseCode
+
+# upper bounds of the buckets in nanoseconds, the last bucket is unbounded
+LOCAL_BUCKETS = (1_000, 2_000, 5_000, 10_000, 20_000, 50_000, 100_000, 200_000, 500_000, 1_000_000)
+UPSTREAM_BUCKETS = (1_000_000, 2_000_000, 5_000_000, 10_000_000, 20_000_000, 50_000_000, 100_000_000, 200_000_000, 500_000_000, 1_000_000_000, 2_000_000_000)
+
+# the name of the CHAOS class TXT query answered with the statistics
+STATS_NAME = 'stats.bind'
+
+class DNSHistogram:
+    '''
+    Latency histogram with fixed buckets, the observed values are in nanoseconds
+    '''
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: tuple[int, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: int):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, quantile: float) -> int | None:
+        '''
+        Returns the upper bound of the bucket holding the quantile,
+        None if nothing was observed or if it is in the unbounded bucket
+        '''
+        if self.count == 0:
+            return None
+
+        rank = quantile * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+class DNSMetrics:
+    '''
+    Counters and latency histograms of one server process
+
+    The server handles the queries on a single event loop thread, so the
+    counters are plain integers updated without any lock. Recording a query
+    is a dictionary update and at most a few clock reads
+    '''
+
+    def __init__(self, labels: dict[str, str] | None = None):
+        self.labels = labels or {}
+        self.started_at = time.time()
+
+        # (source, qtype, response code) -> number of queries
+        self.queries: dict[tuple[str, DNSQuestionType | None, DNSHeaderResponseCode | None], int] = {}
+        # forwarded queries answered from the cache, waiting for the upstream
+        # answer of the same question, cached answers refreshed before
+        # they expire and expired answers sent for a failed upstream query
+        self.cache_hits = 0
+        self.coalesced = 0
+        # forwarded queries sent to a second upstream server because the first one was slow
+        self.hedged = 0
+        self.prefetches = 0
+        self.stale_answears = 0
+
+        self.parse = DNSHistogram(LOCAL_BUCKETS)
+        self.lookup = DNSHistogram(LOCAL_BUCKETS)
+        self.encode = DNSHistogram(LOCAL_BUCKETS)
+        self.upstream = DNSHistogram(UPSTREAM_BUCKETS)
+
+    def count(
+            self,
+            source: str,
+            qtype: DNSQuestionType | None = None,
+            response_code: DNSHeaderResponseCode | None = None
+    ):
+        '''
+        Counts one answered query, the source is one of the DNSQueryLog sources
+        '''
+        key = (source, qtype, response_code)
+        self.queries[key] = self.queries.get(key, 0) + 1
+
+    def totals(self) -> dict[str, int]:
+        '''
+        Returns the number of queries by source and by response code
+        '''
+        totals = {"queries": 0, "cache_hits": self.cache_hits, "coalesced": self.coalesced, "hedged": self.hedged, "prefetches": self.prefetches, "stale_answers": self.stale_answears}
+        for (source, _, response_code), count in self.queries.items():
+            totals["queries"] += count
+            totals[source] = totals.get(source, 0) + count
+            if response_code is not None:
+                totals[response_code.name] = totals.get(response_code.name, 0) + count
+        return totals
+
+    @staticmethod
+    def is_stats_query(question: DNSQuestion) -> bool:
+        '''
+        Checks if the question is the CHAOS class stats.bind TXT query
+        '''
+        return question.qclass == DNSQuestionClass.CH and\
+            question.qtype == DNSQuestionType.TXT and\
+            question.domain.lower() == STATS_NAME
+
+    def build_stats_response(self, header: DNSHeader, question: DNSQuestion, opt: bytes = b'') -> bytes:
+        '''
+        Builds the answear to the stats.bind query, one TXT record
+        holding a name=value string for every statistic, followed by the OPT record if any
+        '''
+        statistics = [f"uptime={round(time.time() - self.started_at)}"]
+        statistics += [f"{name}={count}" for name, count in self.totals().items()]
+
+        for name, histogram in (("parse", self.parse), ("lookup", self.lookup), ("encode", self.encode), ("upstream", self.upstream)):
+            for quantile in (0.5, 0.99):
+                bound = histogram.quantile(quantile)
+                if bound is not None:
+                    statistics.append(f"{name}_p{round(quantile * 100)}_us={bound // 1000}")
+
+        records = []
+        for statistic in statistics:
+            text = statistic.encode('ascii')
+            rdata = bytes([len(text)]) + text
+            # the owner is a pointer to the question name, at offset 12
+            records.append(b'\xc0\x0c' + struct.pack('!HHIH', DNSQuestionType.TXT.value, DNSQuestionClass.CH.value, 0, len(rdata)) + rdata)
+
+        response_header = header.build_response_header(answers_count=len(records), authority_count=0, additional_count=1 if opt else 0)
+        return b''.join((response_header.as_bytes(), question.as_bytes(), *records, opt))
+
+    def render(self) -> str:
+        '''
+        Renders the metrics in the Prometheus text format
+        '''
+        lines = [
+            "# HELP dns_queries_total Answered queries by source, type and response code",
+            "# TYPE dns_queries_total counter"
+        ]
+
+        for (source, qtype, response_code), count in sorted(self.queries.items(), key=lambda item: str(item[0])):
+            labels = self.__labels(
+                source=source,
+                qtype=qtype.name if qtype is not None else "OTHER",
+                rcode=response_code.name if response_code is not None else "NONE"
+            )
+            lines.append(f"dns_queries_total{labels} {count}")
+
+        lines.append("# HELP dns_cache_hits_total Forwarded queries answered from the cache")
+        lines.append("# TYPE dns_cache_hits_total counter")
+        lines.append(f"dns_cache_hits_total{self.__labels()} {self.cache_hits}")
+
+        lines.append("# HELP dns_coalesced_queries_total Forwarded queries which waited for the upstream answer of the same question")
+        lines.append("# TYPE dns_coalesced_queries_total counter")
+        lines.append(f"dns_coalesced_queries_total{self.__labels()} {self.coalesced}")
+
+        lines.append("# HELP dns_hedged_queries_total Forwarded queries also sent to a second upstream server because the first one was slow")
+        lines.append("# TYPE dns_hedged_queries_total counter")
+        lines.append(f"dns_hedged_queries_total{self.__labels()} {self.hedged}")
+
+        lines.append("# HELP dns_cache_prefetches_total Popular cached answers queried again before they expire")
+        lines.append("# TYPE dns_cache_prefetches_total counter")
+        lines.append(f"dns_cache_prefetches_total{self.__labels()} {self.prefetches}")
+
+        lines.append("# HELP dns_stale_answers_total Expired cached answers sent because the upstream server was slow or failed")
+        lines.append("# TYPE dns_stale_answers_total counter")
+        lines.append(f"dns_stale_answers_total{self.__labels()} {self.stale_answears}")
+
+        for name, histogram, description in (
+            ("dns_parse_seconds", self.parse, "Time spent parsing the queries"),
+            ("dns_lookup_seconds", self.lookup, "Time spent looking up the answears in the zones"),
+            ("dns_encode_seconds", self.encode, "Time spent encoding the responses"),
+            ("dns_upstream_rtt_seconds", self.upstream, "Round trip time of the forwarded queries")
+        ):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{self.__labels(le=f'{bound / 1e9:g}')} {cumulative}")
+            lines.append(f"{name}_bucket{self.__labels(le='+Inf')} {histogram.count}")
+            lines.append(f"{name}_sum{self.__labels()} {histogram.sum / 1e9}")
+            lines.append(f"{name}_count{self.__labels()} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def __labels(self, **labels: str) -> str:
+        labels = {**self.labels, **labels}
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+async def serve_metrics(host: str, port: int, metrics: DNSMetrics) -> asyncio.Server:
+    '''
+    Starts a minimal HTTP server answering GET /metrics with the metrics
+    in the Prometheus text format
+    '''
+
+    async def handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # skip the headers of the request
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b'GET' and parts[1] == b'/metrics':
+                status, body = "200 OK", metrics.render().encode('utf-8')
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode('ascii') + body
+            )
+            await writer.drain()
+        except (TimeoutError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_request, host, port)
@@ -0,0 +1,175 @@
+import os
+import sys
+import ctypes
+import socket
+
+class DNSIOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class DNSMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(DNSIOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int)
+    ]
+
+class DNSMMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", DNSMsgHdr), ("msg_len", ctypes.c_uint)]
+
+# large enough for any socket address, like struct sockaddr_storage
+SOCKADDR_SIZE = 128
+
+def load_libc() -> ctypes.CDLL | None:
+    '''
+    Returns the C library if it has recvmmsg and sendmmsg, which only Linux has, or None
+    '''
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        recvmmsg = libc.recvmmsg
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(DNSMMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(DNSMMsgHdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return libc
+
+LIBC = load_libc()
+
+class DNSMMsgSocket:
+    '''
+    Thin binding of recvmmsg and sendmmsg for one non-blocking UDP socket,
+    which receive and send up to batch_size datagrams in one system call
+
+    The datagrams are received into batch_size preallocated buffers of
+    buffer_size bytes, a longer datagram is dropped.
+    Only available on Linux, see DNSMMsgSocket.available
+    '''
+
+    def __init__(self, sock: socket.socket, batch_size: int, buffer_size: int):
+        if LIBC is None:
+            raise OSError("recvmmsg and sendmmsg are not available")
+
+        self.sock = sock
+        self.family = sock.family
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+
+        self.buffers = ctypes.create_string_buffer(batch_size * buffer_size)
+        self.names = ctypes.create_string_buffer(batch_size * SOCKADDR_SIZE)
+        self.iovecs = (DNSIOVec * batch_size)()
+        self.received = (DNSMMsgHdr * batch_size)()
+
+        buffers = ctypes.addressof(self.buffers)
+        names = ctypes.addressof(self.names)
+        for index in range(batch_size):
+            self.iovecs[index].iov_base = buffers + index * buffer_size
+            self.iovecs[index].iov_len = buffer_size
+
+            header = self.received[index].msg_hdr
+            header.msg_name = names + index * SOCKADDR_SIZE
+            header.msg_iov = ctypes.pointer(self.iovecs[index])
+            header.msg_iovlen = 1
+
+        # the messages sent, their buffers point to the responses themselves
+        self.send_iovecs = (DNSIOVec * batch_size)()
+        self.sent = (DNSMMsgHdr * batch_size)()
+        for index in range(batch_size):
+            self.sent[index].msg_hdr.msg_iov = ctypes.pointer(self.send_iovecs[index])
+            self.sent[index].msg_hdr.msg_iovlen = 1
+
+    @staticmethod
+    def available() -> bool:
+        return LIBC is not None
+
+    def receive(self) -> list[tuple[bytes, tuple]]:
+        '''
+        Returns the datagrams waiting on the socket, at most batch_size, with
+        their source addresses. The data is copied out of the buffers, which are
+        reused by the next call
+
+        Raises BlockingIOError if there is none and OSError on any other error
+        '''
+        for index in range(self.batch_size):
+            self.received[index].msg_hdr.msg_namelen = SOCKADDR_SIZE
+
+        count = LIBC.recvmmsg(self.sock.fileno(), self.received, self.batch_size, 0, None)
+        if count < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        buffers = ctypes.addressof(self.buffers)
+        names = ctypes.addressof(self.names)
+        datagrams = []
+        for index in range(count):
+            message = self.received[index]
+            # a datagram longer than the buffer is not a valid query
+            if message.msg_hdr.msg_flags & socket.MSG_TRUNC:
+                continue
+
+            data = ctypes.string_at(buffers + index * self.buffer_size, message.msg_len)
+            name = ctypes.string_at(names + index * SOCKADDR_SIZE, message.msg_hdr.msg_namelen)
+            datagrams.append((data, DNSMMsgSocket.__decode_address(name)))
+
+        return datagrams
+
+    def send(self, datagrams: list[tuple[bytes, tuple]]) -> int:
+        '''
+        Sends the first batch_size datagrams to their addresses and returns
+        how many were sent, which may be less than asked if the socket buffer is full
+
+        Raises BlockingIOError if none could be sent and OSError if the first one failed
+        '''
+        datagrams = datagrams[:self.batch_size]
+
+        # the buffers point into the bytes objects, kept alive until the call returns
+        names = []
+        for index, (data, address) in enumerate(datagrams):
+            name = self.__encode_address(address)
+            names.append(name)
+
+            self.send_iovecs[index].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+            self.send_iovecs[index].iov_len = len(data)
+
+            header = self.sent[index].msg_hdr
+            header.msg_name = ctypes.cast(ctypes.c_char_p(name), ctypes.c_void_p).value
+            header.msg_namelen = len(name)
+
+        count = LIBC.sendmmsg(self.sock.fileno(), self.sent, len(datagrams), 0)
+        if count < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        return count
+
+    @staticmethod
+    def __decode_address(name: bytes) -> tuple:
+        family = int.from_bytes(name[:2], byteorder=sys.byteorder)
+        port = int.from_bytes(name[2:4], byteorder='big')
+
+        if family == socket.AF_INET6:
+            flowinfo = int.from_bytes(name[4:8], byteorder='big')
+            scope_id = int.from_bytes(name[24:28], byteorder=sys.byteorder)
+            return socket.inet_ntop(socket.AF_INET6, name[8:24]), port, flowinfo, scope_id
+
+        return socket.inet_ntop(socket.AF_INET, name[4:8]), port
+
+    def __encode_address(self, address: tuple) -> bytes:
+        family = self.family.to_bytes(2, byteorder=sys.byteorder)
+        port = address[1].to_bytes(2, byteorder='big')
+
+        if self.family == socket.AF_INET6:
+            flowinfo = (address[2] if len(address) > 2 else 0).to_bytes(4, byteorder='big')
+            scope_id = (address[3] if len(address) > 3 else 0).to_bytes(4, byteorder=sys.byteorder)
+            return family + port + flowinfo + socket.inet_pton(socket.AF_INET6, address[0]) + scope_id
+
+        return family + port + socket.inet_pton(socket.AF_INET, address[0]) + bytes(8)
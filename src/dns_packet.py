@@ -1,45 +1,105 @@
+import struct
 from  dns_header import DNSHeader
 from  dns_question import DNSQuestion
 from  dns_enums import DNSHeaderResponseCode
 from  dns_answear import DNSAnswear
+from  dns_metrics import DNSMetrics
+from  dns_wire import find_opt, build_opt, EDNS_DO_BIT
+from time import perf_counter_ns
 from typing import Self
 
 class DNSPacket:
     '''
     A class representing a DNS packet split into header, question and answears
+
+    If the query has an OPT record (EDNS), the responses have one as well.
+    A query whose additional records can't be read is answeared with FORMAT_ERROR
+    https://datatracker.ietf.org/doc/html/rfc6891
     '''
     def __init__(self, data: bytes):
         self.data = data
         self.header = DNSHeader(data)
-        self.question = DNSQuestion(data[12:])
+        # the question is read in place, right after the 12 bytes of the header
+        self.question = DNSQuestion(data, 12)
         self.answears = DNSAnswear(self.question)
 
-    def build_response(self) -> tuple[bytes, DNSHeaderResponseCode]:
+        # the OPT record of the query, only searched for if there are additional records
+        self.opt = None
+        self.malformed_opt = False
+        if self.header.additional_count:
+            try:
+                self.opt = find_opt(data)
+            except (IndexError, struct.error):
+                self.malformed_opt = True
+
+    def build_response(self, metrics: DNSMetrics | None = None) -> tuple[bytes, DNSHeaderResponseCode]:
         '''
         Builds the response bytes for the packet from the current packet
 
+        If metrics are given, the time spent looking up the answears
+        and encoding the response is added to their histograms
+
         Returns the response bytes and the response code
         '''
+        if self.malformed_opt:
+            return self.build_error_response(DNSHeaderResponseCode.FORMAT_ERROR), DNSHeaderResponseCode.FORMAT_ERROR
+
+        if metrics is not None:
+            started = perf_counter_ns()
 
         response_question_bytes = self.question.as_bytes()
         response_answears, answears_count = self.answears.build_response()
         response_code = DNSHeaderResponseCode.NO_ERROR if isinstance(response_answears, bytes) else response_answears
         authority_bytes = self.answears.get_authority()
 
+        if metrics is not None:
+            looked_up = perf_counter_ns()
+            metrics.lookup.observe(looked_up - started)
+
+        opt_bytes = self.build_opt_record()
+
         response_header = self.header.build_response_header(
             answers_count=answears_count,
             response_code=response_code,
-            authority_count=1 if authority_bytes else 0
+            authority_count=1 if authority_bytes else 0,
+            additional_count=1 if opt_bytes else 0
         )
         response_header_bytes = response_header.as_bytes()
 
         response_answears_bytes = response_answears if isinstance(response_answears, bytes) else b''
         authority_bytes = authority_bytes if authority_bytes else b''
 
-        response_bytes = response_header_bytes + response_question_bytes + response_answears_bytes + authority_bytes
-        
+        response_bytes = b''.join((response_header_bytes, response_question_bytes, response_answears_bytes, authority_bytes, opt_bytes))
+
+        if metrics is not None:
+            metrics.encode.observe(perf_counter_ns() - looked_up)
+
         return response_bytes, response_code
 
+    def build_error_response(self, response_code: DNSHeaderResponseCode) -> bytes:
+        '''
+        Builds the response bytes for the packet without any answears, only with the response code set
+        '''
+
+        opt_bytes = self.build_opt_record()
+
+        response_header = self.header.build_response_header(
+            response_code=response_code,
+            authority_count=0,
+            additional_count=1 if opt_bytes else 0
+        )
+
+        return response_header.as_bytes() + self.question.as_bytes() + opt_bytes
+
+    def build_opt_record(self) -> bytes:
+        '''
+        Builds the OPT record of the response, with the UDP payload size of the
+        server and the DO bit copied from the query, or nothing if the query has no OPT record
+        '''
+        if self.opt is None:
+            return b''
+        return build_opt(flags=self.opt.ttl & EDNS_DO_BIT)
+
     def __str__(self) -> str:
         return f"{self.header}\n{self.question}"
     
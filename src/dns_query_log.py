@@ -0,0 +1,167 @@
+import sys
+import json
+import time
+import threading
+from typing import TextIO
+from datetime import datetime
+from collections import deque
+from dns_question import DNSQuestion
+from dns_enums import DNSHeaderResponseCode
+
+class DNSQueryLog:
+    '''
+    Query log kept off the serving path
+
+    Logging a query only appends the raw query and its outcome to a bounded
+    ring buffer, which is drained by a background thread that decodes and
+    writes the lines. When the buffer is full the entries are dropped and
+    counted instead of blocking the server
+
+    Only one of every sample_every queries is logged
+    '''
+
+    # sources of the responses
+    ZONE = 'zone'
+    TEMPLATE = 'template'
+    UPSTREAM = 'upstream'
+    STATS = 'stats'
+    ERROR = 'error'
+    MALFORMED = 'malformed'
+
+    # seconds between two drains of the buffer
+    FLUSH_INTERVAL = 0.2
+
+    def __init__(self, output: TextIO, log_format: str = 'text', sample_every: int = 1, capacity: int = 65536):
+        if sample_every < 1:
+            raise ValueError(f"Invalid query log sample {sample_every}")
+
+        self.output = output
+        self.log_format = log_format
+        self.sample_every = sample_every
+        self.capacity = capacity
+
+        self.buffer: deque[tuple] = deque()
+        self.counter = 0
+        self.dropped = 0
+        self.reported_dropped = 0
+
+        # the formatted timestamp of the current second, shared by all its lines
+        self.timestamp_second = None
+        self.timestamp = None
+
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(target=self.__write_forever, name="query-log", daemon=True)
+        self.writer.start()
+
+    def log(
+            self,
+            query: bytes,
+            source: str,
+            response_code: DNSHeaderResponseCode | None = None,
+            error: str | None = None
+    ):
+        '''
+        Adds the query to the log, it is decoded and written later by the writer thread
+        '''
+        self.counter += 1
+        if self.counter % self.sample_every:
+            return
+
+        if len(self.buffer) >= self.capacity:
+            self.dropped += 1
+            return
+
+        self.buffer.append((time.time(), query, source, response_code, error))
+
+    def close(self):
+        '''
+        Stops the writer thread after writing everything left in the buffer
+        '''
+        self.stopped.set()
+        self.writer.join()
+
+    def __write_forever(self):
+        while not self.stopped.wait(DNSQueryLog.FLUSH_INTERVAL):
+            self.__drain()
+        self.__drain()
+
+    def __drain(self):
+        lines = []
+
+        while self.buffer:
+            lines.append(self.__format(*self.buffer.popleft()))
+
+        dropped = self.dropped
+        if dropped != self.reported_dropped:
+            lines.append(self.__format_dropped(dropped - self.reported_dropped))
+            self.reported_dropped = dropped
+
+        if not lines:
+            return
+
+        try:
+            self.output.write(''.join(lines))
+            self.output.flush()
+        except (OSError, ValueError):
+            pass
+
+    def __format(
+            self,
+            timestamp: float,
+            query: bytes,
+            source: str,
+            response_code: DNSHeaderResponseCode | None,
+            error: str | None
+    ) -> str:
+        try:
+            question = DNSQuestion(query)
+            domain = question.domain
+            qtype = str(question.qtype) if question.qtype is not None else int.from_bytes(query[question.end - 4:question.end - 2], byteorder='big')
+        except Exception:
+            domain = None
+            qtype = None
+
+        rcode = response_code.name if response_code is not None else None
+
+        if self.log_format == 'jsonl':
+            return json.dumps({
+                "time": round(timestamp, 3),
+                "domain": domain,
+                "qtype": qtype,
+                "rcode": rcode,
+                "source": source,
+                "error": error
+            }) + "\n"
+
+        date = self.__timestamp(timestamp)
+
+        if source == DNSQueryLog.MALFORMED:
+            return f"[{date}] Dropped malformed request\n"
+        if source == DNSQueryLog.ERROR:
+            return f"[{date}] Failed to redirect \"{domain}\": {error}\n"
+        if source == DNSQueryLog.UPSTREAM:
+            return f"[{date}] Responded from Google with {rcode} for \"{domain}\" ({qtype})\n"
+        return f"[{date}] Responded with {rcode} for \"{domain}\" ({qtype})\n"
+
+    def __format_dropped(self, dropped: int) -> str:
+        if self.log_format == 'jsonl':
+            return json.dumps({"time": round(time.time(), 3), "dropped": dropped}) + "\n"
+        return f"[{self.__timestamp(time.time())}] Dropped {dropped} log lines, the query log buffer was full\n"
+
+    def __timestamp(self, timestamp: float) -> str:
+        '''
+        Returns the formatted timestamp, formatting it only once per second
+        '''
+        second = int(timestamp)
+        if second != self.timestamp_second:
+            self.timestamp_second = second
+            self.timestamp = datetime.strftime(datetime.fromtimestamp(second), "%d-%m-%Y %H:%M:%S")
+        return self.timestamp
+
+def open_query_log(path: str) -> TextIO:
+    '''
+    Opens the output of the query log, - being the standard output
+    '''
+    if path == '-':
+        return sys.stdout
+    return open(path, 'a')
@@ -1,35 +1,38 @@
-from utils import convert_bytes_to_int
 from dns_enums import DNSQuestionType, DNSQuestionClass
+from dns_errors import DNSFormatError
 
 class DNSQuestion:
     '''
     A class representing only one DNS question
+
+    The question is read in place from the message, only its end is found
+    when it is created, the fields are decoded the first time they are used
     '''
 
-    def __init__(self, data: bytes):
+    def __init__(self, data: bytes | memoryview, offset: int = 12):
         '''
-        The data is the bytes of the question which are offseted by the header bytes (12 bytes)
+        The data is the whole DNS message, the question starts at offset, which is after the header (12 bytes)
         '''
-        self.data = data
-        self.__parse_data()
+        self.data = memoryview(data)
+        self.offset = offset
+        self.end = self.__scan_domain() + 4
 
-    def __parse_data(self):
-        '''
-        Parses the data and sets the domain, qtype and qclass
-        '''
-        self.domain, index = self.__read_domain()
-        qtype = convert_bytes_to_int(self.data[index:index+2])
-        qclass = convert_bytes_to_int(self.data[index+2:index+4])
-        self.qtype = DNSQuestionType.init_from(qtype)
-        self.qclass = DNSQuestionClass.init_from(qclass)
+        # decoded the first time they are used
+        self.__domain = None
+        self.__qtype = None
+        self.__qclass = None
+        self.__raw = None
+
+        if self.end > len(self.data):
+            raise DNSFormatError("Question out of the message")
 
-    def __read_domain(self) -> tuple[str, int]:
+    def __scan_domain(self) -> int:
         '''
-        Reads the domain from the data and returns it
+        Walks over the labels of the domain without decoding them
 
         Assuming that the domain is not compressed to points to another part of the packet
 
-        Returns: a tuple of the domain and the index where the domain ends
+        Returns: the index where the domain ends
         '''
 
         '''
@@ -40,48 +43,87 @@ class DNSQuestion:
         Example:
         3www6google3com0 -> www.google.com
         '''
-        domain = ''
-        index = 0
+        data = self.data
+        index = self.offset
 
         while True:
+            if index >= len(data):
+                raise DNSFormatError("Question name out of the message")
+
             # read the length of the part
-            length = self.data[index]
+            length = data[index]
             if length == 0:
-                break
-
-            index += 1
-            # read the part and decode it
-            domain += self.data[index:index+length].decode('utf-8') + '.'
-            index += length
-        
-        return domain[:-1], index + 1
-    
+                return index + 1
+
+            # the length of a label is at most 63, anything bigger is a pointer
+            if length > 63:
+                raise DNSFormatError("Compressed question name")
+
+            index += length + 1
+
+    @property
+    def domain(self) -> str:
+        '''
+        The domain of the question, decoded from the labels
+
+        Raises a DNSFormatError if the labels are not valid UTF-8
+        '''
+        if self.__domain is None:
+            self.__domain = self.__read_domain()
+        return self.__domain
+
+    @property
+    def qtype(self) -> DNSQuestionType | None:
+        if self.__qtype is None:
+            self.__qtype = DNSQuestionType.init_from(int.from_bytes(self.data[self.end - 4:self.end - 2], byteorder='big'))
+        return self.__qtype
+
+    @property
+    def qclass(self) -> DNSQuestionClass | None:
+        if self.__qclass is None:
+            self.__qclass = DNSQuestionClass.init_from(int.from_bytes(self.data[self.end - 2:self.end], byteorder='big'))
+        return self.__qclass
+
+    @property
+    def raw(self) -> bytes:
+        '''
+        The question section exactly as it was received
+        '''
+        if self.__raw is None:
+            self.__raw = self.data[self.offset:self.end].tobytes()
+        return self.__raw
+
+    def __read_domain(self) -> str:
+        '''
+        Reads the domain from the labels found by __scan_domain
+
+        Raises a DNSFormatError if the labels are not valid UTF-8
+        '''
+        data = self.data
+        index = self.offset
+        labels = []
+
+        while index < self.end - 5:
+            length = data[index]
+            labels.append(data[index + 1:index + 1 + length])
+            index += length + 1
+
+        try:
+            return b'.'.join(labels).decode('utf-8')
+        except UnicodeDecodeError:
+            raise DNSFormatError("Question name is not valid UTF-8")
+
     def as_bytes(self) -> bytes:
         '''
-        Convert the DNSQuestion to bytes
+        Convert the DNSQuestion to bytes, which are the bytes it was read from
         '''
-        result_bytes= b''
-
-        # break the domain into parts and encode them
-        domain_parts = self.domain.split('.')
-        for part in domain_parts:
-            # extract the length of the part and encode it
-            result_bytes += len(part).to_bytes(1, byteorder='big')
-            # encode the part
-            result_bytes += part.encode('utf-8')
-        # add the terminating zero length byte
-        result_bytes += b'\x00'
-
-        result_bytes += self.qtype.value.to_bytes(2, byteorder='big')
-        result_bytes += self.qclass.value.to_bytes(2, byteorder='big')
-
-        return result_bytes
-    
+        return self.raw
+
     def __str__(self) -> str:
         to_return = f"DOMAIN: {self.domain}\n"
         to_return += f"QTYPE: {self.qtype}\n"
         to_return += f"QCLASS: {self.qclass}\n"
         return to_return
-    
+
     def __repr__(self) -> str:
         return self.__str__()
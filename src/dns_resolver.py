@@ -0,0 +1,543 @@
+import time
+import struct
+import asyncio
+from typing import NamedTuple
+from collections import OrderedDict
+from dns_errors import DNSServerError
+from dns_upstream import DNSUpstreamTransport
+from dns_upstream_pool import DNSUpstreamPool, DNSUpstreamStats
+from dns_wire import (
+    DNSNameCompressor, build_opt, encode_name,
+    find_opt, iter_records, question_end, read_name, read_rdata
+)
+
+# the record types and class the resolver reads
+A_TYPE = 1
+NS_TYPE = 2
+CNAME_TYPE = 5
+SOA_TYPE = 6
+ANY_TYPE = 255
+IN_CLASS = 1
+
+# the IPv4 addresses of the 13 root servers, a to m
+# https://www.iana.org/domains/root/servers
+ROOT_HINTS = [
+    '198.41.0.4', '170.247.170.2', '192.33.4.12', '199.7.91.13', '192.203.230.10',
+    '192.5.5.241', '192.112.36.4', '198.97.190.53', '192.36.148.17', '192.58.128.30',
+    '193.0.14.129', '199.7.83.42', '202.12.27.33'
+]
+
+class DNSDecodedRecord(NamedTuple):
+    '''
+    A record of a response from an authoritative server, with its owner name
+    and the names in its RDATA decoded, see read_rdata for the RDATA parts
+    '''
+
+    section: int
+    name: str
+    rtype: int
+    rclass: int
+    ttl: int
+    rdata: list[bytes | str]
+
+def in_zone(name: str, zone: str) -> bool:
+    '''
+    Tells if the name is the zone or a name below it, every name being below the root
+    '''
+    return not zone or name == zone or name.endswith('.' + zone)
+
+class DNSDelegation:
+    '''
+    A zone cut, the names of the servers authoritative for the zone below it
+    '''
+
+    __slots__ = ('zone', 'names', 'expires_at')
+
+    def __init__(self, zone: str, names: list[str], expires_at: float):
+        self.zone = zone
+        self.names = names
+        self.expires_at = expires_at
+
+class DNSInfrastructureCache:
+    '''
+    The delegations learned from the referrals and the addresses of the name servers
+
+    A lookup starts at the deepest live delegation above the name, and at the
+    root servers of the hints, which never expire, if none is known. The names
+    are lower cased, without the trailing dot. Each map is an LRU of at most
+    max_entries entries and an entry lives for its TTL, at most MAX_TTL seconds
+    '''
+
+    MAX_TTL = 86400
+
+    def __init__(self, root_hints: list[str], max_entries: int):
+        self.max_entries = max_entries
+
+        # the root servers are only known by their address, which stands for their name
+        self.root = DNSDelegation('', list(root_hints), float('inf'))
+        self.hints = {address: [address] for address in root_hints}
+
+        self.delegations: OrderedDict[str, DNSDelegation] = OrderedDict()
+        # name server -> (IPv4 addresses, expiry time)
+        self.addresses: OrderedDict[str, tuple[list[str], float]] = OrderedDict()
+
+    def find(self, name: str) -> DNSDelegation:
+        '''
+        Returns the deepest live delegation of the name or of one of its ancestors
+        '''
+        now = time.monotonic()
+        while name:
+            delegation = self.delegations.get(name)
+            if delegation is not None:
+                if now < delegation.expires_at:
+                    self.delegations.move_to_end(name)
+                    return delegation
+                del self.delegations[name]
+            name = name.partition('.')[2]
+
+        return self.root
+
+    def add_delegation(self, zone: str, names: list[str], ttl: int) -> DNSDelegation:
+        delegation = DNSDelegation(zone, names, time.monotonic() + min(ttl, DNSInfrastructureCache.MAX_TTL))
+        self.delegations[zone] = delegation
+        self.delegations.move_to_end(zone)
+        if len(self.delegations) > self.max_entries:
+            self.delegations.popitem(last=False)
+        return delegation
+
+    def remove_delegation(self, zone: str):
+        self.delegations.pop(zone, None)
+
+    def get_addresses(self, name: str) -> list[str] | None:
+        '''
+        Returns the live addresses of the name server or None if they are not known
+        '''
+        hint = self.hints.get(name)
+        if hint is not None:
+            return hint
+
+        entry = self.addresses.get(name)
+        if entry is None:
+            return None
+
+        addresses, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self.addresses[name]
+            return None
+
+        self.addresses.move_to_end(name)
+        return addresses
+
+    def add_addresses(self, name: str, addresses: list[str], ttl: int):
+        self.addresses[name] = (addresses, time.monotonic() + min(ttl, DNSInfrastructureCache.MAX_TTL))
+        self.addresses.move_to_end(name)
+        if len(self.addresses) > self.max_entries:
+            self.addresses.popitem(last=False)
+
+class DNSIterativeResolver:
+    '''
+    Resolves the queries itself, following the referrals from the root servers
+    down to the servers authoritative for the name, instead of forwarding them
+
+    It is used by the DNSForwarder in place of its upstream transport, so the
+    answears are cached, coalesced and served stale like the forwarded ones
+
+    The referrals fill a DNSInfrastructureCache, so once the servers of a zone are
+    known its names are resolved with a single query. The glue addresses are only
+    taken from the servers of a zone above the name server, the names without glue
+    are resolved with nested lookups at most MAX_DEPTH deep. The CNAME chains are
+    followed, at most MAX_CNAMES long, and the answears of the chain are merged
+
+    The servers are tried from the smallest smoothed RTT like in a DNSUpstreamPool,
+    one query at a time, and the next one is asked if a server fails. A lookup never
+    follows more than MAX_REFERRALS referrals nor sends more than MAX_QUERIES queries,
+    and at most max_outstanding queries of all the lookups wait for an answear at once
+
+    The queries are sent to port on every server, so a local hierarchy of
+    authoritative servers can stand in for the real one
+    '''
+
+    MAX_REFERRALS = 16
+    MAX_QUERIES = 48
+    MAX_DEPTH = 3
+    MAX_CNAMES = 8
+
+    def __init__(
+            self,
+            root_hints: list[str],
+            port: int = 53,
+            max_outstanding: int = 256,
+            sockets_count: int = 4,
+            timeout: float = 1.0,
+            max_entries: int = 10000
+    ):
+        # every server is asked once, a failed query goes to the next server
+        self.transport = DNSUpstreamTransport(None, sockets_count, timeout, 0)
+        self.infrastructure = DNSInfrastructureCache(root_hints, max_entries)
+        self.port = port
+        self.outstanding = asyncio.Semaphore(max_outstanding)
+        self.max_entries = max_entries
+
+        # server address -> its RTT and failures
+        self.stats: OrderedDict[str, DNSUpstreamStats] = OrderedDict()
+
+    async def open(self):
+        await self.transport.open()
+
+    def close(self):
+        self.transport.close()
+
+    async def query(self, query: bytes) -> bytes:
+        '''
+        Resolves the question of the query and returns the response, with
+        the query ID and question, recursion available and not authoritative
+
+        Raises a DNSServerError if the name could not be resolved
+        '''
+        try:
+            end = question_end(query)
+            name = read_name(query, 12).lower()
+            qtype, qclass = struct.unpack_from('!HH', query, end - 4)
+        except (IndexError, struct.error):
+            raise DNSServerError("Invalid question")
+
+        budget = [DNSIterativeResolver.MAX_QUERIES]
+        answears: list[DNSDecodedRecord] = []
+        seen = {name}
+
+        # the responses are decoded when they are received, any error
+        # left is a bug and the client gets a SERVER_FAILURE for it
+        try:
+            for _ in range(DNSIterativeResolver.MAX_CNAMES + 1):
+                response, records = await self.__resolve(name, qtype, qclass, budget, 0)
+                target = DNSIterativeResolver.__follow_cnames(response, records, name, qtype, answears, seen)
+                if target is None:
+                    break
+                name = target
+            else:
+                raise DNSServerError(f"CNAME chain of {read_name(query, 12)} too long")
+
+            return DNSIterativeResolver.__build_response(query, end, response, records, answears)
+        except (IndexError, ValueError, OverflowError, struct.error) as error:
+            raise DNSServerError(f"Invalid response for {read_name(query, 12)}: {error}")
+
+    async def query_tcp(self, query: bytes) -> bytes:
+        '''
+        Same as query, whose responses are already complete
+        '''
+        return await self.query(query)
+
+    async def __resolve(
+            self,
+            name: str,
+            qtype: int,
+            qclass: int,
+            budget: list[int],
+            depth: int
+    ) -> tuple[bytes, list[DNSDecodedRecord]]:
+        '''
+        Follows the referrals from the deepest known delegation of the name and
+        returns the response of a server authoritative for it and its records
+        '''
+        question = encode_name(name) + struct.pack('!HH', qtype, qclass)
+        # no recursion desired and EDNS, so the referrals fit in UDP
+        packet = struct.pack('!HHHHHH', 0, 0, 1, 0, 0, 1) + question + build_opt()
+
+        delegation = self.infrastructure.find(name)
+        glue: dict[str, list[str]] = {}
+
+        for _ in range(DNSIterativeResolver.MAX_REFERRALS):
+            try:
+                addresses = await self.__addresses(delegation, glue, budget, depth)
+            except DNSServerError:
+                if glue or not delegation.zone:
+                    raise
+                # the addresses of a cached delegation expired before it, ask the zone above again
+                self.infrastructure.remove_delegation(delegation.zone)
+                delegation = self.infrastructure.find(delegation.zone)
+                continue
+
+            response, records = await self.__ask(addresses, packet, budget)
+
+            referral = self.__referral(response, records, name, delegation.zone)
+            if referral is None:
+                return response, records
+            delegation, glue = referral
+
+        raise DNSServerError(f"Too many referrals for {name}")
+
+    async def __addresses(
+            self,
+            delegation: DNSDelegation,
+            glue: dict[str, list[str]],
+            budget: list[int],
+            depth: int
+    ) -> list[str]:
+        '''
+        Returns the addresses of the name servers of the delegation, from the glue
+        of the referral, the cache or, if none is known, looking up a name server
+        '''
+        addresses = []
+        missing = []
+        for name in delegation.names:
+            known = glue.get(name) or self.infrastructure.get_addresses(name)
+            if known:
+                addresses += known
+            else:
+                missing.append(name)
+
+        if addresses:
+            return addresses
+
+        if depth >= DNSIterativeResolver.MAX_DEPTH:
+            raise DNSServerError(f"Name servers of {delegation.zone or '.'} nested too deep")
+
+        for name in missing:
+            # a name server inside its own zone can't be found without glue
+            if delegation.zone and in_zone(name, delegation.zone):
+                continue
+
+            try:
+                response, records = await self.__resolve(name, A_TYPE, IN_CLASS, budget, depth + 1)
+            except DNSServerError:
+                continue
+
+            found = [
+                (record.ttl, '.'.join(str(byte) for byte in record.rdata[0]))
+                for record in records
+                if record.section == 0 and record.rtype == A_TYPE and len(record.rdata[0]) == 4
+                and record.name.lower() == name
+            ]
+            if found:
+                addresses = [address for _, address in found]
+                self.infrastructure.add_addresses(name, addresses, min(ttl for ttl, _ in found))
+                return addresses
+
+        raise DNSServerError(f"No address for the name servers of {delegation.zone or '.'}")
+
+    async def __ask(self, addresses: list[str], packet: bytes, budget: list[int]) -> tuple[bytes, list[DNSDecodedRecord]]:
+        '''
+        Sends the query to the servers, the best one first, until one of them
+        answears, and returns its response and its records, decoded
+
+        A server which doesn't answear, answears with an error other than
+        NAME_ERROR or with a malformed response, including a name which
+        can't be decoded, is given up for the next one
+        '''
+        error = DNSServerError("No name server to ask")
+
+        for address in self.__order(addresses):
+            if budget[0] <= 0:
+                raise DNSServerError("Too many queries for one lookup")
+            budget[0] -= 1
+
+            stats = self.__stats(address)
+            server = (address, self.port)
+            started = time.monotonic()
+            try:
+                async with self.outstanding:
+                    response = await self.transport.query(packet, server)
+                    if response[2] & 0b00000010:
+                        response = await self.transport.query_tcp(packet, server)
+            except DNSServerError as server_error:
+                stats.add_failure()
+                error = server_error
+                continue
+
+            stats.add_rtt(time.monotonic() - started)
+
+            response_code = response[3] & 0b00001111
+            if not response[2] & 0b10000000 or response_code not in (0, 3):
+                error = DNSServerError(f"{address} answered with response code {response_code}")
+                continue
+
+            try:
+                records = [
+                    DNSDecodedRecord(
+                        record.section,
+                        read_name(response, record.offset),
+                        record.rtype,
+                        record.rclass,
+                        record.ttl,
+                        read_rdata(response, record)
+                    )
+                    for record in iter_records(response)
+                ]
+            except (IndexError, struct.error):
+                error = DNSServerError(f"Malformed response from {address}")
+                continue
+
+            return response, records
+
+        raise error
+
+    def __referral(
+            self,
+            response: bytes,
+            records: list[DNSDecodedRecord],
+            name: str,
+            zone: str
+    ) -> tuple[DNSDelegation, dict[str, list[str]]] | None:
+        '''
+        Returns the delegation and the glue addresses of a referral, caching them,
+        or None if the response is an answear
+
+        A referral has no answear and the NS records of a zone below the zone of
+        the server and above the name in its authority section, any other NS
+        records in the authority section are ignored
+        '''
+        if response[3] & 0b00001111 or any(record.section == 0 for record in records):
+            return None
+
+        child = None
+        names = []
+        ttl = DNSInfrastructureCache.MAX_TTL
+        for record in records:
+            if record.section != 1 or record.rtype != NS_TYPE:
+                continue
+
+            owner = record.name.lower()
+            if child is None:
+                if owner == zone or not in_zone(owner, zone) or not in_zone(name, owner):
+                    return None
+                child = owner
+            elif owner != child:
+                continue
+
+            names.append(record.rdata[0].lower())
+            ttl = min(ttl, record.ttl)
+
+        if child is None:
+            return None
+
+        # only the server of the zone above the name servers can be trusted with their addresses
+        glue: dict[str, list[str]] = {}
+        glue_ttls: dict[str, int] = {}
+        for record in records:
+            if record.section != 2 or record.rtype != A_TYPE or len(record.rdata[0]) != 4:
+                continue
+
+            owner = record.name.lower()
+            if owner not in names or not in_zone(owner, zone):
+                continue
+
+            glue.setdefault(owner, []).append('.'.join(str(byte) for byte in record.rdata[0]))
+            glue_ttls[owner] = min(glue_ttls.get(owner, record.ttl), record.ttl)
+
+        for owner, addresses in glue.items():
+            self.infrastructure.add_addresses(owner, addresses, glue_ttls[owner])
+
+        return self.infrastructure.add_delegation(child, names, ttl), glue
+
+    @staticmethod
+    def __follow_cnames(
+            response: bytes,
+            records: list[DNSDecodedRecord],
+            name: str,
+            qtype: int,
+            answears: list[DNSDecodedRecord],
+            seen: set[str]
+    ) -> str | None:
+        '''
+        Adds the answears for the name to answears, following its CNAME chain inside
+        the response, and returns the end of the chain if it has to be resolved
+        again or None if the response has the final answear
+
+        The chain ends at a name seen before, so a CNAME loop is answeared as it is
+        '''
+        current = name
+        while True:
+            owned = [record for record in records if record.section == 0 and record.name.lower() == current]
+            final = [record for record in owned if record.rtype == qtype or qtype == ANY_TYPE]
+            cname = next((record for record in owned if record.rtype == CNAME_TYPE), None)
+
+            if final or cname is None:
+                answears += final
+                break
+
+            answears.append(cname)
+            target = cname.rdata[0].lower()
+            if target in seen:
+                return None
+
+            seen.add(target)
+            current = target
+
+        if current == name or final or response[3] & 0b00001111:
+            return None
+
+        # a negative answear for the target from the same zone is final
+        if any(record.section == 1 and record.rtype == SOA_TYPE for record in records):
+            return None
+
+        return current
+
+    @staticmethod
+    def __build_response(
+            query: bytes,
+            end: int,
+            response: bytes,
+            records: list[DNSDecodedRecord],
+            answears: list[DNSDecodedRecord]
+    ) -> bytes:
+        '''
+        Builds the response to the query from the answears, with the response
+        code of the last authoritative response and, if it has no answear,
+        its SOA record for the negative caching
+
+        The names are compressed again, the OPT record is only
+        sent if the query has one, with the payload size of the server
+        '''
+        response_code = response[3] & 0b00001111
+        authority = []
+        if not answears or response_code:
+            authority = [record for record in records if record.section == 1 and record.rtype == SOA_TYPE]
+
+        try:
+            opt = build_opt() if query[10:12] != b'\x00\x00' and find_opt(query) is not None else b''
+        except (IndexError, struct.error):
+            opt = b''
+
+        # response, the opcode of the query, recursion desired and available
+        flags = 0b1000000110000000 | (query[2] & 0b01111000) << 8 | response_code
+        message = bytearray(query[:2])
+        message += struct.pack('!HHHHH', flags, 1, len(answears), len(authority), 1 if opt else 0)
+        message += query[12:end]
+
+        compressor = DNSNameCompressor(read_name(query, 12))
+        for _, owner, rtype, rclass, ttl, rdata in answears + authority:
+            message += compressor.encode(owner, len(message))
+            message += struct.pack('!HHI', rtype, rclass, ttl)
+            rdlength_offset = len(message)
+            message += b'\x00\x00'
+            for part in rdata:
+                message += part if isinstance(part, bytes) else compressor.encode(part, len(message))
+            struct.pack_into('!H', message, rdlength_offset, len(message) - rdlength_offset - 2)
+
+        return bytes(message + opt)
+
+    def __order(self, addresses: list[str]) -> list[str]:
+        '''
+        Returns the addresses without duplicates, the healthy servers
+        first, each group sorted from the smallest smoothed RTT
+        '''
+        now = time.monotonic()
+
+        def key(address: str) -> tuple[bool, float]:
+            stats = self.stats.get(address)
+            if stats is None:
+                return (False, 0.0)
+            failing = stats.failure_rate > DNSUpstreamPool.MAX_FAILURE_RATE and now - stats.failed_at < DNSUpstreamPool.RETRY_INTERVAL
+            return (failing, stats.srtt if stats.srtt is not None else 0.0)
+
+        return sorted(dict.fromkeys(addresses), key=key)
+
+    def __stats(self, address: str) -> DNSUpstreamStats:
+        stats = self.stats.get(address)
+        if stats is None:
+            stats = self.stats[address] = DNSUpstreamStats()
+            if len(self.stats) > self.max_entries:
+                self.stats.popitem(last=False)
+        else:
+            self.stats.move_to_end(address)
+        return stats
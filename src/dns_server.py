@@ -0,0 +1,487 @@
+import signal
+import socket
+import asyncio
+from collections import deque
+from typing import Callable
+from time import perf_counter_ns
+from dns_packet import DNSPacket
+from dns_answear import DNSAnswear
+from dns_forwarder import DNSForwarder
+from dns_templates import DNSResponseTemplates
+from dns_query_log import DNSQueryLog
+from dns_metrics import DNSMetrics, serve_metrics
+from dns_mmsg import DNSMMsgSocket
+from dns_wire import MIN_UDP_PAYLOAD_SIZE, truncate, udp_payload_size
+from dns_enums import DNSHeaderResponseCode, DNSHeaderRecursionDesired, DNSQuestionType
+from dns_errors import DNSServerError
+
+class DNSQueryHandler:
+    '''
+    Answers the queries from the zones and forwards the ones which
+    are not found to the upstream server
+
+    The forwarded queries run as separate tasks, so waiting for the upstream
+    server never holds up the answers from the zones
+
+    If templates are given, the answers from the zones are memoized
+    and repeated queries are answered without being parsed. If a query
+    log is given, every answered query is added to it
+
+    If metrics are given, every query is counted and timed, and the
+    CHAOS class stats.bind TXT query is answered with the statistics
+    '''
+
+    def __init__(
+            self,
+            forwarder: DNSForwarder,
+            templates: DNSResponseTemplates | None = None,
+            query_log: DNSQueryLog | None = None,
+            metrics: DNSMetrics | None = None
+    ):
+        self.forwarder = forwarder
+        self.templates = templates
+        self.query_log = query_log
+        self.metrics = metrics
+
+        # keep a reference to the running tasks so they are not garbage collected
+        self.tasks: set[asyncio.Task] = set()
+
+    def handle(self, data: bytes, reply: Callable[[bytes], None], tcp: bool = False) -> bool:
+        '''
+        Handles one query, reply is called with the response bytes
+        either right away or after the upstream server answers
+
+        tcp tells if the query was received over TCP, in which case
+        the complete upstream response is sent even if it is large
+
+        Returns False if the query is malformed and dropped without any reply
+        '''
+        if self.templates is not None:
+            template = self.templates.get(data)
+            if template is not None:
+                response_data, response_code, qtype = template
+                reply(response_data)
+                self.__log(data, DNSQueryLog.TEMPLATE, qtype, response_code)
+                return True
+
+        metrics = self.metrics
+        if metrics is not None:
+            started = perf_counter_ns()
+
+        # the question is decoded while building the response,
+        # so a malformed name is only found there
+        try:
+            packet = DNSPacket(data)
+
+            if metrics is not None:
+                metrics.parse.observe(perf_counter_ns() - started)
+
+            response_data, response_code = packet.build_response(metrics)
+        except Exception:
+            self.__log(data, DNSQueryLog.MALFORMED)
+            return False
+
+        if response_code == DNSHeaderResponseCode.NAME_ERROR:
+            # the stats.bind query is never in the zones, so it is only checked for here
+            if metrics is not None and metrics.is_stats_query(packet.question):
+                reply(metrics.build_stats_response(packet.header, packet.question, packet.build_opt_record()))
+                self.__log(data, DNSQueryLog.STATS, packet.question.qtype, DNSHeaderResponseCode.NO_ERROR)
+                return True
+
+            # redirect to the upstream server if the domain is not found
+            # and recursion is desired
+            if packet.header.flags.rd == DNSHeaderRecursionDesired.RECURSION:
+                task = asyncio.create_task(self.__forward(packet, data, reply, tcp))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+                return True
+
+        reply(response_data)
+        self.__log(data, DNSQueryLog.ZONE, packet.question.qtype, response_code)
+
+        if self.templates is not None:
+            self.templates.put(data, response_data, response_code, packet.question.qtype)
+
+        return True
+
+    async def __forward(self, packet: DNSPacket, data: bytes, reply: Callable[[bytes], None], tcp: bool):
+        '''
+        Forwards the query and sends the upstream response back to the client
+        '''
+        try:
+            response_data, response_code = await self.forwarder.redirect(data, tcp)
+        except (DNSServerError, OSError) as error:
+            reply(packet.build_error_response(DNSHeaderResponseCode.SERVER_FAILURE))
+            self.__log(data, DNSQueryLog.ERROR, packet.question.qtype, DNSHeaderResponseCode.SERVER_FAILURE, str(error))
+            return
+
+        reply(response_data)
+        self.__log(data, DNSQueryLog.UPSTREAM, packet.question.qtype, response_code)
+
+    def __log(
+            self,
+            data: bytes,
+            source: str,
+            qtype: DNSQuestionType | None = None,
+            response_code: DNSHeaderResponseCode | None = None,
+            error: str | None = None
+    ):
+        if self.metrics is not None:
+            self.metrics.count(source, qtype, response_code)
+        if self.query_log is not None:
+            self.query_log.log(data, source, response_code, error)
+
+class DNSServerProtocol(asyncio.DatagramProtocol):
+    '''
+    Datagram protocol receiving the queries from the clients
+
+    The responses larger than the UDP payload size of the client, 512 bytes
+    or the size in the OPT record of the query, are truncated
+    '''
+
+    def __init__(self, handler: DNSQueryHandler):
+        self.handler = handler
+        self.transport = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address: tuple[str, int]):
+        self.handler.handle(data, lambda response: self.transport.sendto(udp_response(data, response), address))
+
+def udp_response(query: bytes, response: bytes) -> bytes:
+    '''
+    Returns the response truncated if it is larger than what the client accepts over UDP
+    '''
+    if len(response) > MIN_UDP_PAYLOAD_SIZE:
+        return truncate(response, udp_payload_size(query))
+    return response
+
+class DNSBatchUDPServer:
+    '''
+    UDP socket of the server read and written in batches, instead of one
+    datagram per wakeup of the event loop like a DatagramProtocol
+
+    Every time the socket is readable, up to batch_size queries are received
+    and handled, then the responses already known, the ones from the zones,
+    are sent together. The responses coming later, from the upstream server,
+    are sent as soon as they are ready
+
+    With recvmmsg and sendmmsg (Linux) each batch is one system call through
+    a DNSMMsgSocket, otherwise the queries are received with recvfrom_into
+    into a preallocated buffer. The queries are copied out of the buffers,
+    which are reused, since the query log and the upstream queries keep them
+
+    Responses waiting for the socket to be writable are queued, at most
+    MAX_QUEUED of them, any response over it is dropped
+    '''
+
+    # larger than any query, with an OPT record and its options
+    BUFFER_SIZE = 4096
+    MAX_QUEUED = 4096
+
+    def __init__(self, handler: DNSQueryHandler, sock: socket.socket, batch_size: int, mmsg: bool = True):
+        if batch_size < 1:
+            raise ValueError(f"Invalid UDP batch size {batch_size}")
+
+        self.handler = handler
+        self.sock = sock
+        self.batch_size = batch_size
+
+        self.mmsg = DNSMMsgSocket(sock, batch_size, DNSBatchUDPServer.BUFFER_SIZE) if mmsg and DNSMMsgSocket.available() else None
+        self.buffer = bytearray(DNSBatchUDPServer.BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+
+        # (response, address) of the responses not sent yet
+        self.outgoing: deque[tuple[bytes, tuple]] = deque()
+        # whether a batch is being handled, its responses are sent at its end
+        self.batching = False
+        self.writing = False
+
+    def start(self):
+        self.sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self.__read_ready)
+
+    def close(self):
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self.sock.fileno())
+        loop.remove_writer(self.sock.fileno())
+        self.sock.close()
+
+    def __read_ready(self):
+        try:
+            queries = self.mmsg.receive() if self.mmsg is not None else self.__receive()
+        except OSError:
+            return
+
+        self.batching = True
+        try:
+            for data, address in queries:
+                self.handler.handle(data, lambda response, data=data, address=address: self.__reply(data, response, address))
+        finally:
+            self.batching = False
+
+        self.__flush()
+
+    def __receive(self) -> list[tuple[bytes, tuple]]:
+        '''
+        Receives the waiting queries, at most batch_size, one recvfrom_into each
+        '''
+        queries = []
+        for _ in range(self.batch_size):
+            try:
+                length, address = self.sock.recvfrom_into(self.buffer)
+            except BlockingIOError:
+                break
+            queries.append((bytes(self.view[:length]), address))
+        return queries
+
+    def __reply(self, query: bytes, response: bytes, address: tuple):
+        if len(self.outgoing) >= DNSBatchUDPServer.MAX_QUEUED:
+            return
+
+        self.outgoing.append((udp_response(query, response), address))
+        if not self.batching and not self.writing:
+            self.__flush()
+
+    def __flush(self):
+        '''
+        Sends the queued responses until the socket buffer is full, then
+        waits for the socket to be writable to send the rest
+        '''
+        outgoing = self.outgoing
+        while outgoing:
+            try:
+                if self.mmsg is not None:
+                    sent = self.mmsg.send([outgoing[index] for index in range(min(len(outgoing), self.batch_size))])
+                else:
+                    self.sock.sendto(*outgoing[0])
+                    sent = 1
+            except BlockingIOError:
+                if not self.writing:
+                    self.writing = True
+                    asyncio.get_running_loop().add_writer(self.sock.fileno(), self.__flush)
+                return
+            except OSError:
+                # like a DatagramTransport, a response which can't be sent is dropped
+                sent = 1
+
+            for _ in range(sent):
+                outgoing.popleft()
+
+        if self.writing:
+            self.writing = False
+            asyncio.get_running_loop().remove_writer(self.sock.fileno())
+
+class DNSTCPServerProtocol(asyncio.Protocol):
+    '''
+    Stream protocol of one TCP connection from a client (RFC 7766)
+
+    Every message is prefixed by its length on two bytes. The client may
+    pipeline several queries, each one is handled as soon as it is read and
+    the responses are sent back as they are ready, so out of order. The
+    connection is closed after idle_timeout seconds without any query or
+    pending response, and right away if there are already max_connections
+    '''
+
+    def __init__(self, handler: DNSQueryHandler, connections: set, max_connections: int, idle_timeout: float):
+        self.handler = handler
+        self.connections = connections
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+
+        self.transport = None
+        self.buffer = bytearray()
+        self.pending = 0
+        self.eof = False
+        self.idle_timer: asyncio.TimerHandle | None = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+        if len(self.connections) >= self.max_connections:
+            transport.close()
+            return
+
+        self.connections.add(self)
+        self.__reset_idle_timer()
+
+    def connection_lost(self, exc: Exception | None):
+        self.connections.discard(self)
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+
+    def data_received(self, data: bytes):
+        self.buffer += data
+
+        while len(self.buffer) >= 2:
+            length = int.from_bytes(self.buffer[:2], byteorder='big')
+            if len(self.buffer) < length + 2:
+                break
+
+            query = bytes(self.buffer[2:length + 2])
+            del self.buffer[:length + 2]
+
+            self.pending += 1
+            if not self.handler.handle(query, self.__reply, tcp=True):
+                self.pending -= 1
+
+        self.__reset_idle_timer()
+
+    def eof_received(self) -> bool:
+        # keep the connection half open until the pending responses are sent
+        self.eof = True
+        return self.pending > 0
+
+    def pause_writing(self):
+        # stop reading queries while the client doesn't read the responses
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def __reply(self, response: bytes):
+        self.pending -= 1
+
+        if self.transport.is_closing():
+            return
+
+        self.transport.write(len(response).to_bytes(2, byteorder='big') + response)
+
+        if self.eof and self.pending == 0:
+            self.transport.close()
+            return
+        self.__reset_idle_timer()
+
+    def __reset_idle_timer(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+        self.idle_timer = asyncio.get_running_loop().call_later(self.idle_timeout, self.__close_if_idle)
+
+    def __close_if_idle(self):
+        if self.pending:
+            self.__reset_idle_timer()
+            return
+        self.transport.close()
+
+class DNSZonesReloader:
+    '''
+    Reloads the zones without stopping the server
+
+    The changed zone files are compiled in another thread, so the queries
+    keep being answered from the current zones, which are then swapped
+    with the new ones on the event loop thread
+    '''
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.tasks: set[asyncio.Task] = set()
+
+    async def reload(self):
+        # a reload asked for while another one runs starts after it, so it sees the latest files
+        async with self.lock:
+            zone_files = await asyncio.to_thread(DNSAnswear.read_zone_files)
+            DNSAnswear.swap_zones(zone_files)
+
+    def schedule(self):
+        '''
+        Reloads the zones in the background, used from the SIGHUP handler
+        '''
+        task = asyncio.create_task(self.reload())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def watch(self, interval: float):
+        '''
+        Checks the zone files for changes every interval seconds, which must be positive
+        '''
+        if not interval > 0:
+            raise ValueError(f"Invalid zones reload interval {interval}")
+
+        while True:
+            await asyncio.sleep(interval)
+            await self.reload()
+
+async def serve(
+        host: str,
+        port: int,
+        handler: DNSQueryHandler,
+        reuse_port: bool = False,
+        metrics_port: int | None = None,
+        tcp_max_connections: int = 1024,
+        tcp_idle_timeout: float = 10.0,
+        zones_reload_interval: float | None = None,
+        udp_batch_size: int | None = None
+):
+    '''
+    Serves the queries received on the host and port until cancelled
+    or until SIGTERM is received
+
+    The queries are received both over UDP and TCP, at most tcp_max_connections
+    TCP connections are kept open and each is closed after tcp_idle_timeout
+    seconds without any query
+
+    With reuse_port the sockets are bound with SO_REUSEPORT, so
+    several worker processes can serve the same host and port
+
+    With metrics_port the metrics of the handler are served over HTTP on the host and that port
+
+    The zones are reloaded on SIGHUP and, with zones_reload_interval, whenever
+    a zone file changes, checking the files every zones_reload_interval seconds
+
+    With udp_batch_size the UDP queries are received and answered in
+    batches of up to that many datagrams by a DNSBatchUDPServer
+    '''
+    loop = asyncio.get_running_loop()
+
+    await handler.forwarder.open()
+
+    metrics_server = None
+    if metrics_port is not None and handler.metrics is not None:
+        metrics_server = await serve_metrics(host, metrics_port, handler.metrics)
+
+    if udp_batch_size is not None:
+        sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        transport = DNSBatchUDPServer(handler, sock, udp_batch_size)
+        transport.start()
+    else:
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: DNSServerProtocol(handler),
+            local_addr=(host, port),
+            reuse_port=reuse_port
+        )
+
+    connections: set[DNSTCPServerProtocol] = set()
+    tcp_server = await loop.create_server(
+        lambda: DNSTCPServerProtocol(handler, connections, tcp_max_connections, tcp_idle_timeout),
+        host,
+        port,
+        reuse_port=reuse_port
+    )
+
+    reloader = DNSZonesReloader()
+    loop.add_signal_handler(signal.SIGHUP, reloader.schedule)
+
+    watcher = None
+    if zones_reload_interval is not None:
+        watcher = asyncio.create_task(reloader.watch(zones_reload_interval))
+
+    # return normally on SIGTERM, so the caller can clean up (like flushing the query log)
+    stopped = loop.create_future()
+    loop.add_signal_handler(signal.SIGTERM, lambda: stopped.done() or stopped.set_result(None))
+
+    try:
+        await stopped
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        transport.close()
+        tcp_server.close()
+        for connection in list(connections):
+            connection.transport.close()
+        handler.forwarder.close()
+        if metrics_server is not None:
+            metrics_server.close()
@@ -0,0 +1,107 @@
+import os
+import gc
+import sys
+import time
+import signal
+import traceback
+from typing import Callable
+from datetime import datetime
+
+class DNSSupervisor:
+    '''
+    Forks the worker processes and restarts any worker which dies
+
+    Everything loaded before calling run (like the zones) is shared with the
+    workers copy-on-write. Each worker is expected to bind its own socket with
+    SO_REUSEPORT, so the kernel spreads the queries across all of them.
+    run_worker is called with the index of the worker
+
+    SIGHUP is passed on to the workers, which reload their zones
+    '''
+
+    # seconds to wait before restarting a worker which died
+    RESTART_DELAY = 1.0
+
+    def __init__(self, workers_count: int, run_worker: Callable[[int], None]):
+        self.workers_count = workers_count
+        self.run_worker = run_worker
+
+        # pid -> worker index
+        self.workers: dict[int, int] = {}
+        self.stopping = False
+
+    def run(self):
+        '''
+        Starts the workers and supervises them until SIGINT or SIGTERM
+        '''
+        # move the loaded objects out of the garbage collector generations
+        # so collecting in the workers doesn't touch the shared pages
+        gc.freeze()
+
+        signal.signal(signal.SIGINT, self.__stop)
+        signal.signal(signal.SIGTERM, self.__stop)
+        signal.signal(signal.SIGHUP, self.__reload)
+
+        for index in range(self.workers_count):
+            self.__start_worker(index)
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            index = self.workers.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+
+            self.__log(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+            time.sleep(DNSSupervisor.RESTART_DELAY)
+
+            if not self.stopping:
+                self.__start_worker(index)
+
+    def __start_worker(self, index: int):
+        pid = os.fork()
+
+        if pid != 0:
+            self.workers[pid] = index
+            self.__log(f"Started worker {index} (pid {pid})")
+            return
+
+        # the supervisor stops the workers with SIGTERM, SIGHUP is
+        # ignored until the worker is ready to reload its zones
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        status = 0
+        try:
+            self.run_worker(index)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(status)
+
+    def __stop(self, signum: int, frame):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def __reload(self, signum: int, frame):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    def __log(self, message: str):
+        curent_date = datetime.strftime(datetime.now(), "%d-%m-%Y %H:%M:%S")
+        print(f"[{curent_date}] {message}", flush=True)
@@ -0,0 +1,56 @@
+from dns_answear import DNSAnswear
+from dns_enums import DNSHeaderResponseCode, DNSQuestionType
+
+class DNSResponseTemplates:
+    '''
+    Memoized responses of the queries answered from the zones
+
+    Such a response only depends on the flags and the question of the query,
+    so the key is the query without its ID and the template is the response
+    without its ID. A repeated query is answered by writing its ID in front
+    of the template, without parsing anything past the header
+
+    The templates are dropped whenever the zones are loaded again
+    '''
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.templates: dict[bytes, tuple[bytes, DNSHeaderResponseCode, DNSQuestionType | None]] = {}
+        self.generation = DNSAnswear.generation
+
+    def get(self, query: bytes) -> tuple[bytes, DNSHeaderResponseCode, DNSQuestionType | None] | None:
+        '''
+        Returns the response for the query, its response code and the
+        question type or None if there is no template
+        '''
+        if self.generation != DNSAnswear.generation:
+            self.templates.clear()
+            self.generation = DNSAnswear.generation
+            return None
+
+        template = self.templates.get(query[2:])
+        if template is None:
+            return None
+
+        response, response_code, qtype = template
+        return query[:2] + response, response_code, qtype
+
+    def put(
+            self,
+            query: bytes,
+            response: bytes,
+            response_code: DNSHeaderResponseCode,
+            qtype: DNSQuestionType | None = None
+    ):
+        '''
+        Stores the response of the query as a template, the oldest
+        template is dropped if there are already max_entries
+        '''
+        if self.generation != DNSAnswear.generation:
+            self.templates.clear()
+            self.generation = DNSAnswear.generation
+
+        if len(self.templates) >= self.max_entries:
+            del self.templates[next(iter(self.templates))]
+
+        self.templates[query[2:]] = (response[2:], response_code, qtype)
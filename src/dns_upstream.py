@@ -0,0 +1,264 @@
+import asyncio
+import random
+from dns_errors import DNSServerError
+from dns_wire import question_end
+
+class DNSUpstreamProtocol(asyncio.DatagramProtocol):
+    '''
+    Datagram protocol of one of the upstream sockets, it hands
+    every received datagram to the DNSUpstreamTransport
+    '''
+
+    def __init__(self, owner: 'DNSUpstreamTransport', index: int):
+        self.owner = owner
+        self.index = index
+
+    def datagram_received(self, data: bytes, address: tuple[str, int]):
+        self.owner.response_received(self.index, data, address)
+
+class DNSUpstreamTCPConnection:
+    '''
+    One TCP connection to the upstream server, reused for all the queries
+    sent over TCP (RFC 7766)
+
+    The queries are pipelined over the connection and the responses, which
+    may come out of order, are matched back by their ID and question. The
+    connection is opened on the first query and opened again after the
+    upstream server closes it
+    '''
+
+    def __init__(self, upstream: tuple[str, int], timeout: float = 1.0):
+        self.upstream = upstream
+        self.timeout = timeout
+
+        self.writer: asyncio.StreamWriter | None = None
+        self.reader_task: asyncio.Task | None = None
+        self.connecting = asyncio.Lock()
+        self.random = random.SystemRandom()
+
+        # transaction ID -> (response future, sent question)
+        self.pending: dict[int, tuple[asyncio.Future, bytes]] = {}
+
+    async def query(self, query: bytes) -> bytes:
+        '''
+        Sends the query upstream over the connection and returns the response with the original query ID
+
+        Raises a DNSServerError if there is no response within timeout seconds
+        '''
+        writer = await self.__connect()
+
+        transaction_id = self.random.getrandbits(16)
+        while transaction_id in self.pending:
+            transaction_id = self.random.getrandbits(16)
+
+        packet = transaction_id.to_bytes(2, byteorder='big') + query[2:]
+        question = query[12:question_end(query)]
+
+        response = asyncio.get_running_loop().create_future()
+        self.pending[transaction_id] = (response, question)
+
+        try:
+            writer.write(len(packet).to_bytes(2, byteorder='big') + packet)
+            upstream_data = await asyncio.wait_for(response, self.timeout)
+        except TimeoutError:
+            raise DNSServerError(f"No TCP response from {self.upstream[0]}")
+        finally:
+            self.pending.pop(transaction_id, None)
+
+        # rewrite the ID back to the client's one
+        return query[:2] + upstream_data[2:]
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+
+        self.__fail_pending("Upstream TCP connection closed")
+
+    async def __connect(self) -> asyncio.StreamWriter:
+        '''
+        Returns the open connection, opening it if there is none
+        '''
+        async with self.connecting:
+            if self.writer is None or self.writer.is_closing():
+                try:
+                    reader, self.writer = await asyncio.wait_for(asyncio.open_connection(*self.upstream), self.timeout)
+                except TimeoutError:
+                    raise DNSServerError(f"Could not connect to {self.upstream[0]} over TCP")
+                self.reader_task = asyncio.create_task(self.__read_forever(reader, self.writer))
+            return self.writer
+
+    async def __read_forever(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''
+        Reads the length prefixed responses and resolves the matching pending queries
+        '''
+        try:
+            while True:
+                length = int.from_bytes(await reader.readexactly(2), byteorder='big')
+                data = await reader.readexactly(length)
+                if length < 12:
+                    continue
+
+                pending = self.pending.get(int.from_bytes(data[:2], byteorder='big'))
+                if pending is None:
+                    continue
+
+                response, question = pending
+                if not response.done() and data[12:12 + len(question)] == question:
+                    response.set_result(data)
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+
+        # the upstream server closed the connection, the next query opens a new one
+        writer.close()
+        if self.writer is writer:
+            self.writer = None
+            self.__fail_pending("Upstream TCP connection closed")
+
+    def __fail_pending(self, message: str):
+        for response, _ in self.pending.values():
+            if not response.done():
+                response.set_exception(DNSServerError(message))
+
+class DNSUpstreamTransport:
+    '''
+    Long lived UDP sockets multiplexing all the queries sent to one upstream server,
+    or to any server given with each query if there is no upstream server
+
+    Every query is sent with a random transaction ID from a randomly chosen
+    socket, so each one has its own ephemeral source port. A response is
+    matched back by the socket it arrived on, its ID, its source address and
+    its question. Queries not answered within timeout seconds are sent again
+    up to retries times
+
+    The queries sent with query_tcp share one TCP connection to the upstream
+    server, without an upstream server each one opens its own connection
+    '''
+
+    def __init__(self, upstream: tuple[str, int] | None, sockets_count: int = 4, timeout: float = 1.0, retries: int = 2):
+        self.upstream = upstream
+        self.sockets_count = sockets_count
+        self.timeout = timeout
+        self.retries = retries
+
+        self.transports: list[asyncio.DatagramTransport] = []
+        self.random = random.SystemRandom()
+
+        # (socket index, transaction ID) -> (response future, sent question, server address)
+        self.pending: dict[tuple[int, int], tuple[asyncio.Future, bytes, tuple[str, int]]] = {}
+
+        self.tcp = DNSUpstreamTCPConnection(upstream, timeout) if upstream is not None else None
+
+    async def open(self):
+        '''
+        Opens the sockets, each one is bound to a random ephemeral port and
+        connected to the upstream server if there is one
+        '''
+        loop = asyncio.get_running_loop()
+
+        for index in range(self.sockets_count):
+            if self.upstream is not None:
+                endpoint = {"remote_addr": self.upstream}
+            else:
+                endpoint = {"local_addr": ('0.0.0.0', 0)}
+
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda index=index: DNSUpstreamProtocol(self, index),
+                **endpoint
+            )
+            self.transports.append(transport)
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+        if self.tcp is not None:
+            self.tcp.close()
+
+        for response, _, _ in self.pending.values():
+            if not response.done():
+                response.set_exception(DNSServerError("Upstream transport closed"))
+
+    async def query(self, query: bytes, server: tuple[str, int] | None = None) -> bytes:
+        '''
+        Sends the query upstream, or to the server if there is no upstream
+        server, and returns the response with the original query ID
+
+        Raises a DNSServerError if there is no response after all the retries
+        '''
+        address = server if self.upstream is None else self.upstream
+        if address is None:
+            raise DNSServerError("No server to send the query to")
+        if not self.transports:
+            raise DNSServerError("Upstream transport is not open")
+
+        index = self.random.randrange(len(self.transports))
+        transaction_id = self.random.getrandbits(16)
+        while (index, transaction_id) in self.pending:
+            transaction_id = self.random.getrandbits(16)
+
+        packet = transaction_id.to_bytes(2, byteorder='big') + query[2:]
+        question = query[12:question_end(query)]
+
+        response = asyncio.get_running_loop().create_future()
+        self.pending[(index, transaction_id)] = (response, question, address)
+
+        try:
+            for _ in range(self.retries + 1):
+                self.transports[index].sendto(packet, None if self.upstream is not None else address)
+                try:
+                    # shield the future so a timeout doesn't cancel it before the retransmit
+                    upstream_data = await asyncio.wait_for(asyncio.shield(response), self.timeout)
+                    break
+                except TimeoutError:
+                    continue
+            else:
+                raise DNSServerError(f"No response from {address[0]} after {self.retries + 1} tries")
+        finally:
+            self.pending.pop((index, transaction_id), None)
+
+        # rewrite the ID back to the client's one
+        return query[:2] + upstream_data[2:]
+
+    async def query_tcp(self, query: bytes, server: tuple[str, int] | None = None) -> bytes:
+        '''
+        Sends the query upstream over the shared TCP connection, or to the
+        server over a new connection if there is no upstream server, and
+        returns the response with the original query ID
+
+        Raises a DNSServerError if there is no response
+        '''
+        if self.tcp is not None:
+            return await self.tcp.query(query)
+        if server is None:
+            raise DNSServerError("No server to send the query to")
+
+        connection = DNSUpstreamTCPConnection(server, self.timeout)
+        try:
+            return await connection.query(query)
+        except OSError as error:
+            raise DNSServerError(f"Could not query {server[0]} over TCP: {error}")
+        finally:
+            connection.close()
+
+    def response_received(self, index: int, data: bytes, address: tuple[str, int]):
+        '''
+        Resolves the pending query matching the response, anything
+        which doesn't match a pending query is dropped
+        '''
+        if len(data) < 12:
+            return
+
+        pending = self.pending.get((index, int.from_bytes(data[:2], byteorder='big')))
+        if pending is None:
+            return
+
+        response, question, server = pending
+        if response.done() or address[:2] != server or data[12:12 + len(question)] != question:
+            return
+
+        response.set_result(data)
@@ -0,0 +1,237 @@
+import time
+import asyncio
+from collections import deque
+from dns_errors import DNSServerError
+from dns_metrics import DNSMetrics
+from dns_upstream import DNSUpstreamTransport
+
+class DNSUpstreamStats:
+    '''
+    Smoothed round trip time and failure rate of one upstream server
+
+    The smoothed RTT follows the TCP retransmission timer (RFC 6298), except
+    that a sample counts for at most twice the smoothed RTT, so the occasional
+    late answear doesn't hide how fast the server usually is. The failure
+    rate is a moving average of the failed queries and the last RTT samples
+    are kept for the percentile the hedged queries wait for
+    '''
+
+    # weight of a new sample in the smoothed RTT and the failure rate
+    RTT_GAIN = 1 / 8
+    FAILURE_GAIN = 1 / 8
+
+    # number of RTT samples kept for the percentiles
+    SAMPLES = 64
+
+    # the smoothed RTT of a server is multiplied by this every time another
+    # one is chosen, so a server slowed down by a few late answears is tried again
+    DECAY = 0.98
+
+    def __init__(self):
+        # None until the first answear
+        self.srtt: float | None = None
+        self.failure_rate = 0.0
+        self.failed_at = 0.0
+
+        self.samples: deque[float] = deque(maxlen=DNSUpstreamStats.SAMPLES)
+        # the samples sorted, computed again only after new samples
+        self.sorted_samples: list[float] | None = None
+
+    def add_rtt(self, rtt: float):
+        '''
+        Records an answear received after rtt seconds
+        '''
+        self.__smooth(rtt)
+        self.failure_rate -= self.failure_rate * DNSUpstreamStats.FAILURE_GAIN
+        self.samples.append(rtt)
+        self.sorted_samples = None
+
+    def add_failure(self):
+        '''
+        Records a query the upstream server didn't answear
+        '''
+        self.failure_rate += (1 - self.failure_rate) * DNSUpstreamStats.FAILURE_GAIN
+        self.failed_at = time.monotonic()
+
+    def add_slow(self, elapsed: float):
+        '''
+        Records a query abandoned after elapsed seconds because another
+        upstream server answeared first, its RTT is at least elapsed and
+        it counts as failed, so a server which never answears is given up
+        '''
+        if self.srtt is None or elapsed > self.srtt:
+            self.__smooth(elapsed)
+        self.add_failure()
+
+    def __smooth(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+        else:
+            self.srtt += (min(rtt, 2 * self.srtt) - self.srtt) * DNSUpstreamStats.RTT_GAIN
+
+    def decay(self):
+        '''
+        Records a query sent to another upstream server
+        '''
+        if self.srtt is not None:
+            self.srtt *= DNSUpstreamStats.DECAY
+
+    def percentile(self, percentile: float) -> float | None:
+        '''
+        Returns the RTT below which percentile percent of the last
+        samples are, or None if there aren't enough samples yet
+        '''
+        if len(self.samples) < DNSUpstreamStats.SAMPLES // 4:
+            return None
+
+        if self.sorted_samples is None:
+            self.sorted_samples = sorted(self.samples)
+        return self.sorted_samples[min(int(len(self.sorted_samples) * percentile / 100), len(self.sorted_samples) - 1)]
+
+class DNSUpstreamPool:
+    '''
+    Several upstream servers, each one with its own DNSUpstreamTransport,
+    used like a single DNSUpstreamTransport
+
+    A query goes to the healthy upstream server with the smallest smoothed RTT,
+    the servers never answeared yet being tried first. A server whose failure
+    rate is above MAX_FAILURE_RATE is only tried again RETRY_INTERVAL seconds
+    after its last failure. If the chosen server fails, the query is sent to the next one
+
+    With a hedge percentile, a second query is sent to the next server if the
+    first one didn't answear within that percentile of its recent RTTs, and
+    the first answear wins. Before there are enough samples it waits for the
+    timeout of the transports, when the first query would be sent again anyway
+    '''
+
+    MAX_FAILURE_RATE = 0.5
+    RETRY_INTERVAL = 5.0
+
+    def __init__(
+            self,
+            upstreams: list[tuple[str, int]],
+            sockets_count: int = 4,
+            timeout: float = 1.0,
+            retries: int = 2,
+            hedge_percentile: float | None = None,
+            metrics: DNSMetrics | None = None
+    ):
+        if hedge_percentile is not None and not 0 < hedge_percentile <= 100:
+            raise ValueError(f"Invalid hedge percentile {hedge_percentile}")
+
+        self.transports = [DNSUpstreamTransport(upstream, sockets_count, timeout, retries) for upstream in upstreams]
+        self.stats = [DNSUpstreamStats() for _ in upstreams]
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.metrics = metrics
+
+    async def open(self):
+        for transport in self.transports:
+            await transport.open()
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+
+    async def query(self, query: bytes) -> bytes:
+        '''
+        Sends the query to the best upstream server, and to the next ones if it
+        fails or, with a hedge percentile, if it is slower than usual
+
+        Returns the first response, with the original query ID, and raises
+        a DNSServerError if none of the upstream servers answear
+        '''
+        order = self.__order()
+        index = order.pop(0)
+        for other in order:
+            self.stats[other].decay()
+
+        pending = {asyncio.create_task(self.__query(index, query))}
+        hedged = False
+        error = None
+
+        try:
+            while pending:
+                # only one more query is hedged, after the first one took longer than usual
+                delay = self.__hedge_delay(index) if order and not hedged else None
+                done, pending = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+
+                if not order or (done and pending):
+                    continue
+
+                # hedge if the query is slow or send it again if all the queries failed
+                if not done:
+                    hedged = True
+                    if self.metrics is not None:
+                        self.metrics.hedged += 1
+
+                index = order.pop(0)
+                pending.add(asyncio.create_task(self.__query(index, query)))
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise error
+
+    async def query_tcp(self, query: bytes) -> bytes:
+        '''
+        Sends the query over TCP to the best upstream server
+        '''
+        index = self.__order()[0]
+        started = time.monotonic()
+        try:
+            response = await self.transports[index].query_tcp(query)
+        except DNSServerError:
+            self.stats[index].add_failure()
+            raise
+
+        self.stats[index].add_rtt(time.monotonic() - started)
+        return response
+
+    async def __query(self, index: int, query: bytes) -> bytes:
+        '''
+        Sends the query to one upstream server, recording its RTT or its failure
+        '''
+        stats = self.stats[index]
+        started = time.monotonic()
+        try:
+            response = await self.transports[index].query(query)
+        except asyncio.CancelledError:
+            stats.add_slow(time.monotonic() - started)
+            raise
+        except DNSServerError:
+            stats.add_failure()
+            raise
+
+        stats.add_rtt(time.monotonic() - started)
+        return response
+
+    def __order(self) -> list[int]:
+        '''
+        Returns the indexes of the upstream servers, the healthy ones
+        first, each group sorted from the smallest smoothed RTT
+        '''
+        now = time.monotonic()
+
+        def key(index: int) -> tuple[bool, float]:
+            stats = self.stats[index]
+            failing = stats.failure_rate > DNSUpstreamPool.MAX_FAILURE_RATE and now - stats.failed_at < DNSUpstreamPool.RETRY_INTERVAL
+            return (failing, stats.srtt if stats.srtt is not None else 0.0)
+
+        return sorted(range(len(self.transports)), key=key)
+
+    def __hedge_delay(self, index: int) -> float | None:
+        '''
+        Returns the seconds to wait for the query sent to the upstream server
+        before sending it to the next one, None to not hedge it
+        '''
+        if self.hedge_percentile is None:
+            return None
+
+        delay = self.stats[index].percentile(self.hedge_percentile)
+        return delay if delay is not None else self.timeout
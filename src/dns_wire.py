@@ -0,0 +1,289 @@
+import struct
+from typing import Iterator, NamedTuple
+
+# the OPT pseudo-record type, its TTL field holds the EDNS flags and not a TTL
+OPT_TYPE = 41
+
+# the largest UDP response without EDNS and the UDP payload size advertised
+# by the server in its OPT records, small enough to avoid IP fragmentation
+# https://datatracker.ietf.org/doc/html/rfc6891#section-6.2.5
+MIN_UDP_PAYLOAD_SIZE = 512
+EDNS_UDP_PAYLOAD_SIZE = 1232
+
+# the DNSSEC OK bit of the EDNS flags
+EDNS_DO_BIT = 0x8000
+
+class DNSRecordInfo(NamedTuple):
+    '''
+    Position and fixed fields of a resource record inside a DNS message
+
+    Section is 0 for answears, 1 for authority and 2 for additional records
+    '''
+
+    section: int
+    offset: int
+    rtype: int
+    rclass: int
+    ttl: int
+    rdata_offset: int
+    rdlength: int
+
+class DNSNameCompressor:
+    '''
+    Encodes the domain names of one message, replacing every suffix already
+    written in the message by a pointer to it (RFC 1035 compression)
+    https://datatracker.ietf.org/doc/html/rfc1035#section-4.1.4
+
+    It is seeded with the question name, which is written uncompressed
+    right after the header. The names are fully qualified without the trailing dot,
+    the octets of their labels which are not UTF-8 being surrogate escapes
+    '''
+
+    # a pointer holds an offset of 14 bits
+    MAX_POINTER = 0x3fff
+
+    def __init__(self, question_name: str, offset: int = 12):
+        # lower cased name suffix -> offset of its first label in the message
+        self.suffixes: dict[str, int] = {}
+        labels = question_name.split('.') if question_name else []
+        self.__add(labels, offset, len(labels))
+
+    def encode(self, name: str, offset: int) -> bytes:
+        '''
+        Encodes the name which is written at offset in the message and
+        remembers its suffixes for the names written after it
+        '''
+        labels = name.split('.') if name else []
+
+        # the longest suffix already in the message
+        for index in range(len(labels)):
+            pointer = self.suffixes.get('.'.join(labels[index:]).lower())
+            if pointer is not None:
+                break
+        else:
+            index = len(labels)
+            pointer = None
+
+        encoded = []
+        for label in labels[:index]:
+            encoded_label = label.encode('utf-8', 'surrogateescape')
+            encoded.append(len(encoded_label).to_bytes(1, byteorder='big'))
+            encoded.append(encoded_label)
+        encoded.append(b'\x00' if pointer is None else struct.pack('!H', 0b1100000000000000 | pointer))
+
+        self.__add(labels, offset, index)
+        return b''.join(encoded)
+
+    def __add(self, labels: list[str], offset: int, end: int):
+        '''
+        Remembers the offsets of the suffixes starting at the first end labels
+        '''
+        for index in range(end):
+            suffix = '.'.join(labels[index:]).lower()
+            if offset > DNSNameCompressor.MAX_POINTER:
+                return
+            self.suffixes.setdefault(suffix, offset)
+            offset += len(labels[index].encode('utf-8', 'surrogateescape')) + 1
+
+def skip_name(data: bytes, offset: int) -> int:
+    '''
+    Returns the offset right after the domain name starting at offset
+
+    The name ends either with a zero length byte or with a compression pointer
+    https://datatracker.ietf.org/doc/html/rfc1035#section-4.1.4
+    '''
+    while True:
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0b11000000 == 0b11000000:
+            return offset + 2
+        offset += length + 1
+
+def question_end(data: bytes) -> int:
+    '''
+    Returns the offset right after the first question of the message
+    '''
+    return skip_name(data, 12) + 4
+
+def encode_name(name: str) -> bytes:
+    '''
+    Encodes the fully qualified name, without the trailing dot, uncompressed
+    '''
+    encoded = []
+    for label in name.split('.') if name else []:
+        encoded_label = label.encode('utf-8')
+        encoded.append(len(encoded_label).to_bytes(1, byteorder='big'))
+        encoded.append(encoded_label)
+    encoded.append(b'\x00')
+    return b''.join(encoded)
+
+def read_name(data: bytes, offset: int) -> str:
+    '''
+    Returns the domain name starting at offset, following the compression
+    pointers, fully qualified and without the trailing dot
+
+    A pointer must point before the name it is part of, so a message
+    can't make the reader loop. Raises IndexError if the name is invalid
+    '''
+    labels = []
+    limit = offset
+    while True:
+        length = data[offset]
+        if length == 0:
+            return '.'.join(labels)
+
+        if length & 0b11000000 == 0b11000000:
+            pointer = struct.unpack_from('!H', data, offset)[0] & 0x3fff
+            if pointer >= limit:
+                raise IndexError("Forward compression pointer")
+            offset = limit = pointer
+            continue
+
+        if offset + 1 + length > len(data):
+            raise IndexError("Label out of the message")
+        labels.append(data[offset + 1:offset + 1 + length].decode('utf-8', 'replace'))
+        offset += length + 1
+
+def read_rdata(data: bytes, record: DNSRecordInfo) -> list[bytes | str]:
+    '''
+    Returns the RDATA of the record as its parts, the domain names being the
+    decompressed strings and the other fields the bytes as they are
+
+    Only the well-known types which may be compressed have their names read,
+    the RDATA of any other type is a single part
+    https://datatracker.ietf.org/doc/html/rfc3597#section-4
+    '''
+    start = record.rdata_offset
+    end = start + record.rdlength
+
+    # NS, CNAME and PTR
+    if record.rtype in (2, 5, 12):
+        return [read_name(data, start)]
+    # MX
+    if record.rtype == 15:
+        return [data[start:start + 2], read_name(data, start + 2)]
+    # SOA
+    if record.rtype == 6:
+        rname_offset = skip_name(data, start)
+        return [read_name(data, start), read_name(data, rname_offset), data[end - 20:end]]
+
+    return [data[start:end]]
+
+def iter_records(data: bytes) -> Iterator[DNSRecordInfo]:
+    '''
+    Walks over the resource records of the message, after the question section
+
+    Raises IndexError or struct.error if the message is truncated
+    '''
+    questions_count, *sections_count = struct.unpack_from('!HHHH', data, 4)
+
+    offset = 12
+    for _ in range(questions_count):
+        offset = skip_name(data, offset) + 4
+
+    for section, count in enumerate(sections_count):
+        for _ in range(count):
+            record_offset = offset
+            offset = skip_name(data, offset)
+            rtype, rclass, ttl, rdlength = struct.unpack_from('!HHIH', data, offset)
+            offset += 10
+
+            if offset + rdlength > len(data):
+                raise IndexError("Record data out of the message")
+
+            yield DNSRecordInfo(section, record_offset, rtype, rclass, ttl, offset, rdlength)
+            offset += rdlength
+
+def find_opt(data: bytes) -> DNSRecordInfo | None:
+    '''
+    Returns the OPT pseudo-record of the message or None if it has no OPT record
+
+    Raises IndexError or struct.error if the message is truncated
+    '''
+    for record in iter_records(data):
+        if record.section == 2 and record.rtype == OPT_TYPE:
+            return record
+    return None
+
+def build_opt(payload_size: int = EDNS_UDP_PAYLOAD_SIZE, flags: int = 0) -> bytes:
+    '''
+    Encodes an OPT pseudo-record without any option, the class field holds the
+    UDP payload size and the TTL field the extended RCODE, version and flags
+    https://datatracker.ietf.org/doc/html/rfc6891#section-6.1.2
+    '''
+    # root owner name, type, payload size, extended RCODE 0, version 0, flags and no options
+    return b'\x00' + struct.pack('!HHIH', OPT_TYPE, payload_size, flags & 0xffff, 0)
+
+def udp_payload_size(query: bytes) -> int:
+    '''
+    Returns the largest UDP response the sender of the query accepts, which is
+    the payload size of its OPT record or 512 bytes if it has no OPT record
+    '''
+    if query[10:12] == b'\x00\x00':
+        return MIN_UDP_PAYLOAD_SIZE
+
+    try:
+        opt = find_opt(query)
+    except (IndexError, struct.error):
+        return MIN_UDP_PAYLOAD_SIZE
+
+    if opt is None:
+        return MIN_UDP_PAYLOAD_SIZE
+    return max(opt.rclass, MIN_UDP_PAYLOAD_SIZE)
+
+def truncate(response: bytes, max_size: int) -> bytes:
+    '''
+    Returns the response cut down to at most max_size bytes
+
+    Whole RRsets are dropped from the end of the message, the OPT record is
+    always kept and the TC flag is set if an answear or authority RRset was
+    dropped. A compression pointer only points to earlier bytes, so the kept
+    records never point into the dropped ones
+    https://datatracker.ietf.org/doc/html/rfc2181#section-9
+    '''
+    if len(response) <= max_size:
+        return response
+
+    response_id, flags, questions_count = struct.unpack_from('!HHH', response)
+
+    try:
+        questions_end = question_end(response) if questions_count else 12
+        records = list(iter_records(response))
+    except (IndexError, struct.error):
+        # not even the question can be kept
+        return struct.pack('!HHHHHH', response_id, flags | 0b0000001000000000, 0, 0, 0, 0)
+
+    opt = b''
+    # [section, (section, type, owner name), start, end, records count] of every RRset
+    rrsets = []
+    for record in records:
+        end = record.rdata_offset + record.rdlength
+
+        # the OPT record is the last one, anything after it is dropped
+        if record.rtype == OPT_TYPE:
+            opt = response[record.offset:end]
+            break
+
+        key = (record.section, record.rtype, response[record.offset:skip_name(response, record.offset)])
+        if rrsets and rrsets[-1][1] == key:
+            rrsets[-1][3] = end
+            rrsets[-1][4] += 1
+        else:
+            rrsets.append([record.section, key, record.offset, end, 1])
+
+    counts = [0, 0, 0]
+    size = questions_end
+    for section, _, start, end, count in rrsets:
+        if end + len(opt) > max_size:
+            if section < 2:
+                flags |= 0b0000001000000000
+            break
+        size = end
+        counts[section] += count
+
+    if opt:
+        counts[2] += 1
+
+    header = struct.pack('!HHHHHH', response_id, flags, questions_count, *counts)
+    return header + response[12:size] + opt
@@ -0,0 +1,371 @@
+import os
+import json
+import struct
+from typing import Self, Iterable
+from dns_enums import DNSQuestionType
+from dns_errors import DNSNoDomainFoundError, DNSFormatError
+from dns_wire import DNSNameCompressor
+from dns_master_file import DNSMasterFileParser
+
+class DNSZone:
+    '''
+    A zone compiled into wire format
+
+    Every (owner name, qtype) RRset and the SOA authority record are encoded
+    once when the zone is loaded, so answering a query is a lookup and a join
+
+    An RRset is only sent right after the question for its owner name, so
+    its position in the response is known when it is encoded and the names
+    in its records are compressed against the question and the records before them
+
+    The owner names are fully qualified, lower cased and without the trailing dot
+    '''
+
+    def __init__(self, origin: str):
+        self.origin = DNSZone.normalize_name(origin)
+
+        # owner name -> qtype -> (encoded RRset, number of records)
+        self.names: dict[str, dict[DNSQuestionType, tuple[bytes, int]]] = {self.origin: {}}
+
+        # (owner name, qtype) of the RRsets with a record which could not be encoded
+        self.broken: set[tuple[str, DNSQuestionType]] = set()
+
+        # the compressor of every RRset, holding the names written in it so far,
+        # only needed while the zone is loaded
+        self.compressors: dict[tuple[str, DNSQuestionType], DNSNameCompressor] = {}
+
+        # (owner name, qtype) -> (encoded records, their total length) of every RRset
+        # while the zone is loaded, each RRset is joined once all its records are added
+        self.records: dict[tuple[str, DNSQuestionType], tuple[list[bytes], int]] = {}
+
+        # the serial of the SOA record, None if the zone has no SOA record
+        self.serial: int | None = None
+
+        # the SOA record sent in the authority section, split in the parts
+        # joined by a pointer to the origin inside the question name
+        self.authority: list[bytes] | None = None
+
+    @classmethod
+    def from_json(cls, data: dict) -> Self:
+        '''
+        Compiles a zone from the JSON zone file format
+
+        The keys are the record types as lower case strings, SOA being a
+        dictionary and any other type a list of {name, ttl, value} records
+        '''
+        zone = cls(data["$origin"])
+
+        for qtype in DNSQuestionType:
+            key = str(qtype).lower()
+            if key not in data:
+                continue
+
+            if qtype == DNSQuestionType.SOA:
+                zone.add_soa(data[key])
+                continue
+
+            for record in data[key]:
+                zone.add_record(record["name"], qtype, record["ttl"], record["value"])
+
+        zone.__finish()
+        return zone
+
+    @classmethod
+    def from_master_file(cls, lines: Iterable[str], origin: str | None = None, source: str = "zone file") -> Self:
+        '''
+        Compiles a zone from the RFC 1035 master file format, one record at a time
+
+        The origin of the zone is the owner of the SOA record if it is the first
+        record, otherwise the origin at the first record, $ORIGIN or the origin given
+        '''
+        parser = DNSMasterFileParser(lines, origin, source)
+        zone = None
+
+        for owner, qtype, ttl, value in parser:
+            if zone is None:
+                zone = cls(owner if qtype == DNSQuestionType.SOA else parser.origin)
+
+            if qtype == DNSQuestionType.SOA:
+                # only the SOA record of the origin is served
+                if DNSZone.normalize_name(owner) == zone.origin:
+                    zone.add_soa(value)
+                continue
+
+            zone.add_record(owner, qtype, ttl, value)
+
+        if zone is None:
+            if parser.origin is None:
+                raise DNSFormatError(f"{source}: No records and no $ORIGIN")
+            zone = cls(parser.origin)
+
+        zone.__finish()
+        return zone
+
+    @classmethod
+    def from_zone_file(cls, zone_file: str) -> Self:
+        '''
+        Compiles a zone file, which is a JSON zone file if it starts with {
+        and an RFC 1035 master file otherwise
+
+        The origin of a master file named <origin>.zone defaults to <origin>
+        '''
+        with open(zone_file, encoding='utf-8') as file:
+            first = file.read(1)
+            while first.isspace():
+                first = file.read(1)
+            file.seek(0)
+
+            if first == '{':
+                return cls.from_json(json.load(file))
+
+            name = os.path.basename(zone_file)
+            origin = name.removesuffix('.zone') if name.endswith('.zone') else None
+            return cls.from_master_file(file, origin, zone_file)
+
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        '''
+        Returns the name lower cased and without the trailing dot
+        '''
+        return name.lower().rstrip('.')
+
+    def qualify_name(self, name: str) -> str:
+        '''
+        Returns the fully qualified name, without the trailing dot, of a name from
+        the zone file which is either @ for the origin, absolute if it ends with
+        a dot or relative to the origin
+        '''
+        if name == '@':
+            return self.origin
+        if name.endswith('.'):
+            return name[:-1]
+        return f"{name}.{self.origin}"
+
+    def add_record(self, owner: str, qtype: DNSQuestionType, ttl: int, value: str | list[bytes]):
+        '''
+        Encodes a record and appends it to the (owner, qtype) RRset, which
+        is only in the index once the zone is loaded
+        '''
+        owner = DNSZone.normalize_name(self.qualify_name(owner))
+        self.__add_name(owner)
+        records, length = self.records.get((owner, qtype), ([], 0))
+
+        try:
+            compressor = self.__get_compressor(owner, qtype)
+            rdata_offset = DNSZone.__answears_offset(owner) + length + 12
+            record = DNSZone.__encode_record(qtype, ttl, self.__encode_rdata(qtype, value, compressor, rdata_offset))
+        except Exception:
+            self.broken.add((owner, qtype))
+            return
+
+        records.append(record)
+        self.records[(owner, qtype)] = (records, length + len(record))
+
+    def add_soa(self, soa: dict[str, str]):
+        '''
+        Encodes the SOA record, which is both the answer for SOA questions
+        of the origin and the authority section of any other answer
+        '''
+        try:
+            ttl = int(soa["ttl"])
+            compressor = self.__get_compressor(self.origin, DNSQuestionType.SOA)
+            rdata_offset = DNSZone.__answears_offset(self.origin) + 12
+            record = DNSZone.__encode_record(DNSQuestionType.SOA, ttl, self.__encode_soa(soa, compressor, rdata_offset))
+
+            # in the authority section the question name might be any name of the zone,
+            # so the names are only compressed against the origin at its end
+            mname = self.__split_origin(self.qualify_name(soa["mname"]))
+            rname = self.__split_origin(self.qualify_name(soa["rname"]))
+            numbers = self.__encode_soa_numbers(soa)
+        except Exception:
+            self.broken.add((self.origin, DNSQuestionType.SOA))
+            return
+
+        self.names[self.origin][DNSQuestionType.SOA] = (record, 1)
+        self.serial = int(soa["serial"])
+
+        # the owner pointer, fixed fields, mname, rname and the numbers, an empty part being a pointer to the origin
+        parts = [b'', struct.pack('!HHI', DNSQuestionType.SOA.value, 1, ttl), None, *mname, *rname, numbers]
+        rdlength = sum(len(part) if part else 2 for part in parts[3:])
+        parts[2] = struct.pack('!H', rdlength)
+
+        self.authority = [b'']
+        for part in parts:
+            if part:
+                self.authority[-1] += part
+            else:
+                self.authority.append(b'')
+
+    def get_answears(self, domain: str, qtype: DNSQuestionType) -> tuple[bytes, int]:
+        '''
+        Returns the encoded answears of the domain for the qtype and their count
+
+        An empty answear means the domain exists without records of the
+        qtype. If the domain is an alias any question gets its CNAME record,
+        unless the domain has records of the qtype which could not be encoded
+
+        Raises DNSNoDomainFoundError if the domain doesn't exist in the zone
+        and DNSFormatError if some of its records could not be encoded
+        '''
+        rrsets = self.names.get(domain)
+        if rrsets is None:
+            raise DNSNoDomainFoundError(domain)
+
+        # an RRset whose records all failed to encode is not in rrsets, but it exists
+        if qtype not in rrsets and (domain, qtype) not in self.broken and DNSQuestionType.CNAME in rrsets:
+            qtype = DNSQuestionType.CNAME
+
+        if (domain, qtype) in self.broken:
+            raise DNSFormatError(f"Invalid {qtype} records for {domain}")
+
+        return rrsets.get(qtype, (b'', 0))
+
+    def get_authority(self, domain: str) -> bytes | None:
+        '''
+        Returns the SOA record for the authority section of an answear for the domain
+
+        The owner name and the names ending with the origin are pointers to
+        the origin, which is the end of the question name
+        '''
+        if self.authority is None:
+            return None
+
+        # the encoded labels before the origin are one byte longer than
+        # their text, the length byte taking the place of the dot
+        offset = 12 + len(domain.encode('utf-8')) - len(self.origin.encode('utf-8'))
+        return struct.pack('!H', 0b1100000000000000 | offset).join(self.authority)
+
+    def __finish(self):
+        '''
+        Joins the records of every RRset once all of them are added
+        and drops what was only needed to encode them
+        '''
+        for (owner, qtype), (records, _) in self.records.items():
+            self.names[owner][qtype] = (b''.join(records), len(records))
+
+        del self.records
+        del self.compressors
+
+    def __add_name(self, owner: str) -> dict[DNSQuestionType, tuple[bytes, int]]:
+        '''
+        Adds the owner name to the index and returns its RRsets
+
+        The names between the owner and the origin are added without any
+        RRset, they exist even if they don't have records of their own
+        '''
+        rrsets = self.names.get(owner)
+        if rrsets is not None:
+            return rrsets
+
+        rrsets = self.names[owner] = {}
+
+        name = owner
+        suffix = '.' + self.origin
+        while name.endswith(suffix):
+            name = name.split('.', 1)[1]
+            self.names.setdefault(name, {})
+
+        return rrsets
+
+    def __get_compressor(self, owner: str, qtype: DNSQuestionType) -> DNSNameCompressor:
+        compressor = self.compressors.get((owner, qtype))
+        if compressor is None:
+            compressor = self.compressors[(owner, qtype)] = DNSNameCompressor(owner)
+        return compressor
+
+    @staticmethod
+    def __answears_offset(owner: str) -> int:
+        '''
+        Returns the offset of the answears for the owner name, which are
+        right after the header and the question for that name
+        '''
+        return 12 + len(DNSZone.__encode_domain(owner)) + 4
+
+    def __split_origin(self, name: str) -> list[bytes]:
+        '''
+        Encodes the name as its labels before the origin followed by an empty
+        part standing for a pointer to the origin, if the name ends with the origin
+        '''
+        if DNSZone.normalize_name(name) == self.origin:
+            return [b'']
+        if DNSZone.normalize_name(name).endswith('.' + self.origin):
+            prefix = name[:len(name) - len(self.origin) - 1]
+            return [DNSZone.__encode_domain(prefix)[:-1], b'']
+        return [DNSZone.__encode_domain(name)]
+
+    @staticmethod
+    def __encode_record(qtype: DNSQuestionType, ttl: int, rdata: bytes) -> bytes:
+        '''
+        Encodes a full resource record from its already encoded RDATA
+
+        The records are only sent for the name of the question, so the owner name is
+        a pointer to the question name which starts after the header
+        https://datatracker.ietf.org/doc/html/rfc1035#section-4.1.4
+        '''
+        # type, IN class, TTL and RDLENGTH
+        return b'\xc0\x0c' + struct.pack('!HHIH', qtype.value, 1, ttl, len(rdata)) + rdata
+
+    def __encode_rdata(self, qtype: DNSQuestionType, value: str | list[bytes], compressor: DNSNameCompressor, offset: int) -> bytes:
+        '''
+        Encodes the RDATA of any record type except SOA, which starts at offset in the response
+        '''
+        if qtype == DNSQuestionType.A:
+            # convert the IPv4 address to bytes
+            parts = value.split('.')
+            return bytes([int(part) for part in parts])
+
+        elif qtype == DNSQuestionType.CNAME or qtype == DNSQuestionType.NS or qtype == DNSQuestionType.PTR:
+            return compressor.encode(self.qualify_name(value), offset)
+
+        elif qtype == DNSQuestionType.TXT:
+            # every character string prefixed by its length, a string from
+            # a JSON zone file being a TXT record with a single one
+            encoded = []
+            for string in [value.encode('utf-8')] if isinstance(value, str) else value:
+                if len(string) > 255:
+                    raise DNSFormatError("TXT character string longer than 255 bytes")
+                encoded.append(len(string).to_bytes(1, byteorder='big') + string)
+            return b''.join(encoded)
+
+        elif qtype == DNSQuestionType.MX:
+            preference, exchange = value.split()
+            preference = int(preference).to_bytes(2, byteorder='big')
+            return preference + compressor.encode(self.qualify_name(exchange), offset + 2)
+
+        raise DNSFormatError(f"Unsupported record type {qtype}")
+
+    def __encode_soa(self, soa: dict[str, str], compressor: DNSNameCompressor, offset: int) -> bytes:
+        '''
+        Encodes the RDATA of the SOA record, which starts at offset in the response
+        '''
+        numbers = self.__encode_soa_numbers(soa)
+        mname = compressor.encode(self.qualify_name(soa["mname"]), offset)
+        rname = compressor.encode(self.qualify_name(soa["rname"]), offset + len(mname))
+        return mname + rname + numbers
+
+    @staticmethod
+    def __encode_soa_numbers(soa: dict[str, str]) -> bytes:
+        '''
+        Encodes the serial, refresh, retry, expire and minimum fields of the SOA record
+        '''
+        return struct.pack(
+            '!IIIII',
+            int(soa["serial"]),
+            int(soa["refresh"]),
+            int(soa["retry"]),
+            int(soa["expire"]),
+            int(soa["minimum"])
+        )
+
+    @staticmethod
+    def __encode_domain(domain: str) -> bytes:
+        '''
+        Encodes the fully qualified domain name into bytes, ending with the zero length byte
+        '''
+        result = []
+        for part in domain.split('.') if domain else []:
+            encoded_part = part.encode('utf-8', 'surrogateescape')
+            result.append(len(encoded_part).to_bytes(1, byteorder='big'))
+            result.append(encoded_part)
+        result.append(b'\x00')
+        return b''.join(result)
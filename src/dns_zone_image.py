@@ -0,0 +1,245 @@
+import os
+import mmap
+import zlib
+import struct
+from dns_enums import DNSQuestionType
+from dns_errors import DNSNoDomainFoundError, DNSFormatError
+from dns_zone import DNSZone
+
+'''
+Layout of a zone image, all the integers are little endian:
+
+header:     magic (8 bytes) | version (H) | zones count (I)
+directory:  for every zone, ZONE_ENTRY
+zone:       origin | authority parts | hash table | names
+
+ZONE_ENTRY: origin offset (I) | origin length (H) | serial (q, -1 without SOA) |
+            authority offset (I) | authority parts count (H, 0 without SOA) |
+            hash table offset (I) | hash table mask (I)
+
+authority part: length (H) | bytes
+hash table slot: CRC32 of the name (I) | offset of the name + 1 (I, 0 for an empty slot)
+name:       length (H) | name | RRsets count (H) | RRsets
+RRset:      qtype (H) | broken (B) | records count (H) | length (I) | encoded records
+
+The names are the fully qualified owner names, lower cased, without the
+trailing dot and encoded as UTF-8. The encoded records are the same as the
+ones DNSZone compiles, so they are sent as they are
+'''
+
+MAGIC = b'DNSZONES'
+VERSION = 1
+
+HEADER = struct.Struct('<8sHI')
+ZONE_ENTRY = struct.Struct('<IHqIHII')
+SLOT = struct.Struct('<II')
+RRSET = struct.Struct('<HBHI')
+LENGTH = struct.Struct('<H')
+
+def write_zone_image(zones: list[DNSZone], path: str):
+    '''
+    Writes the compiled zones as an image to the path
+
+    The image is written to a temporary file which then replaces the path,
+    so a server mapping the previous image is never left with a partial one
+    '''
+    directory_end = HEADER.size + ZONE_ENTRY.size * len(zones)
+    entries = []
+    blocks = []
+    offset = directory_end
+
+    for zone in zones:
+        block = bytearray()
+
+        origin = zone.origin.encode('utf-8')
+        origin_offset = offset + len(block)
+        block += origin
+
+        authority_offset = offset + len(block)
+        for part in zone.authority or []:
+            block += LENGTH.pack(len(part)) + part
+
+        # twice as many slots as names, so the probe sequences stay short
+        capacity = 1
+        while capacity < 2 * len(zone.names):
+            capacity *= 2
+        table_offset = offset + len(block)
+        table = bytearray(SLOT.size * capacity)
+        block += table
+
+        for name, rrsets in zone.names.items():
+            encoded_name = name.encode('utf-8', 'surrogateescape')
+            name_offset = offset + len(block)
+
+            # the RRsets with a record which could not be encoded are flagged as broken,
+            # the ones without any record left are written empty so they are still found
+            entries_of_name = [
+                RRSET.pack(qtype.value, (name, qtype) in zone.broken, count, len(rrset)) + rrset
+                for qtype, (rrset, count) in rrsets.items()
+            ]
+            entries_of_name += [
+                RRSET.pack(qtype.value, 1, 0, 0)
+                for broken_name, qtype in zone.broken
+                if broken_name == name and qtype not in rrsets
+            ]
+
+            block += LENGTH.pack(len(encoded_name)) + encoded_name + LENGTH.pack(len(entries_of_name))
+            block += b''.join(entries_of_name)
+
+            name_hash = zlib.crc32(encoded_name)
+            slot = name_hash & (capacity - 1)
+            while SLOT.unpack_from(table, slot * SLOT.size)[1] != 0:
+                slot = (slot + 1) & (capacity - 1)
+            SLOT.pack_into(table, slot * SLOT.size, name_hash, name_offset + 1)
+
+        block[table_offset - offset:table_offset - offset + len(table)] = table
+
+        entries.append(ZONE_ENTRY.pack(
+            origin_offset,
+            len(origin),
+            zone.serial if zone.serial is not None else -1,
+            authority_offset,
+            len(zone.authority) if zone.authority is not None else 0,
+            table_offset,
+            capacity - 1
+        ))
+        blocks.append(block)
+        offset += len(block)
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(zones)))
+        file.writelines(entries)
+        file.writelines(blocks)
+    os.replace(temporary_path, path)
+
+def is_zone_image(path: str) -> bool:
+    '''
+    Checks if the file starts with the magic of a zone image
+    '''
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+def open_zone_image(path: str) -> list['DNSMappedZone']:
+    '''
+    Maps the zone image in memory and returns its zones
+
+    Nothing but the directory is read, the names are looked up directly in
+    the mapped file, which is shared by all the processes mapping it
+    '''
+    with open(path, 'rb') as file:
+        image = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, zones_count = HEADER.unpack_from(image)
+    if magic != MAGIC or version != VERSION:
+        raise DNSFormatError(f"{path} is not a zone image of version {VERSION}")
+
+    return [
+        DNSMappedZone(image, *ZONE_ENTRY.unpack_from(image, HEADER.size + index * ZONE_ENTRY.size))
+        for index in range(zones_count)
+    ]
+
+class DNSMappedZone:
+    '''
+    A zone read from a memory mapped zone image, answering like DNSZone
+    '''
+
+    def __init__(
+            self,
+            image: mmap.mmap,
+            origin_offset: int,
+            origin_length: int,
+            serial: int,
+            authority_offset: int,
+            authority_count: int,
+            table_offset: int,
+            table_mask: int
+    ):
+        self.image = image
+        self.origin = image[origin_offset:origin_offset + origin_length].decode('utf-8')
+        self.serial = serial if serial >= 0 else None
+        self.table_offset = table_offset
+        self.table_mask = table_mask
+
+        # the SOA record of the authority section, in the same parts as DNSZone.authority
+        self.authority: list[bytes] | None = None
+        if authority_count:
+            self.authority = []
+            offset = authority_offset
+            for _ in range(authority_count):
+                length, = LENGTH.unpack_from(image, offset)
+                self.authority.append(image[offset + 2:offset + 2 + length])
+                offset += 2 + length
+
+    def get_answears(self, domain: str, qtype: DNSQuestionType) -> tuple[bytes, int]:
+        '''
+        Returns the encoded answears of the domain for the qtype and their count,
+        the same way as DNSZone.get_answears
+        '''
+        offset = self.__find(domain)
+        if offset is None:
+            raise DNSNoDomainFoundError(domain)
+
+        image = self.image
+        name_length, = LENGTH.unpack_from(image, offset)
+        offset += 2 + name_length
+        rrsets_count, = LENGTH.unpack_from(image, offset)
+        offset += 2
+
+        # (broken, records count, offset, length) of the RRsets of the qtype and of the CNAME
+        wanted = qtype.value if qtype is not None else -1
+        found = {}
+        for _ in range(rrsets_count):
+            rrset_qtype, broken, count, length = RRSET.unpack_from(image, offset)
+            if rrset_qtype == wanted or rrset_qtype == DNSQuestionType.CNAME.value:
+                found[rrset_qtype] = (broken, count, offset, length)
+            offset += RRSET.size + length
+
+        # if the domain is an alias any question gets its CNAME record, unless it has an
+        # RRset of the qtype, which might have no record and only be flagged as broken
+        if wanted not in found and found.get(DNSQuestionType.CNAME.value, (0, 0))[1] > 0:
+            qtype, wanted = DNSQuestionType.CNAME, DNSQuestionType.CNAME.value
+
+        rrset = found.get(wanted)
+        if rrset is None:
+            return (b'', 0)
+
+        broken, count, offset, length = rrset
+        if broken:
+            raise DNSFormatError(f"Invalid {qtype} records for {domain}")
+
+        offset += RRSET.size
+        return (self.image[offset:offset + length], count)
+
+    def get_authority(self, domain: str) -> bytes | None:
+        '''
+        Returns the SOA record for the authority section of an answear for the domain,
+        the same way as DNSZone.get_authority
+        '''
+        if self.authority is None:
+            return None
+
+        offset = 12 + len(domain.encode('utf-8')) - len(self.origin.encode('utf-8'))
+        return struct.pack('!H', 0b1100000000000000 | offset).join(self.authority)
+
+    def __find(self, domain: str) -> int | None:
+        '''
+        Returns the offset of the name in the image or None if it is not in the zone
+        '''
+        name = domain.encode('utf-8')
+        name_hash = zlib.crc32(name)
+        image = self.image
+        slot = name_hash & self.table_mask
+
+        while True:
+            slot_hash, name_offset = SLOT.unpack_from(image, self.table_offset + slot * SLOT.size)
+            if name_offset == 0:
+                return None
+
+            name_offset -= 1
+            if slot_hash == name_hash:
+                name_length, = LENGTH.unpack_from(image, name_offset)
+                if image[name_offset + 2:name_offset + 2 + name_length] == name:
+                    return name_offset
+
+            slot = (slot + 1) & self.table_mask
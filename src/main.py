@@ -1,73 +1,298 @@
-import socket
-from dns_header import DNSHeader
-from dns_packet import DNSPacket
+import asyncio
+import argparse
+from typing import Callable
 from dns_answear import DNSAnswear
-from dns_enums import DNSHeaderResponseCode, DNSHeaderRecursionDesired
-from datetime import datetime
+from dns_lazy_zone import DNSParsedZones
+from dns_forwarder import DNSForwarder
+from dns_cache import DNSCache
+from dns_upstream import DNSUpstreamTransport
+from dns_upstream_pool import DNSUpstreamPool
+from dns_resolver import ROOT_HINTS, DNSIterativeResolver
+from dns_supervisor import DNSSupervisor
+from dns_templates import DNSResponseTemplates
+from dns_query_log import DNSQueryLog, open_query_log
+from dns_metrics import DNSMetrics
+from dns_server import DNSQueryHandler, serve
 
 DNS_SERVER_IP = '127.0.0.1'
 GOOGLE_DNS_IP = '8.8.8.8'
 DNS_PORT = 53
 
-def redirect_to_google(query: bytes) -> tuple[bytes, DNSHeaderResponseCode]:
+# maximum number of queries waiting for an answer from Google at the same time
+MAX_FORWARDED_QUERIES = 256
+
+# number of sockets used for sending the queries to Google
+UPSTREAM_SOCKETS = 4
+# seconds to wait for an answer from Google before sending the query again
+UPSTREAM_TIMEOUT = 1.0
+UPSTREAM_RETRIES = 2
+
+# maximum number of queries of the iterative resolver waiting for an
+# answer at the same time and of delegations and name servers it remembers
+RESOLVER_MAX_OUTSTANDING = 256
+RESOLVER_MAX_ENTRIES = 10000
+
+# limits of the cache for the answers from Google
+CACHE_MAX_ENTRIES = 10000
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+# default cap of the seconds a negative answear from Google is cached for
+CACHE_MAX_NEGATIVE_TTL = 900
+# seconds to wait for Google before answering with an expired answer, with --serve-stale
+STALE_ANSWER_TIMEOUT = 1.8
+
+# maximum number of memoized responses with --response-templates
+RESPONSE_TEMPLATES_MAX_ENTRIES = 10000
+
+# maximum number of open TCP connections from the clients and the
+# seconds after which a connection without any query is closed
+TCP_MAX_CONNECTIONS = 1024
+TCP_IDLE_TIMEOUT = 10.0
+
+# maximum number of UDP queries received at once with --udp-batch, which
+# sizes the preallocated receive buffers
+UDP_MAX_BATCH = 1024
+
+# maximum number of queries waiting to be written to the query log
+QUERY_LOG_BUFFER = 65536
+
+
+def parse_address(address: str) -> tuple[str, int]:
     '''
-    Redirects the query to google and returns the response data and response code
+    Parses an address given as IP or IP:PORT, the port defaults to DNS_PORT
     '''
+    host, _, port = address.partition(':')
+    return host, int(port) if port else DNS_PORT
 
-    google_connection = socket.socket(
-        socket.AF_INET, # IPv4 
-        socket.SOCK_DGRAM # UDP
-    )
 
-    # send the original query to google
-    google_connection.sendto(query, (GOOGLE_DNS_IP, DNS_PORT))
-    
-    google_data, _ = google_connection.recvfrom(1024)
-    google_connection.close()
+def parse_addresses(addresses: str) -> list[tuple[str, int]]:
+    '''
+    Parses a comma separated list of addresses given as IP or IP:PORT
+    '''
+    return [parse_address(address) for address in addresses.split(',')]
 
-    # get the response code from the google response
-    dns_header = DNSHeader(google_data)
-    response_code = dns_header.flags.rcode
 
-    return google_data, response_code
+def bounded_int(minimum: int, maximum: int | None = None) -> Callable[[str], int]:
+    '''
+    Returns an argument type parsing an integer between minimum and maximum, both included
+    '''
+    def parse(value: str) -> int:
+        number = int(value)
+        if number < minimum or (maximum is not None and number > maximum):
+            bounds = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+            raise argparse.ArgumentTypeError(f"{value} is not {bounds}")
+        return number
 
+    # argparse names the type in its error for a value which isn't a number
+    parse.__name__ = 'int'
+    return parse
 
-def main():
-    connection = socket.socket(
-        socket.AF_INET, # IPv4 
-        socket.SOCK_DGRAM # UDP
+
+def bounded_float(minimum: float, maximum: float | None = None) -> Callable[[str], float]:
+    '''
+    Returns an argument type parsing a number greater than minimum and at most maximum
+    '''
+    def parse(value: str) -> float:
+        number = float(value)
+        if not number > minimum or (maximum is not None and not number <= maximum):
+            bounds = f"greater than {minimum} and at most {maximum}" if maximum is not None else f"greater than {minimum}"
+            raise argparse.ArgumentTypeError(f"{value} is not {bounds}")
+        return number
+
+    # argparse names the type in its error for a value which isn't a number
+    parse.__name__ = 'float'
+    return parse
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Authoritive and recursive DNS server")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DNS_PORT,
+        help="port the server listens on"
+    )
+    parser.add_argument(
+        "--upstream",
+        type=parse_addresses,
+        default=[(GOOGLE_DNS_IP, DNS_PORT)],
+        help="IP[:PORT] of the server the recursive queries are forwarded to, or a comma separated list "
+             "of servers, each query going to the fastest healthy one"
+    )
+    parser.add_argument(
+        "--hedge-percentile",
+        type=bounded_float(0, 100),
+        help="with several upstream servers, send the query to a second one if the first one "
+             "didn't answer within this percentile of its recent round trip times (above 0 and up to 100)"
     )
+    parser.add_argument(
+        "--iterative",
+        action="store_true",
+        help="resolve the recursive queries from the root servers instead of forwarding them to the upstream server"
+    )
+    parser.add_argument(
+        "--root-hints",
+        type=lambda addresses: addresses.split(','),
+        default=ROOT_HINTS,
+        help="comma separated IPv4 addresses of the root servers the iterative resolution starts from"
+    )
+    parser.add_argument(
+        "--resolver-port",
+        type=int,
+        default=DNS_PORT,
+        help="port of the authoritative servers queried by the iterative resolver"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes sharing the port with SO_REUSEPORT"
+    )
+    parser.add_argument(
+        "--max-negative-ttl",
+        type=int,
+        default=CACHE_MAX_NEGATIVE_TTL,
+        help="cache the NXDOMAIN and NODATA answers from the upstream server for at most this many seconds, 0 to not cache them"
+    )
+    parser.add_argument(
+        "--serve-stale",
+        type=int,
+        default=0,
+        metavar="SECONDS",
+        help="answer with the expired cached answers, for up to this many seconds after they expire, when the upstream server is slow or fails"
+    )
+    parser.add_argument(
+        "--prefetch-hits",
+        type=int,
+        default=0,
+        help="query again the cached answers asked at least this many times shortly before they expire, 0 to not prefetch"
+    )
+    parser.add_argument(
+        "--udp-batch",
+        type=bounded_int(1, UDP_MAX_BATCH),
+        metavar="N",
+        help=f"receive and answer up to N UDP queries per wakeup (1 to {UDP_MAX_BATCH}), with recvmmsg and sendmmsg where available"
+    )
+    parser.add_argument(
+        "--response-templates",
+        action="store_true",
+        help="memoize the answers from the zones and reuse them for repeated queries"
+    )
+    parser.add_argument(
+        "--query-log",
+        default="-",
+        help="file the queries are logged to, - for the standard output or off to disable the log"
+    )
+    parser.add_argument(
+        "--query-log-format",
+        choices=["text", "jsonl"],
+        default="text",
+        help="format of the query log lines"
+    )
+    parser.add_argument(
+        "--query-log-sample",
+        type=bounded_int(1),
+        default=1,
+        help="log only one of every this many queries"
+    )
+    parser.add_argument(
+        "--zones",
+        default=DNSAnswear.zones_path,
+        help="zone files to serve, a glob pattern of JSON zone files or a zone image written by compile_zones.py"
+    )
+    parser.add_argument(
+        "--lazy-zones",
+        type=int,
+        metavar="MAX_ZONES",
+        help="compile the <origin>.zone files on their first query instead of at startup, keeping at most this many compiled zones"
+    )
+    parser.add_argument(
+        "--zones-reload-interval",
+        type=bounded_float(0),
+        help="check the zone files for changes every this many seconds and reload the changed ones"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve the metrics over HTTP on this port, each worker uses the next port"
+    )
+    return parser.parse_args()
 
-    connection.bind((DNS_SERVER_IP, DNS_PORT))
 
-    DNSAnswear.load_zones()
+def run_worker(arguments: argparse.Namespace, reuse_port: bool, index: int = 0):
+    '''
+    Serves the queries in the current process, the caches, the metrics and
+    the upstream sockets belong to the process running this function
+    '''
+    metrics = DNSMetrics({"worker": str(index)})
+    cache = DNSCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, arguments.max_negative_ttl, arguments.serve_stale, arguments.prefetch_hits)
+    if arguments.iterative:
+        upstream = DNSIterativeResolver(
+            arguments.root_hints,
+            arguments.resolver_port,
+            RESOLVER_MAX_OUTSTANDING,
+            UPSTREAM_SOCKETS,
+            UPSTREAM_TIMEOUT,
+            RESOLVER_MAX_ENTRIES
+        )
+    elif len(arguments.upstream) > 1:
+        upstream = DNSUpstreamPool(
+            arguments.upstream,
+            UPSTREAM_SOCKETS,
+            UPSTREAM_TIMEOUT,
+            UPSTREAM_RETRIES,
+            arguments.hedge_percentile,
+            metrics
+        )
+    else:
+        upstream = DNSUpstreamTransport(arguments.upstream[0], UPSTREAM_SOCKETS, UPSTREAM_TIMEOUT, UPSTREAM_RETRIES)
+    forwarder = DNSForwarder(upstream, MAX_FORWARDED_QUERIES, cache, metrics, STALE_ANSWER_TIMEOUT)
+
+    templates = DNSResponseTemplates(RESPONSE_TEMPLATES_MAX_ENTRIES) if arguments.response_templates else None
 
-    while True:
-        print("--------------------")
-        data, address = connection.recvfrom(1024) # buffer size
+    query_log = None
+    if arguments.query_log != "off":
+        query_log = DNSQueryLog(
+            open_query_log(arguments.query_log),
+            arguments.query_log_format,
+            arguments.query_log_sample,
+            QUERY_LOG_BUFFER
+        )
 
-        curent_date = datetime.strftime(datetime.now(), "%d-%m-%Y %H:%M:%S")
-        packet = DNSPacket(data)
-        print(f"[{curent_date}] Received request for \"{packet.question.domain}\"")
-        
-        response_data, response_code = packet.build_response()
+    handler = DNSQueryHandler(forwarder, templates, query_log, metrics)
 
-        curent_date = datetime.strftime(datetime.now(), "%d-%m-%Y %H:%M:%S")
+    # every worker has its own metrics, served on its own port
+    metrics_port = arguments.metrics_port + index if arguments.metrics_port is not None else None
 
-        # redirect to google if the domain is not found
-        # and recursion is desired
-        if response_code == DNSHeaderResponseCode.NAME_ERROR and packet.header.flags.rd == DNSHeaderRecursionDesired.RECURSION:
-            print(f"[{curent_date}] Redirecting to Google")
+    try:
+        asyncio.run(serve(
+            DNS_SERVER_IP,
+            arguments.port,
+            handler,
+            reuse_port,
+            metrics_port,
+            TCP_MAX_CONNECTIONS,
+            TCP_IDLE_TIMEOUT,
+            arguments.zones_reload_interval,
+            arguments.udp_batch
+        ))
+    finally:
+        if query_log is not None:
+            query_log.close()
 
-            response_data, response_code = redirect_to_google(data)
-            # send the response back to the client
-            connection.sendto(response_data, address)
 
-            print(f"[{curent_date}] Responded from Google with {response_code.name} for \"{packet.question.domain}\"")
-            continue
+def main():
+    arguments = parse_arguments()
+
+    # load the zones before forking, so the workers share them
+    DNSAnswear.zones_path = arguments.zones
+    if arguments.lazy_zones is not None:
+        DNSAnswear.parsed_zones = DNSParsedZones(arguments.lazy_zones)
+    DNSAnswear.load_zones()
 
-        print(f"[{curent_date}] Responded with {response_code.name} for \"{packet.question.domain}\"")
-        connection.sendto(response_data, address)
+    if arguments.workers > 1:
+        DNSSupervisor(arguments.workers, lambda index: run_worker(arguments, True, index)).run()
+    else:
+        run_worker(arguments, False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+'''
+Tests of the DNS server, run them from the src folder:
+
+python3 -m pytest tests
+
+They only use local sockets, the upstream and authoritative servers are stand-ins
+'''
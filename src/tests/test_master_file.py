@@ -0,0 +1,33 @@
+from dns_zone import DNSZone
+from dns_enums import DNSQuestionType
+from dns_master_file import DNSMasterFileParser
+
+ZONE = [
+    "$ORIGIN example.test.",
+    "$TTL 300",
+    "@ IN SOA ns1 admin 1 3600 600 86400 300",
+    "@ IN NS ns1",
+    'txt IN TXT "first" "caf\\195\\169" "\\200\\255"',
+    "alias IN CNAME caf\\195\\169.example.test.",
+    "raw IN CNAME \\200.example.test.",
+]
+
+def test_escaped_octets_are_single_octets():
+    records = {owner: value for owner, _, _, value in DNSMasterFileParser(ZONE)}
+
+    assert records["txt.example.test."] == [b'first', b'caf\xc3\xa9', b'\xc8\xff']
+    assert records["alias.example.test."] == "café.example.test."
+
+def test_txt_character_strings_are_encoded_as_they_are():
+    zone = DNSZone.from_master_file(ZONE)
+    rrset, count = zone.get_answears("txt.example.test", DNSQuestionType.TXT)
+
+    assert count == 1
+    assert rrset.endswith(b'\x05first\x05caf\xc3\xa9\x02\xc8\xff')
+
+def test_escaped_octets_of_names_are_encoded_as_they_are():
+    zone = DNSZone.from_master_file(ZONE)
+    rrset, count = zone.get_answears("raw.example.test", DNSQuestionType.CNAME)
+
+    assert count == 1
+    assert rrset.endswith(b'\x01\xc8\xc0\x10')
@@ -0,0 +1,39 @@
+import struct
+from dns_packet import DNSPacket
+from dns_server import DNSQueryHandler
+from dns_enums import DNSHeaderResponseCode
+from benchmarks.queries import build_query
+
+QUERY = build_query("www.example.com")
+QUESTION = QUERY[12:]
+
+def with_additional(query: bytes, additional_count: int, additional: bytes) -> bytes:
+    return query[:10] + struct.pack('!H', additional_count) + query[12:] + additional
+
+def test_opt_record_is_echoed():
+    # root owner, OPT type, payload size 4096 and the DO bit
+    query = with_additional(QUERY, 1, b'\x00' + struct.pack('!HHIH', 41, 4096, 0x8000, 0))
+    packet = DNSPacket(query)
+
+    assert packet.opt is not None
+    assert packet.build_opt_record() == b'\x00' + struct.pack('!HHIH', 41, 1232, 0x8000, 0)
+
+def test_bogus_additional_count_is_a_format_error():
+    query = with_additional(QUERY, 1, b'')
+    response, response_code = DNSPacket(query).build_response()
+
+    assert response_code == DNSHeaderResponseCode.FORMAT_ERROR
+    assert response[3] & 0x0f == DNSHeaderResponseCode.FORMAT_ERROR.value
+    assert response[12:] == QUESTION
+
+def test_malformed_opt_record_is_answeared():
+    # the OPT record is cut in the middle of its fixed fields
+    query = with_additional(QUERY, 1, b'\x00' + struct.pack('!HH', 41, 4096))
+    replies = []
+
+    assert DNSQueryHandler(None).handle(query, replies.append)
+    assert len(replies) == 1
+    assert replies[0][:2] == query[:2]
+    assert replies[0][3] & 0x0f == DNSHeaderResponseCode.FORMAT_ERROR.value
+    assert struct.unpack_from('!HHHH', replies[0], 4) == (1, 0, 0, 0)
+    assert replies[0][12:] == QUESTION
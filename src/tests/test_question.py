@@ -0,0 +1,38 @@
+import struct
+import pytest
+from dns_question import DNSQuestion
+from dns_server import DNSQueryHandler
+from dns_errors import DNSFormatError
+from benchmarks.queries import build_query
+
+# header of a query with one question and recursion desired
+HEADER = struct.pack('!HHHHHH', 0x1234, 0x0100, 1, 0, 0, 0)
+
+# a label with bytes which are not UTF-8
+NON_UTF8_QUERY = HEADER + b'\x03\xff\xfe\xfd\x07example\x03com\x00' + struct.pack('!HH', 1, 1)
+
+# the second label is longer than the rest of the message
+TRUNCATED_QUERY = HEADER + b'\x03www\x3fexample'
+
+def test_question_fields():
+    question = DNSQuestion(build_query("www.example.com"))
+    assert question.domain == "www.example.com"
+    assert question.raw == b'\x03www\x07example\x03com\x00\x00\x01\x00\x01'
+
+def test_non_utf8_label_is_a_format_error():
+    question = DNSQuestion(NON_UTF8_QUERY)
+    with pytest.raises(DNSFormatError):
+        question.domain
+
+def test_truncated_name_is_a_format_error():
+    with pytest.raises(DNSFormatError):
+        DNSQuestion(TRUNCATED_QUERY)
+
+@pytest.mark.parametrize("query", [NON_UTF8_QUERY, TRUNCATED_QUERY], ids=["non-utf8", "truncated"])
+def test_malformed_query_is_dropped(query: bytes):
+    replies = []
+    handler = DNSQueryHandler(None)
+
+    assert not handler.handle(query, replies.append)
+    assert not handler.handle(query, replies.append, tcp=True)
+    assert replies == []
@@ -0,0 +1,175 @@
+import struct
+import socket
+import asyncio
+import pytest
+from typing import Callable, Sequence
+from dns_resolver import DNSIterativeResolver
+from dns_errors import DNSServerError
+from dns_wire import encode_name, question_end, read_name
+from benchmarks.queries import build_query
+
+A_TYPE = 1
+NS_TYPE = 2
+
+# the stand-ins of the root, the test. TLD and the authoritative servers,
+# all on the same port of different loopback addresses like the real servers on port 53
+ROOT = '127.0.0.1'
+TLD = '127.0.0.2'
+AUTHORITATIVE = '127.0.0.3'
+MALFORMED = '127.0.0.4'
+
+WWW_ADDRESS = bytes([192, 0, 2, 80])
+MAIL_ADDRESS = bytes([192, 0, 2, 25])
+
+def record(name: str, rtype: int, rdata: bytes) -> bytes:
+    return encode_name(name) + struct.pack('!HHIH', rtype, 1, 300, len(rdata)) + rdata
+
+def a_record(name: str, address: str) -> bytes:
+    return record(name, A_TYPE, socket.inet_aton(address))
+
+def respond(
+        query: bytes,
+        answears: Sequence[bytes] = (),
+        authority: Sequence[bytes] = (),
+        additional: Sequence[bytes] = (),
+        response_code: int = 0
+) -> bytes:
+    '''
+    Builds an authoritative response with the ID and question of the query
+    '''
+    flags = 0b1000010000000000 | response_code
+    header = query[:2] + struct.pack('!HHHHH', flags, 1, len(answears), len(authority), len(additional))
+    return header + query[12:question_end(query)] + b''.join((*answears, *authority, *additional))
+
+def referral(query: bytes, zone: str, servers: list[tuple[str, str]]) -> bytes:
+    '''
+    Builds a referral to the zone served by the (name, address) servers, with their glue
+    '''
+    return respond(
+        query,
+        authority=[record(zone, NS_TYPE, encode_name(name)) for name, _ in servers],
+        additional=[a_record(name, address) for name, address in servers]
+    )
+
+def root(query: bytes, name: str) -> bytes:
+    return referral(query, 'test', [('ns.test', TLD)])
+
+def tld(query: bytes, name: str) -> bytes:
+    if name.endswith('broken.test'):
+        return referral(query, 'broken.test', [('ns1.broken.test', MALFORMED), ('ns2.broken.test', AUTHORITATIVE)])
+    return referral(query, 'example.test', [('ns1.example.test', AUTHORITATIVE)])
+
+def authoritative(query: bytes, name: str) -> bytes:
+    if name in ('www.example.test', 'www.broken.test'):
+        return respond(query, [record(name, A_TYPE, WWW_ADDRESS)])
+    if name == 'mail.example.test':
+        return respond(query, [record(name, A_TYPE, MAIL_ADDRESS)])
+    return respond(query, response_code=3)
+
+def undecodable(query: bytes, name: str) -> bytes:
+    # the owner name of the answear is a pointer past the end of the message
+    return respond(query, [b'\xff\xff' + struct.pack('!HHIH', A_TYPE, 1, 300, 4) + WWW_ADDRESS])
+
+def truncated(query: bytes, name: str) -> bytes:
+    # the answear claims more RDATA than the message holds
+    return respond(query, [encode_name(name) + struct.pack('!HHIH', A_TYPE, 1, 300, 16) + WWW_ADDRESS])
+
+class DNSStandInProtocol(asyncio.DatagramProtocol):
+    '''
+    Answears every query with the response built by answear from the query and its name
+    '''
+
+    def __init__(self, answear: Callable[[bytes, str], bytes]):
+        self.answear = answear
+        self.transport = None
+        self.names: list[str] = []
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address: tuple[str, int]):
+        name = read_name(data, 12)
+        self.names.append(name)
+        self.transport.sendto(self.answear(data, name), address)
+
+async def resolve(
+        names: list[str],
+        servers: dict[str, Callable[[bytes, str], bytes]]
+) -> tuple[list[bytes | DNSServerError], dict[str, DNSStandInProtocol]]:
+    '''
+    Resolves the A records of the names one after the other with the stand-in servers
+
+    Returns the response or the error of every name and the stand-ins by address
+    '''
+    loop = asyncio.get_running_loop()
+    stand_ins = {}
+    transports = []
+    port = 0
+    try:
+        for address, answear in servers.items():
+            stand_ins[address] = DNSStandInProtocol(answear)
+            transport, _ = await loop.create_datagram_endpoint(lambda address=address: stand_ins[address], local_addr=(address, port))
+            transports.append(transport)
+            port = transport.get_extra_info('sockname')[1]
+
+        resolver = DNSIterativeResolver([ROOT], port=port, sockets_count=1, timeout=0.5)
+        await resolver.open()
+
+        results = []
+        try:
+            for name in names:
+                try:
+                    results.append(await resolver.query(build_query(name, A_TYPE, query_id=0x2424)))
+                except DNSServerError as error:
+                    results.append(error)
+        finally:
+            resolver.close()
+    finally:
+        for transport in transports:
+            transport.close()
+
+    return results, stand_ins
+
+def answear_address(response: bytes) -> bytes:
+    assert response[:2] == b'\x24\x24'
+    assert response[3] & 0x0f == 0
+    assert struct.unpack_from('!H', response, 6)[0] == 1
+    return response[-4:]
+
+def test_follows_the_referrals():
+    servers = {ROOT: root, TLD: tld, AUTHORITATIVE: authoritative}
+    (response,), stand_ins = asyncio.run(resolve(['www.example.test'], servers))
+
+    assert answear_address(response) == WWW_ADDRESS
+    assert stand_ins[ROOT].names == ['www.example.test']
+    assert stand_ins[TLD].names == ['www.example.test']
+    assert stand_ins[AUTHORITATIVE].names == ['www.example.test']
+
+def test_reuses_the_infrastructure_cache():
+    servers = {ROOT: root, TLD: tld, AUTHORITATIVE: authoritative}
+    (www, mail), stand_ins = asyncio.run(resolve(['www.example.test', 'mail.example.test'], servers))
+
+    assert answear_address(www) == WWW_ADDRESS
+    assert answear_address(mail) == MAIL_ADDRESS
+    # the delegation of example.test is cached, so only its server is asked again
+    assert stand_ins[ROOT].names == ['www.example.test']
+    assert stand_ins[TLD].names == ['www.example.test']
+    assert stand_ins[AUTHORITATIVE].names == ['www.example.test', 'mail.example.test']
+
+@pytest.mark.parametrize("malformed", [undecodable, truncated])
+def test_skips_a_malformed_response(malformed: Callable[[bytes, str], bytes]):
+    servers = {ROOT: root, TLD: tld, AUTHORITATIVE: authoritative, MALFORMED: malformed}
+    (response,), stand_ins = asyncio.run(resolve(['www.broken.test'], servers))
+
+    # the malformed server is asked first, then its answear is given up for the next server
+    assert answear_address(response) == WWW_ADDRESS
+    assert stand_ins[MALFORMED].names == ['www.broken.test']
+    assert stand_ins[AUTHORITATIVE].names == ['www.broken.test']
+
+@pytest.mark.parametrize("malformed", [undecodable, truncated])
+def test_fails_when_every_response_is_malformed(malformed: Callable[[bytes, str], bytes]):
+    servers = {ROOT: root, TLD: tld, AUTHORITATIVE: malformed, MALFORMED: malformed}
+    (error,), _ = asyncio.run(resolve(['www.broken.test'], servers))
+
+    assert isinstance(error, DNSServerError)
+    assert "Malformed response" in error.message
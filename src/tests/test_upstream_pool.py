@@ -0,0 +1,69 @@
+import time
+import asyncio
+from dns_upstream_pool import DNSUpstreamPool
+from dns_metrics import DNSMetrics
+from benchmarks.fake_upstream import FakeUpstreamProtocol
+from benchmarks.queries import build_query
+
+SLOW_ADDRESS = '192.0.2.1'
+FAST_ADDRESS = '192.0.2.2'
+SLOW_DELAY = 0.5
+
+async def start_upstream(address: str, delay: float) -> tuple[asyncio.DatagramTransport, FakeUpstreamProtocol]:
+    protocol = FakeUpstreamProtocol(address, 300, delay, 0.0, 0)
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(lambda: protocol, local_addr=('127.0.0.1', 0))
+    return transport, protocol
+
+async def query_hedged(warm_up: bool) -> tuple[bytes, float, DNSMetrics, FakeUpstreamProtocol]:
+    '''
+    Queries a pool of a slow upstream server, tried first, and a fast one
+    and returns the response, how long it took, the metrics and the fast server
+    '''
+    slow_transport, _ = await start_upstream(SLOW_ADDRESS, SLOW_DELAY)
+    fast_transport, fast = await start_upstream(FAST_ADDRESS, 0.0)
+
+    metrics = DNSMetrics()
+    pool = DNSUpstreamPool(
+        [slow_transport.get_extra_info('sockname'), fast_transport.get_extra_info('sockname')],
+        sockets_count=1,
+        timeout=0.2 if not warm_up else 2.0,
+        retries=0,
+        hedge_percentile=90,
+        metrics=metrics
+    )
+    await pool.open()
+
+    if warm_up:
+        # enough samples for the percentile, the slow server looking the fastest
+        for _ in range(32):
+            pool.stats[0].add_rtt(0.01)
+            pool.stats[1].add_rtt(0.05)
+
+    try:
+        started = time.monotonic()
+        response = await pool.query(build_query("www.example.com", query_id=0x4242))
+        elapsed = time.monotonic() - started
+    finally:
+        pool.close()
+        slow_transport.close()
+        fast_transport.close()
+
+    return response, elapsed, metrics, fast
+
+def test_hedges_after_the_timeout_without_samples():
+    response, elapsed, metrics, fast = asyncio.run(query_hedged(warm_up=False))
+
+    assert response[:2] == b'\x42\x42'
+    assert response.endswith(bytes([192, 0, 2, 2]))
+    assert metrics.hedged == 1
+    assert fast.answered == 1
+    assert elapsed < SLOW_DELAY
+
+def test_hedges_after_the_percentile_of_the_rtts():
+    response, elapsed, metrics, fast = asyncio.run(query_hedged(warm_up=True))
+
+    assert response.endswith(bytes([192, 0, 2, 2]))
+    assert metrics.hedged == 1
+    assert fast.answered == 1
+    # far below the 2 seconds timeout the first query would otherwise wait for
+    assert elapsed < SLOW_DELAY
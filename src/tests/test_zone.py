@@ -0,0 +1,37 @@
+import pytest
+from dns_zone import DNSZone
+from dns_zone_image import write_zone_image, open_zone_image
+from dns_enums import DNSQuestionType
+from dns_errors import DNSFormatError
+
+ZONE = [
+    "$ORIGIN example.test.",
+    "$TTL 300",
+    "@ IN SOA ns1 admin 1 3600 600 86400 300",
+    "@ IN NS ns1",
+    "ns1 IN A 192.0.2.1",
+    "alias IN CNAME ns1",
+    "alias IN MX not-a-preference mail",
+    "www IN A 192.0.2.2",
+]
+
+@pytest.fixture(params=["compiled", "image"])
+def zone(request, tmp_path):
+    zone = DNSZone.from_master_file(ZONE)
+    if request.param == "compiled":
+        return zone
+
+    path = str(tmp_path / "zones.image")
+    write_zone_image([zone], path)
+    return open_zone_image(path)[0]
+
+def test_alias_answears_any_qtype_with_its_cname(zone):
+    _, count = zone.get_answears("alias.example.test", DNSQuestionType.A)
+    assert count == 1
+
+def test_broken_rrset_is_not_replaced_by_the_cname(zone):
+    with pytest.raises(DNSFormatError):
+        zone.get_answears("alias.example.test", DNSQuestionType.MX)
+
+def test_missing_qtype_is_an_empty_answear(zone):
+    assert zone.get_answears("www.example.test", DNSQuestionType.MX) == (b'', 0)